@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# cache.py -- an in-process LRU cache of tournament standings
+#
+
+import collections
+import threading
+
+
+class StandingsCache(object):
+    """A thread-safe LRU cache of playerStandings() results by tournament.
+
+    Writers invalidate a tournament after their transaction commits. Readers
+    take a token() before querying the database and hand it back to put(),
+    which drops the result if the tournament was invalidated in between, so
+    a slow read can never put standings older than a committed write back
+    in the cache.
+
+    Args:
+      maxentries (optional):  the most tournaments kept. Pass 0 to disable
+        caching.
+      maxrows (optional):  the most standings rows kept across all
+        tournaments
+    """
+
+    def __init__(self, maxentries=128, maxrows=100000):
+        self.maxentries = maxentries
+        self.maxrows = maxrows
+        self._entries = collections.OrderedDict()
+        self._rows = 0
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, tournament_id):
+        """Returns a copy of the cached standings, or None on a miss."""
+        with self._lock:
+            standings = self._entries.get(tournament_id)
+            if standings is None:
+                self.misses += 1
+                return None
+            # Mark the entry as the most recently used
+            del self._entries[tournament_id]
+            self._entries[tournament_id] = standings
+            self.hits += 1
+            return list(standings)
+
+    def token(self, tournament_id):
+        """Returns the token a reader passes to put() for this tournament."""
+        with self._lock:
+            return (self._generation, self._versions.get(tournament_id, 0))
+
+    def put(self, tournament_id, standings, token):
+        """Caches standings read after token() was taken.
+
+        Returns:
+          stored:  whether the standings were cached
+        """
+        with self._lock:
+            if token != (self._generation,
+                         self._versions.get(tournament_id, 0)):
+                return False
+            if self.maxentries <= 0 or len(standings) > self.maxrows:
+                return False
+            self._discard(tournament_id)
+            self._entries[tournament_id] = tuple(standings)
+            self._rows += len(standings)
+            while (len(self._entries) > self.maxentries or
+                   self._rows > self.maxrows):
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, tournament_id=0):
+        """Drops a tournament's standings, or every tournament's when 0."""
+        with self._lock:
+            self.invalidations += 1
+            if tournament_id == 0:
+                self._generation += 1
+                self._versions.clear()
+                self._entries.clear()
+                self._rows = 0
+            else:
+                self._versions[tournament_id] = (
+                    self._versions.get(tournament_id, 0) + 1)
+                self._discard(tournament_id)
+
+    def stats(self):
+        """Returns a dict of the cache's counters and current size."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'entries': len(self._entries),
+                    'rows': self._rows}
+
+    def _discard(self, tournament_id):
+        """Removes an entry if present. Needs the lock."""
+        standings = self._entries.pop(tournament_id, None)
+        if standings is not None:
+            self._rows -= len(standings)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# export.py -- writes streamed tournament rows out as CSV or JSON lines
+#
+
+import collections
+import csv
+import json
+
+FORMATS = ('csv', 'jsonl')
+
+# The columns of the rows tournament.py streams
+STANDINGS_COLUMNS = ('id', 'name', 'wins', 'matches', 'omw')
+MATCHES_COLUMNS = ('winner', 'loser')
+PLAYERS_COLUMNS = ('id', 'name')
+
+
+def writeRows(rows, columns, out, format='csv'):
+    """Writes rows to a file one at a time, as they are iterated.
+
+    Args:
+      rows:  an iterable of tuples
+      columns:  the name of each column of the rows
+      out:  a file object open for writing. For CSV on Python 3 open it
+        with newline=''.
+      format (optional):  'csv' for CSV with a header line, or 'jsonl' for
+        one JSON object per line
+
+    Returns:
+      The number of rows written.
+
+    Raises:
+      ValueError:  if the format is unknown
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown export format: %r." % (format,))
+    written = 0
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(collections.OrderedDict(zip(columns, row))))
+            out.write('\n')
+            written += 1
+    return written
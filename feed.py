@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+# feed.py -- standings changes pushed to subscribers instead of polled
+#
+# On PostgreSQL the Standings triggers NOTIFY the 'standings' channel with
+# the players whose standings changed, whichever process changed them. The
+# other backends publish the tournaments their own session changes to a
+# ChangeHub in process. Either way a StandingsFeed reads back only what
+# changed and turns it into per-player deltas.
+#
+
+import collections
+import select
+import threading
+import time
+
+# The channel the Standings triggers notify
+CHANNEL = 'standings'
+
+# A player whose standings or rank changed. Ranks count from 1. old_rank is
+# None for a player new to the standings, and rank is None for one no longer
+# in them, whose wins, matches and omw are then those last seen.
+StandingsDelta = collections.namedtuple(
+    'StandingsDelta', 'id name wins matches omw rank old_rank')
+
+
+class ChangeHub(object):
+    """Passes the ids of changed tournaments to in-process subscribers."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Returns a new Subscription to every later change."""
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def publish(self, tournament_id):
+        """Tells every subscriber a tournament changed (0 for all)."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(tournament_id)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+
+class Subscription(object):
+    """The changes a ChangeHub has published since they were last taken."""
+
+    def __init__(self, hub):
+        self._hub = hub
+        self._changed = []
+        self._cond = threading.Condition()
+
+    def put(self, tournament_id):
+        with self._cond:
+            self._changed.append(tournament_id)
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Returns (tournament_id, None) events, waiting for at least one
+        for up to timeout seconds (forever if None)."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._changed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            changed, self._changed = self._changed, []
+        return [(tournament_id, None) for tournament_id in changed]
+
+    def close(self):
+        self._hub.unsubscribe(self)
+
+
+class Listener(object):
+    """Listens for the Standings triggers' notifications on a connection of
+    its own, which it closes when it is closed.
+
+    Each notification is '<tournament_id> <player_id> ...', or the
+    tournament id alone when too many players changed to list, or '0' when
+    every tournament may have changed.
+    """
+
+    def __init__(self, DB):
+        self._DB = DB
+        DB.autocommit = True
+        c = DB.cursor()
+        c.execute("LISTEN %s;" % CHANNEL)
+        c.close()
+
+    def wait(self, timeout=None):
+        """Returns (tournament_id, player_ids) events, with player_ids None
+        for every player, waiting for at least one for up to timeout seconds
+        (forever if None)."""
+        DB = self._DB
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            DB.poll()
+            if DB.notifies:
+                break
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return []
+            select.select([DB], [], [], remaining)
+        events = []
+        while DB.notifies:
+            ids = [int(i) for i in DB.notifies.pop(0).payload.split()]
+            events.append((ids[0], ids[1:] or None))
+        return events
+
+    def close(self):
+        self._DB.close()
+
+
+class StandingsFeed(object):
+    """Yields the changes to some tournaments' standings as they happen.
+
+    The feed reads the tournaments' standings once, then after each change
+    reads only the players that changed (or, where the source does not say
+    which, the tournament's standings once) and re-ranks them in memory.
+
+    Iterate over the feed for (tournament_id, deltas) tuples, without end,
+    or call poll() to wait a while for them. Close it when done.
+
+    Args:
+      session:  the session to read standings with
+      tournament_ids:  the tournaments to follow
+      source:  a Listener or Subscription, already listening
+
+    Attributes:
+      reads:  the queries the feed has made
+      rows:  the standings rows the feed has read
+    """
+
+    def __init__(self, session, tournament_ids, source):
+        self._session = session
+        self._source = source
+        self.tournament_ids = list(tournament_ids)
+        self.reads = 0
+        self.rows = 0
+        self._standings = dict((t, {}) for t in self.tournament_ids)
+        self._ranks = dict((t, {}) for t in self.tournament_ids)
+        self._refresh(self.tournament_ids)
+
+    def __iter__(self):
+        while True:
+            for change in self.poll():
+                yield change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def poll(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for changes.
+
+        Returns:
+          A list of (tournament_id, deltas) tuples, one for each followed
+          tournament whose standings changed, with a list of StandingsDelta
+          sorted by rank. Empty if nothing changed in time.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changes = self._changes(self._source.wait(timeout))
+            if changes:
+                return changes
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    return []
+
+    def close(self):
+        """Stops listening."""
+        self._source.close()
+
+    def _changes(self, events):
+        """Reads back what events say changed; returns the changes."""
+        whole = set()
+        players = {}
+        for (tournament_id, player_ids) in events:
+            if tournament_id == 0:
+                whole.update(self._standings)
+            elif tournament_id not in self._standings:
+                continue
+            elif player_ids is None:
+                whole.add(tournament_id)
+            else:
+                players.setdefault(tournament_id, set()).update(player_ids)
+        changes = self._refresh(sorted(whole))
+        for (tournament_id, player_ids) in sorted(players.items()):
+            if tournament_id in whole:
+                continue
+            rows = self._session.standingsOf(tournament_id,
+                                             sorted(player_ids))
+            self.reads += 1
+            self.rows += len(rows)
+            standings = dict(self._standings[tournament_id])
+            for player_id in player_ids:
+                standings.pop(player_id, None)
+            standings.update((row[0], row) for row in rows)
+            changes.append(self._apply(tournament_id, standings))
+        return sorted(change for change in changes if change[1])
+
+    def _refresh(self, tournament_ids):
+        """Reads whole tournaments' standings; returns their changes."""
+        if not tournament_ids:
+            return []
+        grouped = self._session.standingsMany(tournament_ids)
+        self.reads += 1
+        changes = []
+        for tournament_id in tournament_ids:
+            rows = grouped[tournament_id]
+            self.rows += len(rows)
+            changes.append(self._apply(
+                tournament_id, dict((row[0], row) for row in rows)))
+        return changes
+
+    def _apply(self, tournament_id, standings):
+        """Replaces a tournament's standings; returns (tournament_id,
+        deltas) for the players whose row or rank changed."""
+        old = self._standings[tournament_id]
+        old_ranks = self._ranks[tournament_id]
+        ordered = sorted(standings.values(),
+                         key=lambda row: (-row[2], -row[4], row[0]))
+        ranks = dict((row[0], rank)
+                     for (rank, row) in enumerate(ordered, 1))
+        deltas = [StandingsDelta(*(row + (ranks[row[0]],
+                                          old_ranks.get(row[0]))))
+                  for row in ordered
+                  if old.get(row[0]) != row or
+                  old_ranks.get(row[0]) != ranks[row[0]]]
+        deltas.extend(StandingsDelta(*(row + (None, old_ranks[player_id])))
+                      for (player_id, row) in sorted(old.items())
+                      if player_id not in standings)
+        self._standings[tournament_id] = standings
+        self._ranks[tournament_id] = ranks
+        return (tournament_id, deltas)
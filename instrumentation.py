@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# instrumentation.py -- opt-in call, statement and row counters for
+# tournament.py
+#
+# Nothing is recorded until enable() is called. While disabled every hook
+# below costs a single check of the module's active Instruments.
+#
+
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('tournament')
+
+_active = None
+_last = None
+
+
+class Instruments(object):
+    """Counters for the instrumented functions, kept per function name.
+
+    Each function's figures include the functions it calls: the SQL run by
+    playerStandings inside swissPairings counts towards both.
+
+    Args:
+      log (optional):  log every instrumented call as a JSON record on the
+        'tournament' logger at INFO level
+    """
+
+    def __init__(self, log=False):
+        self.log = log
+        self._functions = {}
+        self._totals = {'statements': 0, 'rows': 0, 'connections': 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call(self, name, function, *args, **kwargs):
+        """Returns function(*args, **kwargs), recording it under name."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # statements, rows, connections
+        frame = [0, 0, 0]
+        stack.append(frame)
+        started = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            stack.pop()
+            with self._lock:
+                record = self._functions.get(name)
+                if record is None:
+                    record = self._functions[name] = {
+                        'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                        'statements': 0, 'rows': 0, 'connections': 0}
+                record['calls'] += 1
+                record['seconds'] += elapsed
+                record['max_seconds'] = max(record['max_seconds'], elapsed)
+                record['statements'] += frame[0]
+                record['rows'] += frame[1]
+                record['connections'] += frame[2]
+            if self.log:
+                logger.info(json.dumps(
+                    {'function': name, 'seconds': elapsed,
+                     'statements': frame[0], 'rows': frame[1],
+                     'connections': frame[2], 'depth': len(stack)},
+                    sort_keys=True))
+
+    def count(self, index, key, n=1):
+        """Adds n to a counter of every call running on this thread."""
+        for frame in getattr(self._local, 'stack', ()):
+            frame[index] += n
+        with self._lock:
+            self._totals[key] += n
+
+    def stats(self):
+        """Returns the totals and a copy of every function's counters."""
+        with self._lock:
+            stats = dict(self._totals)
+            stats['functions'] = dict((name, dict(record)) for (name, record)
+                                      in self._functions.items())
+        return stats
+
+
+class CountingCursor(object):
+    """Counts the statements a cursor runs and the rows it fetches."""
+
+    def __init__(self, cursor, instruments):
+        self._cursor = cursor
+        self._instruments = instruments
+
+    def execute(self, *args):
+        self._instruments.count(0, 'statements')
+        return self._cursor.execute(*args)
+
+    def executemany(self, *args):
+        self._instruments.count(0, 'statements')
+        return self._cursor.executemany(*args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._instruments.count(1, 'rows')
+        return row
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        self._instruments.count(1, 'rows', len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._instruments.count(1, 'rows', len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def enable(log=False):
+    """Starts recording with a fresh set of Instruments and returns them."""
+    global _active, _last
+    _active = _last = Instruments(log)
+    return _active
+
+
+def disable():
+    """Stops recording. stats() keeps returning what was recorded."""
+    global _active
+    _active = None
+
+
+def stats():
+    """Returns the figures recorded since enable(), or an empty dict."""
+    if _last is None:
+        return {}
+    return _last.stats()
+
+
+def instrumented(function):
+    """Decorates a function so its calls are recorded while enabled."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        instruments = _active
+        if instruments is None:
+            return function(*args, **kwargs)
+        return instruments.call(name, function, *args, **kwargs)
+    return wrapper
+
+
+def call(name, function, *args):
+    """Returns function(*args), recorded under name while enabled."""
+    instruments = _active
+    if instruments is None:
+        return function(*args)
+    return instruments.call(name, function, *args)
+
+
+def cursor(c):
+    """Returns a cursor that is counted while enabled."""
+    instruments = _active
+    if instruments is None:
+        return c
+    return CountingCursor(c, instruments)
+
+
+def connector(factory):
+    """Wraps a connection factory so the connections it opens are counted."""
+    def connect():
+        DB = factory()
+        instruments = _active
+        if instruments is not None:
+            instruments.count(2, 'connections')
+        return DB
+    return connect
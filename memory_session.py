@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+#
+# memory_session.py -- the tournament queries on plain Python dicts
+#
+
+import contextlib
+import threading
+
+import queries
+from cache import StandingsCache
+from feed import ChangeHub, StandingsFeed
+from pairing_state import PairingStates
+from queries import cleanName
+
+
+class MemorySession(object):
+    """Keeps every tournament in process memory, with no database at all.
+
+    A drop-in replacement for session.TournamentSession for tests,
+    simulations and events run without a server. Nothing is persisted.
+    Standings are kept up to date as matches are reported, the same way the
+    Standings table is, so reads only sort them.
+
+    Calls are serialised by a lock and each one is atomic: it checks its
+    arguments before changing anything. A cursor() block holds the lock
+    for its whole length but, unlike a database transaction, is not rolled
+    back if it fails part way.
+
+    Args:
+      cache_entries (optional):  the most tournaments' sorted standings
+        cached. Pass 0 to disable the cache.
+      cache_rows (optional):  the most standings rows cached in total
+      state_entries (optional):  the most tournaments' pairing states kept
+    """
+
+    def __init__(self, cache_entries=128, cache_rows=100000,
+                 state_entries=128):
+        self.cache = StandingsCache(cache_entries, cache_rows)
+        self.states = PairingStates(state_entries)
+        self.changes = ChangeHub()
+        self._lock = threading.RLock()
+        self._players = {0: 'Bye'}
+        self._next_player_id = 1
+        # The id of the player registered under each external id
+        self._external_ids = {}
+        self._tournaments = {}
+        self._next_tournament_id = 1
+        # Per tournament: the (winner, loser) matches in the order they were
+        # reported, the matches of each recorded round, each player's
+        # [wins, losses, omw] and each player's set of opponents.
+        self._matches = {}
+        self._rounds = {}
+        self._standings = {}
+        self._opponents = {}
+        # The final standings of each archived tournament
+        self._archived = {}
+
+    @contextlib.contextmanager
+    def cursor(self):
+        """Holds the session's lock for the length of the block."""
+        with self._lock:
+            yield None
+
+    def close(self):
+        """Does nothing; there are no connections to close."""
+
+    def createTournament(self, name):
+        """Adds a tournament and returns its id."""
+        with self._lock:
+            id_of_new_row = self._next_tournament_id
+            self._next_tournament_id += 1
+            self._tournaments[id_of_new_row] = cleanName(name)
+            self._matches[id_of_new_row] = []
+            self._rounds[id_of_new_row] = {}
+            self._standings[id_of_new_row] = {}
+            self._opponents[id_of_new_row] = {}
+            self._register(id_of_new_row, 0)
+        return id_of_new_row
+
+    def deleteTournaments(self):
+        """Removes all the matches, players, and tournaments."""
+        with self._lock:
+            self._players = {0: 'Bye'}
+            self._external_ids.clear()
+            self._tournaments.clear()
+            self._matches.clear()
+            self._rounds.clear()
+            self._standings.clear()
+            self._opponents.clear()
+            self._archived.clear()
+            self._changed()
+            self.states.discard()
+
+    def deleteMatches(self, tournament_id=0):
+        """Removes the matches of one tournament, or of all when 0."""
+        with self._lock:
+            if tournament_id == 0:
+                tournament_ids = list(self._tournaments)
+            else:
+                tournament_ids = [tournament_id]
+            for t in tournament_ids:
+                if t not in self._tournaments:
+                    continue
+                self._matches[t] = []
+                self._rounds[t] = {}
+                for player_id in self._standings[t]:
+                    self._standings[t][player_id] = [0, 0, 0]
+                    self._opponents[t][player_id] = set()
+            self._changed(tournament_id)
+            self.states.discard(tournament_id)
+
+    def deleteTournament(self, tournament_id):
+        """Removes one tournament with its matches and registrations."""
+        with self._lock:
+            if self._tournaments.pop(tournament_id, None) is None:
+                return
+            for table in (self._matches, self._rounds, self._standings,
+                          self._opponents):
+                del table[tournament_id]
+            self._changed(tournament_id)
+            self.states.discard(tournament_id)
+
+    def archiveTournament(self, tournament_id):
+        """Moves a tournament's final standings into the archive.
+
+        Returns:
+          The number of matches archived.
+
+        Raises:
+          ValueError:  if there is no such tournament
+        """
+        with self._lock:
+            if tournament_id not in self._tournaments:
+                raise ValueError("There is no tournament %d to archive." %
+                                 tournament_id)
+            self._archived[tournament_id] = self.playerStandings(
+                tournament_id)
+            archived = len(self._matches[tournament_id])
+            self.deleteTournament(tournament_id)
+        return archived
+
+    def archivedStandings(self, tournament_id):
+        """Returns an archived tournament's final playerStandings()."""
+        with self._lock:
+            return list(self._archived.get(tournament_id, ()))
+
+    def deletePlayers(self):
+        """Removes all the player records except for 'Bye'.
+
+        Raises:
+          ValueError:  if any player has matches recorded, as the foreign
+            keys on the Matches table would in the database
+        """
+        with self._lock:
+            if any(self._matches.values()):
+                raise ValueError("Players with matches cannot be deleted.")
+            self._players = {0: 'Bye'}
+            self._external_ids.clear()
+            for t in self._tournaments:
+                self._standings[t] = {}
+                self._opponents[t] = {}
+                # Keep 'Bye' registered so byes can still be reported.
+                self._register(t, 0)
+            self._changed()
+
+    def countPlayers(self, tournament_id=0):
+        """Returns the number of players in a tournament, or in all when 0."""
+        with self._lock:
+            if tournament_id == 0:
+                return len(self._players) - 1
+            standings = self._standings.get(tournament_id, {})
+            return len(standings) - (0 in standings)
+
+    def registerPlayer(self, tournament_id, name, external_id=None):
+        """Adds a player to a tournament and returns the player's id, which
+        is that of the player already registered under external_id if
+        there is one."""
+        return self.registerPlayers(tournament_id, [name], [external_id])[0]
+
+    def registerPlayers(self, tournament_id, names, external_ids=None):
+        """Adds many players to a tournament; returns their ids in order.
+
+        Names with an external id are linked to the player already
+        registered under it, if there is one.
+
+        Raises:
+          ValueError:  if a linked player is already in the tournament, as
+            the Tournaments_Players primary key would in the database
+        """
+        external_ids = queries.externalIds(names, external_ids)
+        if not names:
+            return []
+        names = [cleanName(name) for name in names]
+        with self._lock:
+            self._checkTournament(tournament_id)
+            for external_id in external_ids:
+                if (self._external_ids.get(external_id)
+                        in self._standings[tournament_id]):
+                    raise ValueError(
+                        "Player %r is already registered in tournament %s." %
+                        (external_id, tournament_id))
+            ids = []
+            for (name, external_id) in zip(names, external_ids):
+                player_id = self._external_ids.get(external_id)
+                if player_id is None:
+                    player_id = self._next_player_id
+                    self._next_player_id += 1
+                    if external_id is not None:
+                        self._external_ids[external_id] = player_id
+                self._players[player_id] = name
+                self._register(tournament_id, player_id)
+                ids.append(player_id)
+            self._changed(tournament_id)
+        return ids
+
+    def findPlayers(self, external_ids):
+        """Returns a dict of (id, name) by external id for the players
+        registered under any of external_ids."""
+        with self._lock:
+            return dict((e, (self._external_ids[e],
+                             str(self._players[self._external_ids[e]])))
+                        for e in external_ids if e in self._external_ids)
+
+    def playerHistory(self, player_id):
+        """Returns (tournament_id, wins, matches, OMWs) tuples, by tournament
+        id, for every live and archived tournament a player is in."""
+        history = []
+        with self._lock:
+            for (t, standings) in self._standings.items():
+                if player_id in standings:
+                    wins, losses, omw = standings[player_id]
+                    history.append((t, wins, wins + losses, omw))
+            for (t, standings) in self._archived.items():
+                history.extend((t, row[2], row[3], row[4])
+                               for row in standings if row[0] == player_id)
+        return sorted(history)
+
+    def playerStandings(self, tournament_id):
+        """Returns (id, name, wins, matches, OMWs) tuples sorted by wins."""
+        with self._lock:
+            standings = self.cache.get(tournament_id)
+            if standings is not None:
+                return standings
+            token = self.cache.token(tournament_id)
+            standings = [
+                (player_id, str(self._players[player_id]), wins,
+                 wins + losses, omw)
+                for (player_id, (wins, losses, omw))
+                in self._standings.get(tournament_id, {}).items()
+                if player_id != 0]
+            standings.sort(key=lambda row: (-row[2], -row[4], row[0]))
+            self.cache.put(tournament_id, standings, token)
+        return standings
+
+    def iterStandings(self, tournament_id, fetch_size=1000):
+        """Iterates over playerStandings(). The standings are already held
+        in memory, so fetch_size is not used."""
+        return iter(self.playerStandings(tournament_id))
+
+    def iterPlayers(self, tournament_id, fetch_size=1000, external_ids=False):
+        """Iterates over the (id, name) of every player in a tournament by
+        id, or (id, name, external_id) with external_ids."""
+        with self._lock:
+            players = [(player_id, str(self._players[player_id]))
+                       for player_id in sorted(self._standings.get(
+                           tournament_id, ()))
+                       if player_id != 0]
+            if external_ids:
+                linked = dict((player_id, external_id) for
+                              (external_id, player_id) in
+                              self._external_ids.items())
+                players = [(player_id, name, linked.get(player_id))
+                           for (player_id, name) in players]
+        return iter(players)
+
+    def standingsMany(self, tournament_ids):
+        """Returns a dict of playerStandings() lists by tournament id."""
+        with self._lock:
+            return dict((t, self.playerStandings(t)) for t in tournament_ids)
+
+    def standingsFeed(self, tournament_ids):
+        """Returns a StandingsFeed of tournaments, fed the changes made
+        through this session."""
+        return StandingsFeed(self, tournament_ids, self.changes.subscribe())
+
+    def rebuildStandings(self, tournament_id=0):
+        """Recomputes the standings from the matches.
+
+        Returns a list of the (tournament_id, player_id) rows that were out
+        of date.
+        """
+        stale = []
+        with self._lock:
+            if tournament_id == 0:
+                tournament_ids = sorted(self._tournaments)
+            else:
+                tournament_ids = [tournament_id]
+            for t in tournament_ids:
+                if t not in self._tournaments:
+                    continue
+                standings = dict((player_id, [0, 0, 0])
+                                 for player_id in self._standings[t])
+                opponents = dict((player_id, set())
+                                 for player_id in self._standings[t])
+                for (winner, loser) in self._matches[t]:
+                    standings[winner][0] += 1
+                    standings[loser][1] += 1
+                    opponents[winner].add(loser)
+                    opponents[loser].add(winner)
+                for (player_id, row) in standings.items():
+                    row[2] = sum(standings[o][0] for o in opponents[player_id])
+                    if row != self._standings[t][player_id]:
+                        stale.append((t, player_id))
+                self._standings[t] = standings
+                self._opponents[t] = opponents
+            if stale:
+                self._changed(tournament_id)
+        return sorted(stale)
+
+    def reportMatch(self, tournament_id, winner, loser):
+        """Records the outcome of a single match between two players."""
+        self.reportMatches(tournament_id, [(winner, loser)])
+
+    def getMatches(self, tournament_id):
+        """Returns (winner, loser) tuples for every match in a tournament."""
+        with self._lock:
+            return list(self._matches.get(tournament_id, ()))
+
+    def iterMatches(self, tournament_id, fetch_size=1000):
+        """Iterates over getMatches()."""
+        return iter(self.getMatches(tournament_id))
+
+    def matchesSince(self, tournament_id, last_id):
+        """Returns the (id, winner, loser) of a tournament's matches after
+        last_id and the number of matches it has. A match's id is its
+        position in the order matches were reported, counting from 1."""
+        with self._lock:
+            matches = self._matches.get(tournament_id, [])
+            rows = [(i + 1, winner, loser) for (i, (winner, loser))
+                    in enumerate(matches[last_id:], last_id)]
+            return rows, len(matches)
+
+    @contextlib.contextmanager
+    def pairingState(self, tournament_id):
+        """Yields the tournament's pairing_state.PairingState, caught up with
+        its latest matches.
+
+        The session's lock is taken before the state, as every caller takes
+        them, so that two threads never wait on each other.
+        """
+        with self._lock:
+            with self.states.state(tournament_id,
+                                   self.matchesSince) as state:
+                yield state
+
+    def checkPairingState(self, tournament_id):
+        """Rebuilds a tournament's pairing state from its matches and
+        returns how the kept state differed."""
+        with self._lock:
+            return self.states.check(tournament_id, self.matchesSince)
+
+    def matchesMany(self, tournament_ids):
+        """Returns a dict of getMatches() lists by tournament id."""
+        with self._lock:
+            return dict((t, self.getMatches(t)) for t in tournament_ids)
+
+    def reportMatchesMany(self, results):
+        """Records (tournament_id, winner, loser) results across any number
+        of tournaments, checking them all before recording any."""
+        by_tournament = {}
+        for (tournament_id, winner, loser) in results:
+            by_tournament.setdefault(tournament_id, []).append((winner, loser))
+        with self._lock:
+            for (tournament_id, matches) in by_tournament.items():
+                self._checkTournament(tournament_id)
+                standings = self._standings[tournament_id]
+                for (winner, loser) in matches:
+                    if winner not in standings or loser not in standings:
+                        raise ValueError(
+                            "Players %s and %s are not both registered in "
+                            "tournament %s." % (winner, loser, tournament_id))
+            for (tournament_id, matches) in by_tournament.items():
+                self.reportMatches(tournament_id, matches)
+
+    def reportMatches(self, tournament_id, results):
+        """Records many (winner, loser) results in one transaction.
+
+        Raises:
+          ValueError:  if a player is not registered in the tournament
+        """
+        if not results:
+            return
+        with self._lock:
+            self._checkTournament(tournament_id)
+            standings = self._standings[tournament_id]
+            for (winner, loser) in results:
+                if winner not in standings or loser not in standings:
+                    raise ValueError(
+                        "Players %s and %s are not both registered in "
+                        "tournament %s." % (winner, loser, tournament_id))
+            opponents = self._opponents[tournament_id]
+            for (winner, loser) in results:
+                # As in t_StandingsMatchInsert: a first meeting adds each
+                # player's wins to the other's OMW, and the winner's extra
+                # win raises the OMW of each of their opponents.
+                if loser not in opponents[winner]:
+                    opponents[winner].add(loser)
+                    opponents[loser].add(winner)
+                    standings[winner][2] += standings[loser][0]
+                    standings[loser][2] += standings[winner][0]
+                standings[winner][0] += 1
+                standings[loser][1] += 1
+                for player_id in opponents[winner]:
+                    standings[player_id][2] += 1
+                self._matches[tournament_id].append((winner, loser))
+            self._changed(tournament_id)
+
+    def lastRound(self, tournament_id):
+        """Returns the number of the last round recorded, or 0."""
+        with self._lock:
+            return max(self._rounds.get(tournament_id) or [0])
+
+    def recordRound(self, tournament_id, number, matches, matches_seen):
+        """Records a round's (winner, loser) matches all at once.
+
+        Returns:
+          recorded:  False if exactly these matches were already recorded as
+            this round, and True otherwise
+
+        Raises:
+          ValueError:  if the round was recorded with other matches, the
+            tournament no longer has matches_seen matches or a player is
+            not registered in it
+        """
+        with self._lock:
+            self._checkTournament(tournament_id)
+            recorded = self._rounds[tournament_id].get(number)
+            if recorded:
+                if sorted(recorded) == sorted(matches):
+                    return False
+                raise ValueError(
+                    "Round %d of tournament %d has already been recorded." %
+                    (number, tournament_id))
+            if len(self._matches[tournament_id]) != matches_seen:
+                raise ValueError(
+                    "Tournament %d has changed since round %d was paired." %
+                    (tournament_id, number))
+            if matches:
+                self.reportMatches(tournament_id, matches)
+                self._rounds[tournament_id][number] = list(matches)
+        return True
+
+    def numberOfMatchesPlayed(self, tournament_id, player1_id, player2_id):
+        """Returns the number of matches two players have played."""
+        pair = set([player1_id, player2_id])
+        with self._lock:
+            return sum(1 for match in self._matches.get(tournament_id, ())
+                       if set(match) == pair)
+
+    def hasBye(self, tournament_id, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        with self._lock:
+            return (player_id, 0) in self._matches.get(tournament_id, ())
+
+    def getOpponentMatchWins(self, tournament_id, player_id):
+        """Returns the total number of wins of all of a player's opponents."""
+        with self._lock:
+            standings = self._standings.get(tournament_id, {})
+            opponents = self._opponents.get(tournament_id, {})
+            return sum(standings[o][0] for o in opponents.get(player_id, ()))
+
+    def _changed(self, tournament_id=0):
+        """Drops a tournament's cached standings (every tournament's when 0)
+        and publishes the change. Needs the lock."""
+        self.cache.invalidate(tournament_id)
+        self.changes.publish(tournament_id)
+
+    def _register(self, tournament_id, player_id):
+        """Gives a player an empty standings row. Needs the lock."""
+        self._standings[tournament_id][player_id] = [0, 0, 0]
+        self._opponents[tournament_id][player_id] = set()
+
+    def _checkTournament(self, tournament_id):
+        """Raises ValueError for an unknown tournament. Needs the lock."""
+        if tournament_id not in self._tournaments:
+            raise ValueError("No tournament with id %s." % (tournament_id,))
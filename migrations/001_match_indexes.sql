@@ -0,0 +1,49 @@
+-- Migration 001: index Matches by tournament and scope v_WinsAndLosses.
+--
+-- Brings a database created from an older tournament.sql up to date:
+--
+--   psql -d tournament -f migrations/001_match_indexes.sql
+--
+-- The old v_WinsAndLosses joined every match ever played before filtering
+-- by tournament, and counted a player's matches from other tournaments.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS Matches_tournament_winner_idx
+    ON Matches (tournament_id, winner);
+CREATE INDEX IF NOT EXISTS Matches_tournament_loser_idx
+    ON Matches (tournament_id, loser);
+
+DROP VIEW IF EXISTS v_WinsAndLosses;
+
+-- Create a view that returns tournament_id, id, name, wins, and losses for each player
+-- Only the matches of the player's own tournament are counted, so filtering
+-- on tournament_id reads that tournament's rows and nothing else.
+CREATE VIEW v_WinsAndLosses AS
+    SELECT tp.tournament_id, p.id, p.name,
+        (SELECT COUNT(*) FROM Matches m
+         WHERE m.tournament_id = tp.tournament_id AND m.winner = p.id) AS wins,
+        (SELECT COUNT(*) FROM Matches m
+         WHERE m.tournament_id = tp.tournament_id AND m.loser = p.id) AS losses
+    FROM Tournaments_Players tp INNER JOIN Players p ON p.id = tp.player_id
+    WHERE p.id <> 0;
+
+-- Create a function that returns id, name, wins, and losses for each player
+-- in one tournament, aggregating only that tournament's matches
+CREATE OR REPLACE FUNCTION f_WinsAndLosses(integer)
+RETURNS TABLE (id integer, name text, wins bigint, losses bigint) AS $$
+    SELECT p.id, p.name, COALESCE(w.wins, 0), COALESCE(l.losses, 0)
+    FROM Tournaments_Players tp
+    INNER JOIN Players p ON p.id = tp.player_id
+    LEFT JOIN (
+        SELECT winner, COUNT(*) AS wins FROM Matches
+        WHERE tournament_id = $1 GROUP BY winner
+    ) w ON w.winner = p.id
+    LEFT JOIN (
+        SELECT loser, COUNT(*) AS losses FROM Matches
+        WHERE tournament_id = $1 GROUP BY loser
+    ) l ON l.loser = p.id
+    WHERE tp.tournament_id = $1 AND p.id <> 0;
+$$ LANGUAGE sql STABLE;
+
+COMMIT;
@@ -0,0 +1,129 @@
+-- Migration 002: the Standings table and the triggers that maintain it.
+--
+--   psql -d tournament -f migrations/002_standings.sql
+--
+-- Creates the table, fills it from the existing Matches with
+-- f_RebuildStandings(0), and from then on keeps it up to date as players
+-- are registered and matches reported.
+
+BEGIN;
+-- Create the standings table, which holds each player's wins, losses and
+-- opponent match wins and is kept up to date as matches are reported
+CREATE TABLE Standings (
+    tournament_id integer,
+    player_id integer,
+    wins integer NOT NULL DEFAULT 0,
+    losses integer NOT NULL DEFAULT 0,
+    omw integer NOT NULL DEFAULT 0,
+    primary key (tournament_id, player_id),
+    foreign key (tournament_id, player_id)
+        references Tournaments_Players (tournament_id, player_id)
+        ON DELETE CASCADE
+);
+
+CREATE INDEX Standings_order_idx
+    ON Standings (tournament_id, wins DESC, omw DESC, player_id);
+
+-- Give every player registered in a tournament an empty standings row
+CREATE FUNCTION f_StandingsPlayerInsert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO Standings (tournament_id, player_id)
+    VALUES (NEW.tournament_id, NEW.player_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsPlayerInsert
+    AFTER INSERT ON Tournaments_Players
+    FOR EACH ROW EXECUTE PROCEDURE f_StandingsPlayerInsert();
+
+-- Update the standings for a newly reported match. The winner's extra win
+-- raises the OMW of each of their distinct opponents by one, and the first
+-- match between two players adds each one's wins to the other's OMW.
+CREATE FUNCTION f_StandingsMatchInsert() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND id <> NEW.id
+        AND ((winner = NEW.winner AND loser = NEW.loser)
+             OR (winner = NEW.loser AND loser = NEW.winner))
+    ) THEN
+        UPDATE Standings s SET omw = s.omw + o.wins
+        FROM Standings o
+        WHERE s.tournament_id = NEW.tournament_id
+        AND o.tournament_id = NEW.tournament_id
+        AND ((s.player_id = NEW.winner AND o.player_id = NEW.loser)
+             OR (s.player_id = NEW.loser AND o.player_id = NEW.winner));
+    END IF;
+    UPDATE Standings SET wins = wins + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id = NEW.winner;
+    UPDATE Standings SET losses = losses + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id = NEW.loser;
+    UPDATE Standings SET omw = omw + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id IN (
+        SELECT loser FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND winner = NEW.winner
+        UNION
+        SELECT winner FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND loser = NEW.winner
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsMatchInsert
+    AFTER INSERT ON Matches
+    FOR EACH ROW EXECUTE PROCEDURE f_StandingsMatchInsert();
+
+-- Recompute the standings of one tournament (or of all when passed 0) from
+-- the Matches table. Returns the rows that were out of date.
+CREATE FUNCTION f_RebuildStandings(integer)
+RETURNS TABLE (tournament_id integer, player_id integer) AS $$
+    INSERT INTO Standings (tournament_id, player_id)
+    SELECT tp.tournament_id, tp.player_id FROM Tournaments_Players tp
+    WHERE ($1 = 0 OR tp.tournament_id = $1) AND NOT EXISTS (
+        SELECT 1 FROM Standings s
+        WHERE s.tournament_id = tp.tournament_id
+        AND s.player_id = tp.player_id
+    );
+    WITH m AS (
+        SELECT tournament_id, winner, loser FROM Matches
+        WHERE $1 = 0 OR tournament_id = $1
+    ), w AS (
+        SELECT tournament_id, winner AS id, COUNT(*) AS wins
+        FROM m GROUP BY tournament_id, winner
+    ), l AS (
+        SELECT tournament_id, loser AS id, COUNT(*) AS losses
+        FROM m GROUP BY tournament_id, loser
+    ), o AS (
+        SELECT tournament_id, winner AS id, loser AS opponent FROM m
+        UNION
+        SELECT tournament_id, loser, winner FROM m
+    ), omw AS (
+        SELECT o.tournament_id, o.id, SUM(w.wins) AS omw
+        FROM o JOIN w ON w.tournament_id = o.tournament_id
+        AND w.id = o.opponent
+        GROUP BY o.tournament_id, o.id
+    ), r AS (
+        SELECT s.tournament_id, s.player_id,
+            COALESCE(w.wins, 0) AS wins, COALESCE(l.losses, 0) AS losses,
+            COALESCE(omw.omw, 0) AS omw
+        FROM Standings s
+        LEFT JOIN w ON w.tournament_id = s.tournament_id
+            AND w.id = s.player_id
+        LEFT JOIN l ON l.tournament_id = s.tournament_id
+            AND l.id = s.player_id
+        LEFT JOIN omw ON omw.tournament_id = s.tournament_id
+            AND omw.id = s.player_id
+        WHERE $1 = 0 OR s.tournament_id = $1
+    )
+    UPDATE Standings s SET wins = r.wins, losses = r.losses, omw = r.omw
+    FROM r
+    WHERE s.tournament_id = r.tournament_id AND s.player_id = r.player_id
+    AND (s.wins, s.losses, s.omw) IS DISTINCT FROM (r.wins, r.losses, r.omw)
+    RETURNING s.tournament_id, s.player_id;
+$$ LANGUAGE sql;
+
+SELECT COUNT(*) AS rebuilt FROM f_RebuildStandings(0);
+
+COMMIT;
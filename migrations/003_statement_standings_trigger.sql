@@ -0,0 +1,66 @@
+-- Migration 003: maintain Standings once per INSERT statement on Matches.
+--
+--   psql -d tournament -f migrations/003_statement_standings_trigger.sql
+--
+-- The row-level trigger from migration 002 re-planned its lookups for
+-- every row of a multi-row insert. The statement-level trigger keeps the
+-- incremental update for single matches and rebuilds a batch's
+-- tournaments in one set-based pass. Transition tables need PostgreSQL 10.
+
+BEGIN;
+
+DROP TRIGGER IF EXISTS t_StandingsMatchInsert ON Matches;
+
+-- Update the standings for newly reported matches. For a single match the
+-- winner's extra win raises the OMW of each of their distinct opponents by
+-- one, and the first match between two players adds each one's wins to the
+-- other's OMW. A batch of matches rebuilds its tournaments' standings.
+CREATE OR REPLACE FUNCTION f_StandingsMatchInsert() RETURNS trigger AS $$
+DECLARE
+    m Matches%ROWTYPE;
+    n integer;
+BEGIN
+    SELECT COUNT(*) INTO n FROM new_matches;
+    IF n > 1 THEN
+        PERFORM f_RebuildStandings(t.tournament_id)
+        FROM (SELECT DISTINCT tournament_id FROM new_matches) t;
+        RETURN NULL;
+    ELSIF n = 0 THEN
+        RETURN NULL;
+    END IF;
+    SELECT * INTO m FROM new_matches;
+    IF NOT EXISTS (
+        SELECT 1 FROM Matches
+        WHERE tournament_id = m.tournament_id AND id <> m.id
+        AND ((winner = m.winner AND loser = m.loser)
+             OR (winner = m.loser AND loser = m.winner))
+    ) THEN
+        UPDATE Standings s SET omw = s.omw + o.wins
+        FROM Standings o
+        WHERE s.tournament_id = m.tournament_id
+        AND o.tournament_id = m.tournament_id
+        AND ((s.player_id = m.winner AND o.player_id = m.loser)
+             OR (s.player_id = m.loser AND o.player_id = m.winner));
+    END IF;
+    UPDATE Standings SET wins = wins + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.winner;
+    UPDATE Standings SET losses = losses + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.loser;
+    UPDATE Standings SET omw = omw + 1
+    WHERE tournament_id = m.tournament_id AND player_id IN (
+        SELECT loser FROM Matches
+        WHERE tournament_id = m.tournament_id AND winner = m.winner
+        UNION
+        SELECT winner FROM Matches
+        WHERE tournament_id = m.tournament_id AND loser = m.winner
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsMatchInsert
+    AFTER INSERT ON Matches
+    REFERENCING NEW TABLE AS new_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsMatchInsert();
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Migration 004: record the round of the matches written by closeRound().
+--
+--   psql -d tournament -f migrations/004_match_rounds.sql
+--
+-- Existing matches keep a NULL round, as do matches reported one at a time.
+
+BEGIN;
+
+ALTER TABLE Matches ADD COLUMN IF NOT EXISTS round integer;
+
+CREATE INDEX IF NOT EXISTS Matches_tournament_round_idx
+    ON Matches (tournament_id, round);
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- Migration 005: index each tournament's matches in the order they were
+-- recorded, so that pairing reads only the matches since its last round.
+--
+--   psql -d tournament -f migrations/005_match_order_index.sql
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS Matches_tournament_id_idx
+    ON Matches (tournament_id, id);
+
+COMMIT;
@@ -0,0 +1,36 @@
+-- Migration 006: archive tables for archiveTournament().
+--
+--   psql -d tournament -f migrations/006_archive_tables.sql
+--
+-- Archived tournaments are moved out of Matches, Standings and
+-- Tournaments_Players so that those tables stay small.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS Archived_Tournaments (
+    id integer primary key,
+    name text
+);
+
+CREATE TABLE IF NOT EXISTS Archived_Standings (
+    tournament_id integer,
+    player_id integer,
+    name text,
+    wins integer NOT NULL,
+    losses integer NOT NULL,
+    omw integer NOT NULL,
+    primary key (tournament_id, player_id)
+);
+
+CREATE TABLE IF NOT EXISTS Archived_Matches (
+    id integer primary key,
+    tournament_id integer,
+    round integer,
+    winner integer,
+    loser integer
+);
+
+CREATE INDEX IF NOT EXISTS Archived_Matches_tournament_idx
+    ON Archived_Matches (tournament_id, id);
+
+COMMIT;
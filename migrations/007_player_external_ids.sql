@@ -0,0 +1,21 @@
+-- Migration 007: external player identifiers and per-player indexes.
+--
+--   psql -d tournament -f migrations/007_player_external_ids.sql
+--
+-- Registrations that carry an external identifier link to the player
+-- already registered under it rather than adding a new Players row, and
+-- playerHistory() reads a player's standings by index.
+
+BEGIN;
+
+ALTER TABLE Players ADD COLUMN IF NOT EXISTS external_id text;
+
+CREATE UNIQUE INDEX IF NOT EXISTS Players_external_id_idx
+    ON Players (external_id);
+
+CREATE INDEX IF NOT EXISTS Standings_player_idx ON Standings (player_id);
+
+CREATE INDEX IF NOT EXISTS Archived_Standings_player_idx
+    ON Archived_Standings (player_id);
+
+COMMIT;
@@ -0,0 +1,53 @@
+-- Migration 008: notify the 'standings' channel as standings change.
+--
+--   psql -d tournament -f migrations/008_standings_notify.sql
+--
+-- StandingsFeed listens on the channel so that displays are sent the
+-- players whose standings changed instead of polling playerStandings().
+
+BEGIN;
+
+-- Tell the listeners on the 'standings' channel whose standings changed, as
+-- '<tournament_id> <player_id> ...', or as the tournament id alone when too
+-- many players changed to list. TRUNCATE sends '0', for every tournament.
+-- Notifications are only delivered when the transaction commits.
+CREATE OR REPLACE FUNCTION f_StandingsNotify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('standings', '0');
+    ELSE
+        PERFORM pg_notify('standings', c.tournament_id || CASE
+            WHEN COUNT(*) <= 500 THEN
+                ' ' || string_agg(c.player_id::text, ' '
+                                  ORDER BY c.player_id)
+            ELSE '' END)
+        FROM changed c GROUP BY c.tournament_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS t_StandingsNotifyInsert ON Standings;
+CREATE TRIGGER t_StandingsNotifyInsert
+    AFTER INSERT ON Standings
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+DROP TRIGGER IF EXISTS t_StandingsNotifyUpdate ON Standings;
+CREATE TRIGGER t_StandingsNotifyUpdate
+    AFTER UPDATE ON Standings
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+DROP TRIGGER IF EXISTS t_StandingsNotifyDelete ON Standings;
+CREATE TRIGGER t_StandingsNotifyDelete
+    AFTER DELETE ON Standings
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+DROP TRIGGER IF EXISTS t_StandingsNotifyTruncate ON Standings;
+CREATE TRIGGER t_StandingsNotifyTruncate
+    AFTER TRUNCATE ON Standings
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+COMMIT;
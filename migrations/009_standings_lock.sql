@@ -0,0 +1,67 @@
+-- Migration 009: lock a tournament while its standings are updated.
+--
+--   psql -d tournament -f migrations/009_standings_lock.sql
+--
+-- Two matches reported at the same time in one tournament each updated the
+-- standings from a snapshot that could not see the other, which could lose
+-- OMW increments or deadlock on the Standings rows. The trigger now locks
+-- the tournaments first.
+
+BEGIN;
+
+-- Update the standings for newly reported matches. For a single match the
+-- winner's extra win raises the OMW of each of their distinct opponents by
+-- one, and the first match between two players adds each one's wins to the
+-- other's OMW. A batch of matches rebuilds its tournaments' standings.
+--
+-- The tournaments are locked first, so matches reported at the same time
+-- update the standings one after another, each reading the last one's
+-- results. NO KEY UPDATE does not wait for the KEY SHARE lock the foreign
+-- key check of every other insert holds on the tournament.
+CREATE OR REPLACE FUNCTION f_StandingsMatchInsert() RETURNS trigger AS $$
+DECLARE
+    m Matches%ROWTYPE;
+    n integer;
+BEGIN
+    PERFORM 1 FROM Tournaments
+    WHERE id IN (SELECT tournament_id FROM new_matches)
+    ORDER BY id FOR NO KEY UPDATE;
+    SELECT COUNT(*) INTO n FROM new_matches;
+    IF n > 1 THEN
+        PERFORM f_RebuildStandings(t.tournament_id)
+        FROM (SELECT DISTINCT tournament_id FROM new_matches) t;
+        RETURN NULL;
+    ELSIF n = 0 THEN
+        RETURN NULL;
+    END IF;
+    SELECT * INTO m FROM new_matches;
+    IF NOT EXISTS (
+        SELECT 1 FROM Matches
+        WHERE tournament_id = m.tournament_id AND id <> m.id
+        AND ((winner = m.winner AND loser = m.loser)
+             OR (winner = m.loser AND loser = m.winner))
+    ) THEN
+        UPDATE Standings s SET omw = s.omw + o.wins
+        FROM Standings o
+        WHERE s.tournament_id = m.tournament_id
+        AND o.tournament_id = m.tournament_id
+        AND ((s.player_id = m.winner AND o.player_id = m.loser)
+             OR (s.player_id = m.loser AND o.player_id = m.winner));
+    END IF;
+    UPDATE Standings SET wins = wins + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.winner;
+    UPDATE Standings SET losses = losses + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.loser;
+    UPDATE Standings SET omw = omw + 1
+    WHERE tournament_id = m.tournament_id AND player_id IN (
+        SELECT loser FROM Matches
+        WHERE tournament_id = m.tournament_id AND winner = m.winner
+        UNION
+        SELECT winner FROM Matches
+        WHERE tournament_id = m.tournament_id AND loser = m.winner
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
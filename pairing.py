@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# pairing.py -- Swiss pairing over a tournament's match history in memory
+#
+
+import utils
+from matching import maxWeightMatching
+
+
+class MatchGraph(object):
+    """The opponents and byes of every player in one tournament.
+
+    Built once from the tournament's matches so that rematch and bye checks
+    during pairing are set lookups instead of database queries.
+
+    Args:
+      matches (optional):  an iterable of (winner, loser) tuples
+    """
+
+    def __init__(self, matches=()):
+        self.opponents = {}
+        self.byes = set()
+        for (winner, loser) in matches:
+            self.addMatch(winner, loser)
+
+    def addMatch(self, winner, loser):
+        """Records a match. A loser of 0 records a 'Bye' for the winner."""
+        if loser == 0:
+            self.byes.add(winner)
+            return
+        self.opponents.setdefault(winner, set()).add(loser)
+        self.opponents.setdefault(loser, set()).add(winner)
+
+    def havePlayed(self, player1_id, player2_id):
+        """Returns true/false if the two players have played each other."""
+        return player2_id in self.opponents.get(player1_id, ())
+
+    def hasBye(self, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        return player_id in self.byes
+
+    def copy(self):
+        """Returns a MatchGraph that later matches added to either one do
+        not change."""
+        graph = MatchGraph()
+        graph.opponents = dict((player_id, set(opponents)) for
+                               (player_id, opponents) in
+                               self.opponents.items())
+        graph.byes = set(self.byes)
+        return graph
+
+
+def chooseBye(pool, graph):
+    """Returns the PlayerRecord of the player who should get a 'Bye'.
+
+    Args:
+      pool:  a utils.StandingsPool of the players to pair
+      graph:  the tournament's MatchGraph
+
+    Returns:
+      The first player in the standings who has not had a 'Bye', or None if
+      every player has had one.
+    """
+    for player in pool:
+        if not graph.hasBye(player.id):
+            return player
+    return None
+
+
+def greedyPairings(pool, graph):
+    """Pairs each player with the next player down they have not played.
+
+    Args:
+      pool:  a utils.StandingsPool of the players to pair, without the
+        player who has the 'Bye'. The pool is emptied as players are paired.
+      graph:  the tournament's MatchGraph
+
+    Returns:
+      A list of [id1, name1, id2, name2] pairs. A player left with only
+      rematches below them in the standings is not paired.
+    """
+    pairings = []
+    # Loop over the pool while it's populated
+    while len(pool) > 0:
+        # Take the first player out of the pool
+        first_player = pool.popFirst()
+        # Iterate through the rest of the pool
+        for player in pool:
+            #  If the first player has not played the current player
+            if not graph.havePlayed(first_player.id, player.id):
+                # Then we have our pair. Add them to the list.
+                pairings.append([first_player.id, str(first_player.name),
+                                player.id, str(player.name)])
+                # And take the current player out of the pool.
+                pool.remove(player.id)
+                break
+    return pairings
+
+
+def matchingPairings(pool, graph, window=8):
+    """Pairs the field with a maximum weight matching of non-rematch pairs.
+
+    Every pair of players who have not played is an edge, weighted so that
+    the matching first minimises the summed squared difference in wins and
+    then the summed distance apart in the standings, which keeps pairs
+    adjacent as greedyPairings does. Unlike greedyPairings it never strands
+    a player when a full pairing without rematches exists.
+
+    To keep large fields fast each player is first only joined to the next
+    window players down the standings. The window doubles until everyone is
+    paired or it covers the whole field.
+
+    Args:
+      pool:  a utils.StandingsPool of the players to pair, without the
+        player who has the 'Bye'
+      graph:  the tournament's MatchGraph
+      window (optional):  how many players down the standings each player
+        is first considered against
+
+    Returns:
+      A list of [id1, name1, id2, name2] pairs in standings order. If no full
+      pairing exists, the largest one is returned.
+    """
+    players = list(pool)
+    n = len(players)
+    if n < 2:
+        return []
+    wins = [player.wins for player in players]
+    # A score difference of one outweighs any amount of standings distance.
+    score_scale = n * n
+    base = (max(wins) - min(wins)) ** 2 * score_scale + n
+    window = max(1, min(window, n - 1))
+    while True:
+        edges = []
+        for i in range(n):
+            for j in range(i + 1, min(n, i + window + 1)):
+                if not graph.havePlayed(players[i].id, players[j].id):
+                    cost = (wins[i] - wins[j]) ** 2 * score_scale + (j - i)
+                    edges.append((i, j, base - cost))
+        mate = maxWeightMatching(edges, maxcardinality=True)
+        mate += (n - len(mate)) * [-1]
+        if -1 not in mate or window == n - 1:
+            break
+        window = min(2 * window, n - 1)
+    pairings = []
+    for i in range(n):
+        j = mate[i]
+        if j > i:
+            pairings.append([players[i].id, str(players[i].name),
+                             players[j].id, str(players[j].name)])
+    return pairings
+
+
+# The pairing algorithms swissPairings can be asked to use, by name.
+ALGORITHMS = {
+    'greedy': greedyPairings,
+    'matching': matchingPairings,
+}
+
+
+def pairField(pool, graph, algorithm='greedy'):
+    """Takes the 'Bye' out of an odd field and pairs the rest.
+
+    Args:
+      pool:  a utils.StandingsPool of the players to pair. The player who
+        gets the 'Bye' is removed from it.
+      graph:  the tournament's MatchGraph
+      algorithm (optional):  the name of one of the ALGORITHMS
+
+    Returns:
+      A (bye, pairings) tuple: the PlayerRecord of the player who should get
+      a 'Bye', or None, and the pairings the algorithm returns.
+    """
+    bye = None
+    if len(pool) % 2 == 1:
+        bye = chooseBye(pool, graph)
+        if bye is not None:
+            pool.remove(bye.id)
+    return bye, ALGORITHMS[algorithm](pool, graph)
+
+
+def pairTournament(job):
+    """Pairs one tournament from plain data, for a worker process.
+
+    Args:
+      job:  a (standings, matches, algorithm) tuple of the tournament's
+        playerStandings() rows, its (winner, loser) matches and the name of
+        the algorithm
+
+    Returns:
+      A (bye, pairings) tuple: the id of the player who should get a 'Bye',
+      or None, and the pairings.
+    """
+    standings, matches, algorithm = job
+    bye, pairings = pairField(utils.StandingsPool(standings),
+                              MatchGraph(matches), algorithm)
+    return (None if bye is None else bye.id), pairings
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# pairing_state.py -- each tournament's match graph, kept between rounds
+#
+
+import collections
+import contextlib
+import threading
+
+from pairing import MatchGraph
+
+
+class PairingState(object):
+    """A tournament's MatchGraph and how far through its matches it is.
+
+    Attributes:
+      graph:  the MatchGraph of every match applied so far
+      last_id:  the id of the last match applied
+      matches:  the number of matches applied
+    """
+
+    def __init__(self, rows=()):
+        self.graph = MatchGraph()
+        self.last_id = 0
+        self.matches = 0
+        self.addMatches(rows)
+
+    def addMatches(self, rows):
+        """Applies (id, winner, loser) rows recorded since last_id."""
+        for (match_id, winner, loser) in rows:
+            self.graph.addMatch(winner, loser)
+            self.last_id = max(self.last_id, match_id)
+            self.matches += 1
+
+    def diff(self, other):
+        """Returns the differences between this state and another.
+
+        Returns:
+          A sorted list of (field, player_id) tuples: ('opponents', id) for
+          a player whose opponents differ, ('byes', id) for a player whose
+          'Bye' differs, and ('matches', 0) if the match counts differ.
+        """
+        differences = set()
+        if self.matches != other.matches:
+            differences.add(('matches', 0))
+        for player_id in (set(self.graph.opponents) |
+                          set(other.graph.opponents)):
+            if (self.graph.opponents.get(player_id, set()) !=
+                    other.graph.opponents.get(player_id, set())):
+                differences.add(('opponents', player_id))
+        for player_id in self.graph.byes ^ other.graph.byes:
+            differences.add(('byes', player_id))
+        return sorted(differences)
+
+
+class PairingStates(object):
+    """A thread-safe LRU of tournaments' PairingStates.
+
+    A state is brought up to date before each use by applying only the
+    matches recorded since it was last used. Its match count is then checked
+    against the tournament's; if matches were deleted, or committed out of
+    id order, the state is rebuilt from every match instead.
+
+    Args:
+      maxentries (optional):  the most tournaments kept. Pass 0 to rebuild
+        the state on every use.
+    """
+
+    def __init__(self, maxentries=128):
+        self.maxentries = maxentries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.rebuilds = 0
+        self.applied = 0
+        self.evictions = 0
+
+    @contextlib.contextmanager
+    def state(self, tournament_id, matchesSince):
+        """Yields a tournament's PairingState, up to date with its matches.
+
+        Other threads wait for the state until the block ends.
+
+        Args:
+          tournament_id:  the id of the tournament
+          matchesSince:  a session's matchesSince method
+        """
+        entry = self._entry(tournament_id)
+        with entry[0]:
+            state = entry[1]
+            rows, count = matchesSince(tournament_id, state.last_id)
+            state.addMatches(rows)
+            if state.matches == count:
+                self._count(updates=1, applied=len(rows))
+            else:
+                rows, count = matchesSince(tournament_id, 0)
+                state = entry[1] = PairingState(rows)
+                self._count(rebuilds=1, applied=len(rows))
+            yield state
+
+    def check(self, tournament_id, matchesSince):
+        """Rebuilds a tournament's state from its matches and diffs it with
+        the state kept, which is then replaced by the rebuilt one.
+
+        Returns:
+          The differences, as PairingState.diff returns them.
+        """
+        entry = self._entry(tournament_id)
+        with entry[0]:
+            state = entry[1]
+            rows, count = matchesSince(tournament_id, state.last_id)
+            state.addMatches(rows)
+            rows, count = matchesSince(tournament_id, 0)
+            rebuilt = entry[1] = PairingState(rows)
+            return state.diff(rebuilt)
+
+    def discard(self, tournament_id=0):
+        """Drops a tournament's state, or every tournament's when 0."""
+        with self._lock:
+            if tournament_id == 0:
+                self._entries.clear()
+            else:
+                self._entries.pop(tournament_id, None)
+
+    def stats(self):
+        """Returns a dict of the counters and the number of states kept."""
+        with self._lock:
+            return {'updates': self.updates,
+                    'rebuilds': self.rebuilds,
+                    'applied': self.applied,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries)}
+
+    def _entry(self, tournament_id):
+        """Returns the [lock, state] entry of a tournament, adding it."""
+        with self._lock:
+            entry = self._entries.pop(tournament_id, None)
+            if entry is None:
+                entry = [threading.Lock(), PairingState()]
+            if self.maxentries <= 0:
+                return entry
+            # Mark the entry as the most recently used
+            self._entries[tournament_id] = entry
+            while len(self._entries) > self.maxentries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def _count(self, **counters):
+        with self._lock:
+            for (name, n) in counters.items():
+                setattr(self, name, getattr(self, name) + n)
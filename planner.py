@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# planner.py -- the next round paired under hypothetical results
+#
+# A PairingPlanner reads a tournament's standings and match graph once.
+# Each scenario then only works out the records of the players its results
+# touch, re-sorts them into the standings order already computed, and
+# checks rematches against the shared graph plus the scenario's own
+# matches, so nothing is read or written per scenario.
+#
+
+import pairing
+import utils
+
+
+class ScenarioGraph(object):
+    """A MatchGraph with a scenario's matches laid over it, unchanged.
+
+    Args:
+      graph:  the tournament's MatchGraph
+      opponents:  a dict of the sets of new opponents by player id
+      byes:  the set of players the scenario gives a 'Bye'
+    """
+
+    __slots__ = ('_graph', '_opponents', '_byes')
+
+    def __init__(self, graph, opponents, byes):
+        self._graph = graph
+        self._opponents = opponents
+        self._byes = byes
+
+    def havePlayed(self, player1_id, player2_id):
+        """Returns true/false if the two players have played each other."""
+        return (player2_id in self._graph.opponents.get(player1_id, ()) or
+                player2_id in self._opponents.get(player1_id, ()))
+
+    def hasBye(self, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        return player_id in self._byes or player_id in self._graph.byes
+
+
+class PairingPlanner(object):
+    """Pairs a tournament's next round as if some results had been reported.
+
+    Nothing is read or written after the planner is made, so it can try
+    many scenarios, from several threads at once, and later matches do not
+    change its view of the tournament.
+
+    Args:
+      standings:  the tournament's playerStandings() rows
+      graph:  the tournament's MatchGraph, which the planner copies
+    """
+
+    def __init__(self, standings, graph):
+        self.graph = graph.copy()
+        rows = sorted((tuple(row) for row in standings),
+                      key=lambda row: (-row[2], -row[4], row[0]))
+        # Every player's figures by their place in the standings, and the
+        # places of their past opponents
+        self._rows = rows
+        self._ids = [row[0] for row in rows]
+        self._names = [row[1] for row in rows]
+        self._wins = [row[2] for row in rows]
+        self._played = [row[3] for row in rows]
+        self._omw = [row[4] for row in rows]
+        self._index = dict((player_id, i)
+                           for (i, player_id) in enumerate(self._ids))
+        self._opponents = [
+            [self._index[opponent] for opponent in
+             self.graph.opponents.get(player_id, ()) if
+             opponent in self._index]
+            for player_id in self._ids]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def standings(self, results=()):
+        """Returns the standings as they would be after some results.
+
+        Args:
+          results (optional):  (winner, loser) tuples, with a loser of 0
+            for a 'Bye'
+
+        Returns:
+          A list of (id, name, wins, matches, omw) tuples in standings order,
+          as playerStandings() returns.
+
+        Raises:
+          ValueError:  if a result is for a player not in the tournament
+        """
+        return self._scenario(results)[0]
+
+    def plan(self, results=(), algorithm='greedy'):
+        """Pairs the next round as if some results had been reported.
+
+        Args:
+          results (optional):  (winner, loser) tuples, with a loser of 0
+            for a 'Bye'
+          algorithm (optional):  'greedy' or 'matching', as for swissPairings
+
+        Returns:
+          A (bye, pairings) tuple: the id of the player who would get a
+          'Bye', or None, and the pairings swissPairings would return.
+
+        Raises:
+          ValueError:  if the algorithm is unknown or a result is for a
+            player not in the tournament
+        """
+        if algorithm not in pairing.ALGORITHMS:
+            raise ValueError("Unknown pairing algorithm: %r." % (algorithm,))
+        rows, graph = self._scenario(results)
+        bye, pairings = pairing.pairField(utils.StandingsPool(rows), graph,
+                                          algorithm)
+        return (None if bye is None else bye.id), pairings
+
+    def _scenario(self, results):
+        """Returns the standings rows and the ScenarioGraph of a scenario.
+
+        A player's OMW is the sum of their distinct opponents' wins, so it
+        changes for the past opponents of each player who wins, and for
+        both players of a pair meeting for the first time.
+        """
+        if not results:
+            return list(self._rows), self.graph
+        index = self._index
+        past = self._opponents
+        wins = self._wins[:]
+        played = self._played[:]
+        omw = self._omw[:]
+        opponents = {}
+        byes = set()
+        firsts = []
+        for (winner, loser) in results:
+            w = index.get(winner)
+            l = index.get(loser)
+            if w is None or (l is None and loser != 0):
+                raise ValueError("Player %s is not in the tournament." %
+                                 (loser if w is not None else winner,))
+            wins[w] += 1
+            played[w] += 1
+            for opponent in past[w]:
+                omw[opponent] += 1
+            if l is None:
+                byes.add(winner)
+                continue
+            played[l] += 1
+            if not (self.graph.havePlayed(winner, loser) or
+                    loser in opponents.get(winner, ())):
+                opponents.setdefault(winner, set()).add(loser)
+                opponents.setdefault(loser, set()).add(winner)
+                firsts.append((w, l))
+        for (w, l) in firsts:
+            omw[w] += wins[l]
+            omw[l] += wins[w]
+        ids = self._ids
+        # Players are listed in the old standings order, so when only a few
+        # records change the sort has little to do.
+        order = sorted(range(len(ids)),
+                       key=lambda i: (-wins[i], -omw[i], ids[i]))
+        names = self._names
+        rows = [(ids[i], names[i], wins[i], played[i], omw[i])
+                for i in order]
+        return rows, ScenarioGraph(self.graph, opponents, byes)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# pool.py -- a bounded, thread-safe connection pool for tournament.py
+#
+
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free before a checkout times out."""
+
+
+class ConnectionPool(object):
+    """A bounded, thread-safe pool of database connections.
+
+    Connections are handed out most-recently-used first, so a quiet pool
+    lets its oldest connections go idle and evicts them after idle_timeout.
+    A connection that has been idle longer than ping_after is health
+    checked with a trivial query before it is handed out again.
+
+    Args:
+      factory:  a callable that opens and returns a new connection
+      maxconn:  the most connections the pool will have open at once
+      maxidle (optional):  the most idle connections kept for reuse. Pass 0
+        to close every connection on checkin (no pooling at all).
+      idle_timeout (optional):  seconds an idle connection is kept open
+      ping_after (optional):  seconds idle before a connection is pinged
+    """
+
+    def __init__(self, factory, maxconn=8, maxidle=None, idle_timeout=300,
+                 ping_after=30):
+        if maxconn < 1:
+            raise ValueError("maxconn must be at least 1.")
+        self._factory = factory
+        self.maxconn = maxconn
+        self.maxidle = maxconn if maxidle is None else maxidle
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        # Idle connections as (connection, last_used) with the most
+        # recently used at the end of the list.
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition(threading.RLock())
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+
+    def checkout(self, timeout=None):
+        """Returns a healthy connection, opening one if the pool has room.
+
+        Args:
+          timeout (optional):  seconds to wait for a connection to be
+            returned when maxconn are already in use. None waits forever.
+
+        Returns:
+          connection:  a database connection owned by the caller until it is
+            passed back to checkin()
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout(
+                        "No connection became free within %s seconds." %
+                        timeout)
+                self._cond.wait(remaining)
+            self._evictIdle(time.time())
+            candidate = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self.checkouts += 1
+        # Health checks and connects happen outside the lock so a slow
+        # server does not stall every other thread.
+        try:
+            if candidate is not None:
+                conn, last_used = candidate
+                if self._isHealthy(conn, time.time() - last_used):
+                    return conn
+                self._close(conn)
+            conn = self._factory()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.connections_opened += 1
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """Returns a connection to the pool.
+
+        Args:
+          conn:  a connection previously returned by checkout()
+          discard (optional):  close the connection instead of reusing it
+        """
+        if not discard and not self._isOpen(conn):
+            discard = True
+        now = time.time()
+        with self._cond:
+            self._in_use -= 1
+            if not discard and len(self._idle) < self.maxidle:
+                self._idle.append((conn, now))
+                conn = None
+            self._evictIdle(now)
+            self._cond.notify()
+        if conn is not None:
+            self._close(conn)
+
+    def closeAll(self):
+        """Closes every idle connection. Checked out connections are kept."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, last_used in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Returns a dict of the pool's counters and current size."""
+        with self._cond:
+            return {'connections_opened': self.connections_opened,
+                    'connections_closed': self.connections_closed,
+                    'checkouts': self.checkouts,
+                    'in_use': self._in_use,
+                    'idle': len(self._idle)}
+
+    def _evictIdle(self, now):
+        """Drops idle connections older than idle_timeout. Needs the lock."""
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, last_used = self._idle.pop(0)
+            # Closing a connection does not block on the server, so it is
+            # fine to do while holding the lock.
+            self._close(conn)
+
+    def _isOpen(self, conn):
+        return not getattr(conn, 'closed', False)
+
+    def _isHealthy(self, conn, idle_for):
+        if not self._isOpen(conn):
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1;")
+            c.fetchone()
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self.connections_closed += 1
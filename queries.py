@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#
+# queries.py -- SQL and row shaping shared by the tournament sessions
+#
+# session.TournamentSession and tournament_async.AsyncTournamentSession run
+# the same statements and shape their rows the same way; both take them from
+# here so the blocking and asyncio paths cannot drift apart.
+#
+
+import re
+import threading
+
+import bleach
+
+# The database tournament.py and tournament_async.py connect to by default
+DSN = "dbname=tournament"
+
+CREATE_TOURNAMENT = "INSERT INTO Tournaments (name) VALUES (%s) RETURNING id;"
+
+REGISTER_BYE = """INSERT INTO Tournaments_Players (tournament_id, player_id)
+    VALUES (%s, 0);"""
+
+DELETE_TOURNAMENTS = (
+    "DELETE FROM Matches;",
+    "DELETE FROM Tournaments_Players;",
+    "DELETE FROM Players WHERE id <> 0;",
+    "DELETE FROM Tournaments;",
+    "DELETE FROM Archived_Matches;",
+    "DELETE FROM Archived_Standings;",
+    "DELETE FROM Archived_Tournaments;",
+)
+
+# DELETE_TOURNAMENTS for PostgreSQL, which empties whole tables without
+# scanning them or leaving dead rows behind
+TRUNCATE_TOURNAMENTS = (
+    """TRUNCATE Matches, Standings, Tournaments_Players, Players,
+    Tournaments, Archived_Matches, Archived_Standings, Archived_Tournaments;""",
+    "INSERT INTO Players (id, name) VALUES (0, 'Bye');",
+)
+
+DELETE_ALL_MATCHES = (
+    "DELETE FROM Matches;",
+    "UPDATE Standings SET wins = 0, losses = 0, omw = 0;",
+)
+
+TRUNCATE_ALL_MATCHES = (
+    "TRUNCATE Matches;",
+    "UPDATE Standings SET wins = 0, losses = 0, omw = 0;",
+)
+
+DELETE_MATCHES = (
+    "DELETE FROM Matches WHERE tournament_id = %s;",
+    """UPDATE Standings SET wins = 0, losses = 0, omw = 0
+    WHERE tournament_id = %s;""",
+)
+
+DELETE_PLAYERS = (
+    "DELETE FROM Tournaments_Players;",
+    "DELETE FROM Players WHERE id <> 0;",
+)
+
+TRUNCATE_PLAYERS = (
+    "TRUNCATE Tournaments_Players, Standings;",
+    "DELETE FROM Players WHERE id <> 0;",
+)
+
+# Every %s is the tournament id. Players are kept, as they may be registered
+# in other tournaments.
+DELETE_TOURNAMENT = (
+    "DELETE FROM Matches WHERE tournament_id = %s;",
+    "DELETE FROM Standings WHERE tournament_id = %s;",
+    "DELETE FROM Tournaments_Players WHERE tournament_id = %s;",
+    "DELETE FROM Tournaments WHERE id = %s;",
+)
+
+# Copies a tournament into the archive tables before DELETE_TOURNAMENT. The
+# first statement copies nothing if there is no such tournament.
+ARCHIVE_TOURNAMENT = (
+    """INSERT INTO Archived_Tournaments (id, name)
+    SELECT id, name FROM Tournaments WHERE id = %s;""",
+    """INSERT INTO Archived_Standings (tournament_id, player_id, name, wins,
+        losses, omw)
+    SELECT s.tournament_id, s.player_id, p.name, s.wins, s.losses, s.omw
+    FROM Standings s JOIN Players p ON p.id = s.player_id
+    WHERE s.tournament_id = %s AND s.player_id <> 0;""",
+    """INSERT INTO Archived_Matches (id, tournament_id, round, winner, loser)
+    SELECT id, tournament_id, round, winner, loser FROM Matches
+    WHERE tournament_id = %s;""",
+)
+
+ARCHIVED_STANDINGS = """SELECT player_id, name, wins, wins + losses, omw
+    FROM Archived_Standings WHERE tournament_id = %s
+    ORDER BY wins DESC, omw DESC, player_id;"""
+
+COUNT_ALL_PLAYERS = "SELECT COUNT(id) as num FROM Players WHERE id <> 0;"
+
+COUNT_PLAYERS = """SELECT COUNT(player_id) as num FROM Tournaments_Players
+    WHERE tournament_id = %s AND player_id <> 0;"""
+
+INSERT_PLAYER = "INSERT INTO Players (name) VALUES (%s) RETURNING id;"
+
+INSERT_PLAYERS = "INSERT INTO Players (name) VALUES %s RETURNING id;"
+
+# Adds a player under an external identifier, or renames and returns the
+# player already registered under it
+UPSERT_PLAYER = """INSERT INTO Players (name, external_id) VALUES (%s, %s)
+    ON CONFLICT (external_id) DO UPDATE SET name = excluded.name
+    RETURNING id;"""
+
+UPSERT_PLAYERS = """INSERT INTO Players (name, external_id) VALUES %s
+    ON CONFLICT (external_id) DO UPDATE SET name = excluded.name
+    RETURNING external_id, id;"""
+
+FIND_PLAYERS = """SELECT external_id, id, name FROM Players
+    WHERE external_id IN %s;"""
+
+PLAYER_HISTORY = """SELECT tournament_id, wins, wins + losses, omw
+    FROM Standings WHERE player_id = %s
+    UNION ALL
+    SELECT tournament_id, wins, wins + losses, omw
+    FROM Archived_Standings WHERE player_id = %s
+    ORDER BY tournament_id;"""
+
+REGISTER_PLAYER = """INSERT INTO Tournaments_Players (tournament_id, player_id)
+    VALUES (%s, %s);"""
+
+REGISTER_PLAYERS = """INSERT INTO Tournaments_Players (tournament_id, player_id)
+    VALUES %s;"""
+
+STANDINGS = """SELECT p.id, p.name, s.wins, s.wins + s.losses, s.omw
+    FROM Standings s JOIN Players p ON p.id = s.player_id
+    WHERE s.tournament_id = %s AND s.player_id <> 0
+    ORDER BY s.wins DESC, s.omw DESC, s.player_id;"""
+
+STANDINGS_OF = """SELECT p.id, p.name, s.wins, s.wins + s.losses, s.omw
+    FROM Standings s JOIN Players p ON p.id = s.player_id
+    WHERE s.tournament_id = %s AND s.player_id IN %s AND s.player_id <> 0;"""
+
+STANDINGS_MANY = """SELECT s.tournament_id, p.id, p.name, s.wins,
+    s.wins + s.losses, s.omw
+    FROM Standings s JOIN Players p ON p.id = s.player_id
+    WHERE s.tournament_id IN %s AND s.player_id <> 0
+    ORDER BY s.tournament_id, s.wins DESC, s.omw DESC, s.player_id;"""
+
+REBUILD_STANDINGS = "SELECT * FROM f_RebuildStandings(%s);"
+
+PLAYERS = """SELECT p.id, p.name
+    FROM Tournaments_Players tp JOIN Players p ON p.id = tp.player_id
+    WHERE tp.tournament_id = %s AND tp.player_id <> 0
+    ORDER BY p.id;"""
+
+PLAYERS_EXTERNAL = """SELECT p.id, p.name, p.external_id
+    FROM Tournaments_Players tp JOIN Players p ON p.id = tp.player_id
+    WHERE tp.tournament_id = %s AND tp.player_id <> 0
+    ORDER BY p.id;"""
+
+INSERT_MATCH = """INSERT INTO Matches (tournament_id, winner, loser)
+    VALUES (%s, %s, %s);"""
+
+INSERT_MATCHES = """INSERT INTO Matches (tournament_id, round, winner, loser)
+    VALUES %s;"""
+
+INSERT_ROUND_MATCH = """INSERT INTO Matches (tournament_id, round, winner, loser)
+    VALUES (%s, %s, %s, %s);"""
+
+# The lock the Standings trigger takes too. NO KEY UPDATE, unlike UPDATE,
+# does not wait for the KEY SHARE lock a Matches insert holds on its
+# tournament, which would deadlock with that insert's trigger.
+LOCK_TOURNAMENT = """SELECT id FROM Tournaments WHERE id = %s
+    FOR NO KEY UPDATE;"""
+
+LAST_ROUND = """SELECT COALESCE(MAX(round), 0) FROM Matches
+    WHERE tournament_id = %s;"""
+
+COUNT_MATCHES = "SELECT COUNT(*) FROM Matches WHERE tournament_id = %s;"
+
+ROUND_MATCHES = """SELECT winner, loser FROM Matches
+    WHERE tournament_id = %s AND round = %s ORDER BY id;"""
+
+MATCHES = """SELECT winner, loser FROM Matches
+    WHERE tournament_id = %s ORDER BY id;"""
+
+MATCHES_SINCE = """SELECT id, winner, loser FROM Matches
+    WHERE tournament_id = %s AND id > %s ORDER BY id;"""
+
+MATCHES_MANY = """SELECT tournament_id, winner, loser FROM Matches
+    WHERE tournament_id IN %s ORDER BY id;"""
+
+MATCHES_BETWEEN = """SELECT id FROM Matches
+    WHERE (winner = %s OR winner = %s)
+    AND (loser = %s OR loser = %s)
+    AND tournament_id = %s;"""
+
+BYES = """SELECT id FROM Matches WHERE winner = %s
+    AND loser = 0 AND tournament_id = %s;"""
+
+PLAYER_MATCHES = """SELECT winner, loser FROM Matches
+    WHERE (winner = %s OR loser = %s) AND tournament_id = %s;"""
+
+OPPONENT_WINS = """SELECT COUNT(winner) FROM Matches
+    WHERE tournament_id = %s AND winner IN %s;"""
+
+# bleach Cleaners are expensive to build and not thread-safe, so each thread
+# builds one and reuses it for every name it cleans.
+_cleaners = threading.local()
+
+# Printable ASCII without '&', '<' or '>', which bleach leaves unchanged.
+_PLAIN_NAME = re.compile(r'[\x20-\x25\x27-\x3b\x3d\x3f-\x7e]*\Z')
+
+
+def cleanName(name):
+    """Returns a name sanitised with bleach."""
+    if _PLAIN_NAME.match(name):
+        return name
+    cleaner = getattr(_cleaners, 'cleaner', None)
+    if cleaner is None:
+        cleaner = _cleaners.cleaner = bleach.Cleaner()
+    return cleaner.clean(name)
+
+
+def externalIds(names, external_ids):
+    """Returns the external identifiers of names being registered.
+
+    Args:
+      names:  the players' names
+      external_ids:  None, or an identifier (or None) for every name
+
+    Raises:
+      ValueError:  if the lists differ in length or an identifier repeats
+    """
+    if external_ids is None:
+        return [None] * len(names)
+    external_ids = list(external_ids)
+    if len(external_ids) != len(names):
+        raise ValueError("Expected %d external ids, not %d." %
+                         (len(names), len(external_ids)))
+    known = [e for e in external_ids if e is not None]
+    if len(set(known)) != len(known):
+        raise ValueError("An external id is repeated.")
+    return external_ids
+
+
+def standingsRow(row):
+    """Shapes a STANDINGS row into a playerStandings() tuple."""
+    return (row[0], str(row[1]), row[2], row[3], row[4])
+
+
+def standingsRows(rows):
+    """Shapes STANDINGS rows into playerStandings() tuples."""
+    return [standingsRow(row) for row in rows]
+
+
+def groupByTournament(tournament_ids, rows, shape=tuple):
+    """Splits rows that start with a tournament id into a dict of lists.
+
+    Every id in tournament_ids gets a list, empty if it has no rows. The
+    rest of each row is passed through shape.
+    """
+    grouped = dict((t, []) for t in tournament_ids)
+    for row in rows:
+        grouped[row[0]].append(shape(row[1:]))
+    return grouped
+
+
+def opponents(player_id, rows):
+    """Returns a player's opponents from their PLAYER_MATCHES rows."""
+    return [row[1] if row[0] == player_id else row[0] for row in rows]
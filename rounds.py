@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# rounds.py -- a tournament round paired and played before it is recorded
+#
+
+
+class Round(object):
+    """One round of a tournament, held in memory until closeRound().
+
+    The pairings, the 'Bye' and the results are kept here while the round
+    is played and then written together in a single transaction, so a round
+    is either recorded whole or not at all.
+
+    Args:
+      tournament_id:  the id of the tournament
+      number:  the round's number, one more than the last round recorded
+    """
+
+    def __init__(self, tournament_id, number):
+        self.tournament_id = tournament_id
+        self.number = number
+        self.pairings = None
+        self.bye = None
+        self.matches_seen = None
+        self.closed = False
+        self._results = {}
+
+    def setPairings(self, pairings, bye, matches_seen):
+        """Records how the round was paired.
+
+        Args:
+          pairings:  the [id1, name1, id2, name2] pairs of the round
+          bye:  the id of the player who gets the 'Bye', or None
+          matches_seen:  the number of matches the tournament had when the
+            round was paired
+        """
+        if self.closed:
+            raise ValueError("Round %d has already been closed." % self.number)
+        self.pairings = pairings
+        self.bye = bye
+        self.matches_seen = matches_seen
+        self._results = {}
+
+    def addResults(self, results):
+        """Adds (winner, loser) results for pairs of this round.
+
+        Either every result is added or, if any is not valid, none are.
+
+        Raises:
+          ValueError:  if the round is unpaired or closed, a result is not
+            for one of its pairs, or a pair already has a result
+        """
+        if self.pairings is None:
+            raise ValueError("Round %d has not been paired." % self.number)
+        if self.closed:
+            raise ValueError("Round %d has already been closed." % self.number)
+        pairs = set(frozenset([pair[0], pair[2]]) for pair in self.pairings)
+        added = {}
+        for (winner, loser) in results:
+            key = frozenset([winner, loser])
+            if key not in pairs:
+                raise ValueError("Players %s and %s are not paired in round "
+                                 "%d." % (winner, loser, self.number))
+            if key in self._results or key in added:
+                raise ValueError("Players %s and %s already have a result in "
+                                 "round %d." % (winner, loser, self.number))
+            added[key] = (winner, loser)
+        self._results.update(added)
+
+    def results(self):
+        """Returns the (winner, loser) results added so far, 'Bye' first,
+        in pairing order."""
+        if self.pairings is None:
+            return []
+        matches = [] if self.bye is None else [(self.bye, 0)]
+        for (id1, name1, id2, name2) in self.pairings:
+            result = self._results.get(frozenset([id1, id2]))
+            if result is not None:
+                matches.append(result)
+        return matches
+
+    def matches(self):
+        """Returns the (winner, loser) matches of the round, 'Bye' first.
+
+        Raises:
+          ValueError:  if the round is unpaired or a pair has no result
+        """
+        if self.pairings is None:
+            raise ValueError("Round %d has not been paired." % self.number)
+        matches = [] if self.bye is None else [(self.bye, 0)]
+        for (id1, name1, id2, name2) in self.pairings:
+            result = self._results.get(frozenset([id1, id2]))
+            if result is None:
+                raise ValueError("Players %s and %s have no result in round "
+                                 "%d." % (id1, id2, self.number))
+            matches.append(result)
+        return matches
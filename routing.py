@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# routing.py -- reads on replicas, writes on the primary
+#
+
+import contextlib
+import itertools
+import sqlite3
+import threading
+import time
+
+import psycopg2
+
+# The errors that mean a replica cannot be reached
+UNAVAILABLE = (psycopg2.OperationalError, psycopg2.InterfaceError,
+               sqlite3.OperationalError)
+
+# The session methods that only read, and so may run on a replica, by the
+# position of the tournament id they read (None if they are not about one
+# tournament)
+READS = {
+    'archivedStandings': 0,
+    'countPlayers': 0,
+    'findPlayers': None,
+    'getMatches': 0,
+    'getOpponentMatchWins': 0,
+    'hasBye': 0,
+    'numberOfMatchesPlayed': 0,
+    'playerHistory': None,
+    'playerStandings': 0,
+    'standingsMany': None,
+}
+
+# The streaming reads, which fall back to the primary only if the replica
+# fails before their first row
+STREAMS = {
+    'iterMatches': 0,
+    'iterPlayers': 0,
+    'iterStandings': 0,
+}
+
+# The session methods that change tournaments, by the position of the
+# tournament id they change (None if they may change every tournament)
+WRITES = {
+    'archiveTournament': 0,
+    'deleteMatches': 0,
+    'deletePlayers': None,
+    'deleteTournament': 0,
+    'deleteTournaments': None,
+    'rebuildStandings': 0,
+    'recordRound': 0,
+    'registerPlayer': 0,
+    'registerPlayers': 0,
+    'reportMatch': 0,
+    'reportMatches': 0,
+    'reportMatchesMany': None,
+}
+
+
+class RoutingSession(object):
+    """Sends read-only calls to replica sessions and the rest to a primary.
+
+    Reads go to the replicas in turn. A replica that cannot be reached is
+    skipped for retry_interval seconds and the read is made on the primary
+    instead, as are all reads when every replica is skipped. Reads made
+    inside a cursor() block run in the primary's transaction.
+
+    Replicas lag behind the primary, so for read_your_writes seconds after
+    a call changes a tournament, this session reads that tournament from
+    the primary. Calls that may change every tournament (deleteTournaments,
+    say) send every read to the primary for that long.
+
+    A read made on a replica is as stale as that replica's lag: a write
+    made through this session shows in it once the replica has caught up,
+    or after read_your_writes seconds, when the read moves back to the
+    replica, whichever is later. A read can therefore miss this session's
+    own write only if the replica lags by more than read_your_writes, and
+    a write made through another session shows once the replica catches
+    up. Replica reads are never cached, here or on the primary, so nothing
+    keeps them past that. Replica sessions should not cache standings
+    themselves, as nothing invalidates their cache; pass them
+    cache_entries=0.
+
+    Args:
+      primary:  the session that every write goes to
+      replicas:  the sessions reads go to
+      read_your_writes (optional):  seconds to keep reading a changed
+        tournament from the primary. Pass 0 to read from replicas straight
+        away.
+      retry_interval (optional):  seconds to skip a replica that failed
+    """
+
+    def __init__(self, primary, replicas, read_your_writes=2.0,
+                 retry_interval=5.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.read_your_writes = read_your_writes
+        self.retry_interval = retry_interval
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # When each tournament was last changed (0 for every tournament),
+        # and when any was
+        self._written = {}
+        self._last_write = 0
+        # When each failed replica, by index, may be tried again
+        self._skipped = {}
+        self.replica_reads = [0] * len(self.replicas)
+        self.primary_reads = 0
+        self.fresh_reads = 0
+        self.fallbacks = 0
+
+    def __getattr__(self, name):
+        if name in READS:
+            return self._router(name, READS[name], self._read)
+        if name in STREAMS:
+            return self._router(name, STREAMS[name], self._stream)
+        if name in WRITES:
+            return self._router(name, WRITES[name], self._write)
+        return getattr(self.primary, name)
+
+    @contextlib.contextmanager
+    def cursor(self, *args, **kwargs):
+        """A primary cursor() block, in which reads run on the primary."""
+        with self.primary.cursor(*args, **kwargs) as c:
+            self._local.depth = getattr(self._local, 'depth', 0) + 1
+            try:
+                yield c
+            finally:
+                self._local.depth -= 1
+
+    def close(self):
+        """Closes the idle connections of the primary and every replica."""
+        self.primary.close()
+        for replica in self.replicas:
+            replica.close()
+
+    def stats(self):
+        """Returns a dict of the reads made on each replica, the reads made
+        on the primary, how many of those were for read-your-writes and how
+        many fell back from a failed replica."""
+        with self._lock:
+            return {'replica_reads': list(self.replica_reads),
+                    'primary_reads': self.primary_reads,
+                    'fresh_reads': self.fresh_reads,
+                    'fallbacks': self.fallbacks}
+
+    def _router(self, name, position, route):
+        def routed(*args, **kwargs):
+            if position is not None and len(args) > position:
+                tournament_id = args[position]
+            else:
+                tournament_id = kwargs.get('tournament_id', 0)
+            return route(name, tournament_id, args, kwargs)
+        return routed
+
+    def _read(self, name, tournament_id, args, kwargs):
+        """Makes a read on a replica, or on the primary if there is none
+        to use or the replica fails."""
+        index = self._choose(tournament_id)
+        if index is not None:
+            try:
+                return getattr(self.replicas[index], name)(*args, **kwargs)
+            except UNAVAILABLE:
+                self._skip(index)
+        return getattr(self.primary, name)(*args, **kwargs)
+
+    def _stream(self, name, tournament_id, args, kwargs):
+        """Yields a streaming read's rows from a replica, or from the
+        primary if the replica fails before its first row."""
+        index = self._choose(tournament_id)
+        if index is None:
+            rows = getattr(self.primary, name)(*args, **kwargs)
+        else:
+            rows = getattr(self.replicas[index], name)(*args, **kwargs)
+        first = []
+        try:
+            first.append(next(rows))
+        except StopIteration:
+            return
+        except UNAVAILABLE:
+            if index is None:
+                raise
+            self._skip(index)
+            rows = getattr(self.primary, name)(*args, **kwargs)
+        try:
+            for row in itertools.chain(first, rows):
+                yield row
+        finally:
+            # Ends the stream's transaction; in-memory streams have none.
+            if hasattr(rows, 'close'):
+                rows.close()
+
+    def _write(self, name, tournament_id, args, kwargs):
+        """Makes a write on the primary and notes the tournament changed."""
+        try:
+            return getattr(self.primary, name)(*args, **kwargs)
+        finally:
+            now = time.time()
+            with self._lock:
+                if len(self._written) > 1000:
+                    # Forget the tournaments replicas have caught up with
+                    self._written = dict(
+                        (t, written) for (t, written) in self._written.items()
+                        if now - written < self.read_your_writes)
+                self._written[tournament_id or 0] = now
+                self._last_write = now
+
+    def _choose(self, tournament_id):
+        """Returns the index of the replica to read from, or None to read
+        from the primary."""
+        now = time.time()
+        with self._lock:
+            if getattr(self._local, 'depth', 0):
+                self.primary_reads += 1
+                return None
+            if self._changed(tournament_id, now):
+                self.primary_reads += 1
+                self.fresh_reads += 1
+                return None
+            for attempt in range(len(self.replicas)):
+                index = next(self._next) % len(self.replicas)
+                if self._skipped.get(index, 0) <= now:
+                    self.replica_reads[index] += 1
+                    return index
+            self.primary_reads += 1
+            return None
+
+    def _changed(self, tournament_id, now):
+        """Returns true/false if this session changed the tournament (any
+        tournament when 0) less than read_your_writes seconds ago. Needs
+        the lock."""
+        if tournament_id:
+            written = max(self._written.get(0, 0),
+                          self._written.get(tournament_id, 0))
+        else:
+            written = self._last_write
+        return now - written < self.read_your_writes
+
+    def _skip(self, index):
+        """Skips a replica that failed for retry_interval seconds."""
+        with self._lock:
+            self._skipped[index] = time.time() + self.retry_interval
+            self.replica_reads[index] -= 1
+            self.primary_reads += 1
+            self.fallbacks += 1
@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+#
+# session.py -- pooled database access for tournament.py
+#
+
+import contextlib
+import itertools
+import threading
+
+from psycopg2.extras import execute_values
+
+import instrumentation
+import queries
+import statements
+from cache import StandingsCache
+from feed import ChangeHub, Listener, StandingsFeed
+from pairing_state import PairingStates
+from pool import ConnectionPool
+from queries import cleanName
+
+# Numbers the server-side cursors opened by TournamentSession._stream.
+_streams = itertools.count(1)
+
+
+class TournamentSession(object):
+    """Runs the tournament queries over a pool of database connections.
+
+    Every query method borrows a connection for the length of the call and
+    commits before giving it back. Calls made while the same thread already
+    holds a connection (swissPairings calling playerStandings and
+    reportMatch, for instance) share that connection and its transaction.
+
+    Standings are served from a StandingsCache, and every method that
+    changes a tournament's standings invalidates it once its transaction
+    has ended, when it also publishes the change to the session's
+    ChangeHub. Each tournament's match graph is kept in PairingStates
+    between rounds.
+
+    Args:
+      factory:  a callable that opens a new database connection
+      cache_entries (optional):  the most tournaments' standings cached.
+        Pass 0 to disable the cache.
+      cache_rows (optional):  the most standings rows cached in total
+      state_entries (optional):  the most tournaments' pairing states kept
+      prepare (optional):  run the hot queries as statements prepared once
+        per connection (see statements.py)
+      **pool_args:  passed through to pool.ConnectionPool
+    """
+
+    # Locks a tournament's row until the transaction ends.
+    LOCK_TOURNAMENT = queries.LOCK_TOURNAMENT
+
+    # Empty whole tables.
+    DELETE_TOURNAMENTS = queries.TRUNCATE_TOURNAMENTS
+    DELETE_ALL_MATCHES = queries.TRUNCATE_ALL_MATCHES
+    DELETE_PLAYERS = queries.TRUNCATE_PLAYERS
+
+    # The statements each connection prepares.
+    STATEMENTS = statements.HOT
+
+    def __init__(self, factory, cache_entries=128, cache_rows=100000,
+                 state_entries=128, prepare=True, **pool_args):
+        self.factory = factory
+        self.pool = ConnectionPool(instrumentation.connector(factory),
+                                   **pool_args)
+        self.changes = ChangeHub()
+        self.cache = StandingsCache(cache_entries, cache_rows)
+        self.states = PairingStates(state_entries)
+        self.statements = self.STATEMENTS if prepare else None
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def cursor(self, name=None):
+        """Yields a cursor, committing (or rolling back) when the block ends.
+
+        The first block on a thread checks a connection out of the pool, and
+        blocks opened before it ends run inside the same transaction. The
+        last of them to end commits and checks the connection in, so
+        streams read in turn on one thread keep their cursors open however
+        they interleave. If the first block fails, the last one rolls back.
+
+        Args:
+          name (optional):  open a server-side cursor of this name, which
+            holds its rows on the server until they are fetched
+        """
+        local = self._local
+        DB = getattr(local, 'connection', None)
+        first = DB is None
+        if first:
+            DB = self.pool.checkout()
+            local.connection = DB
+            local.invalidated = set()
+            local.users = 0
+            local.failed = False
+        local.users += 1
+        failed = False
+        try:
+            yield instrumentation.cursor(self._openCursor(DB, name))
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            local.users -= 1
+            if first and failed:
+                local.failed = True
+            if local.users == 0:
+                self._end(DB, failed or local.failed)
+
+    def _end(self, DB, failed):
+        """Commits (or rolls back) the thread's transaction and checks its
+        connection back in."""
+        broken = False
+        try:
+            if failed:
+                DB.rollback()
+            else:
+                DB.commit()
+        except BaseException:
+            # KeyboardInterrupt and the like must not leave the connection
+            # mid-transaction either.
+            try:
+                DB.rollback()
+            except Exception:
+                broken = True
+            if not failed:
+                raise
+        finally:
+            invalidated = self._local.invalidated
+            self._local.connection = None
+            self._local.invalidated = None
+            self.pool.checkin(DB, discard=broken)
+            for tournament_id in invalidated:
+                self.cache.invalidate(tournament_id)
+                self.changes.publish(tournament_id)
+
+    def _openCursor(self, DB, name):
+        """Returns a cursor on DB: server-side if it is named, and otherwise
+        running the registered statements prepared."""
+        if name is not None:
+            return DB.cursor(name)
+        if self.statements is None:
+            return DB.cursor()
+        return self.statements.cursor(DB, DB.cursor())
+
+    def _invalidate(self, tournament_id=0):
+        """Drops a tournament's cached standings (every tournament's when 0)
+        once the current transaction ends."""
+        self._local.invalidated.add(tournament_id)
+
+    def _cacheable(self, tournament_id):
+        """Returns true/false if this thread may use the cached standings,
+        which it may not once its open transaction has changed them."""
+        invalidated = getattr(self._local, 'invalidated', None)
+        return not invalidated or (tournament_id not in invalidated and
+                                   0 not in invalidated)
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+        self.pool.closeAll()
+
+    def _stream(self, query, args, fetch_size, shape=tuple):
+        """Yields the rows of a query fetch_size at a time from a
+        server-side cursor, holding a connection until the last row."""
+        with self.cursor('tournament_stream_%d' % next(_streams)) as c:
+            try:
+                c.execute(query, args)
+                while True:
+                    rows = c.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield shape(row)
+            except GeneratorExit:
+                # Closed part way: commit what the caller did meanwhile, as
+                # a stream read to the end would.
+                pass
+            finally:
+                c.close()
+
+    def createTournament(self, name):
+        """Adds a tournament and returns its id."""
+        with self.cursor() as c:
+            c.execute(queries.CREATE_TOURNAMENT, (cleanName(name),))
+            id_of_new_row = c.fetchone()[0]
+            c.execute(queries.REGISTER_BYE, (id_of_new_row,))
+        return id_of_new_row
+
+    def deleteTournaments(self):
+        """Removes all the matches, players, and tournaments."""
+        with self.cursor() as c:
+            for query in self.DELETE_TOURNAMENTS:
+                c.execute(query)
+            self._invalidate()
+        self.states.discard()
+
+    def deleteMatches(self, tournament_id=0):
+        """Removes the matches of one tournament, or of all when 0."""
+        with self.cursor() as c:
+            if tournament_id == 0:
+                for query in self.DELETE_ALL_MATCHES:
+                    c.execute(query)
+            else:
+                for query in queries.DELETE_MATCHES:
+                    c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+        self.states.discard(tournament_id)
+
+    def deleteTournament(self, tournament_id):
+        """Removes one tournament with its matches and registrations."""
+        with self.cursor() as c:
+            for query in queries.DELETE_TOURNAMENT:
+                c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+        self.states.discard(tournament_id)
+
+    def archiveTournament(self, tournament_id):
+        """Moves a tournament into the archive tables.
+
+        Returns:
+          The number of matches archived.
+
+        Raises:
+          ValueError:  if there is no such tournament
+        """
+        with self.cursor() as c:
+            c.execute(queries.ARCHIVE_TOURNAMENT[0], (tournament_id,))
+            if c.rowcount == 0:
+                raise ValueError("There is no tournament %d to archive." %
+                                 tournament_id)
+            for query in queries.ARCHIVE_TOURNAMENT[1:]:
+                c.execute(query, (tournament_id,))
+            archived = c.rowcount
+            for query in queries.DELETE_TOURNAMENT:
+                c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+        self.states.discard(tournament_id)
+        return archived
+
+    def archivedStandings(self, tournament_id):
+        """Returns an archived tournament's final playerStandings()."""
+        with self.cursor() as c:
+            c.execute(queries.ARCHIVED_STANDINGS, (tournament_id,))
+            standings = queries.standingsRows(c.fetchall())
+        return standings
+
+    def deletePlayers(self):
+        """Removes all the player records except for 'Bye'."""
+        with self.cursor() as c:
+            for query in self.DELETE_PLAYERS:
+                c.execute(query)
+            self._invalidate()
+
+    def countPlayers(self, tournament_id=0):
+        """Returns the number of players in a tournament, or in all when 0."""
+        with self.cursor() as c:
+            if tournament_id == 0:
+                c.execute(queries.COUNT_ALL_PLAYERS)
+            else:
+                c.execute(queries.COUNT_PLAYERS, (tournament_id,))
+            number_of_players = c.fetchone()[0]
+        return number_of_players
+
+    def registerPlayer(self, tournament_id, name, external_id=None):
+        """Adds a player to a tournament and returns the player's id, which
+        is that of the player already registered under external_id if
+        there is one."""
+        with self.cursor() as c:
+            if external_id is None:
+                c.execute(queries.INSERT_PLAYER, (cleanName(name),))
+            else:
+                c.execute(queries.UPSERT_PLAYER,
+                          (cleanName(name), external_id))
+            id_of_new_row = c.fetchone()[0]
+            c.execute(queries.REGISTER_PLAYER, (tournament_id, id_of_new_row))
+            self._invalidate(tournament_id)
+        return id_of_new_row
+
+    def registerPlayers(self, tournament_id, names, external_ids=None):
+        """Adds many players to a tournament; returns their ids in order.
+
+        Names with an external id are linked to the player already
+        registered under it, if there is one.
+        """
+        external_ids = queries.externalIds(names, external_ids)
+        if not names:
+            return []
+        new = [(cleanName(name),)
+               for (name, e) in zip(names, external_ids) if e is None]
+        known = [(cleanName(name), e)
+                 for (name, e) in zip(names, external_ids) if e is not None]
+        with self.cursor() as c:
+            new_ids = []
+            if new:
+                rows = execute_values(c, queries.INSERT_PLAYERS, new,
+                                      page_size=len(new), fetch=True)
+                # Serial ids are handed out in insert order.
+                new_ids = sorted(row[0] for row in rows)
+            linked = {}
+            if known:
+                linked = dict(execute_values(c, queries.UPSERT_PLAYERS, known,
+                                             page_size=len(known), fetch=True))
+            new_ids = iter(new_ids)
+            ids = [next(new_ids) if e is None else linked[e]
+                   for e in external_ids]
+            execute_values(
+                c, queries.REGISTER_PLAYERS, [(tournament_id, i) for i in ids],
+                page_size=len(ids))
+            self._invalidate(tournament_id)
+        return ids
+
+    def findPlayers(self, external_ids):
+        """Returns a dict of (id, name) by external id for the players
+        registered under any of external_ids."""
+        if not external_ids:
+            return {}
+        with self.cursor() as c:
+            c.execute(queries.FIND_PLAYERS, (tuple(external_ids),))
+            rows = c.fetchall()
+        return dict((row[0], (row[1], str(row[2]))) for row in rows)
+
+    def playerHistory(self, player_id):
+        """Returns (tournament_id, wins, matches, OMWs) tuples, by tournament
+        id, for every live and archived tournament a player is in."""
+        with self.cursor() as c:
+            c.execute(queries.PLAYER_HISTORY, (player_id, player_id))
+            history = c.fetchall()
+        return history
+
+    def playerStandings(self, tournament_id):
+        """Returns (id, name, wins, matches, OMWs) tuples sorted by wins.
+
+        The Standings table is kept up to date as matches are reported, so
+        this is a single indexed read however many players are registered,
+        and none at all when the standings are cached.
+        """
+        cacheable = self._cacheable(tournament_id)
+        if cacheable:
+            standings = self.cache.get(tournament_id)
+            if standings is not None:
+                return standings
+            token = self.cache.token(tournament_id)
+        with self.cursor() as c:
+            c.execute(queries.STANDINGS, (tournament_id,))
+            standings = queries.standingsRows(c.fetchall())
+        if cacheable:
+            self.cache.put(tournament_id, standings, token)
+        return standings
+
+    def standingsOf(self, tournament_id, player_ids):
+        """Returns the playerStandings() tuples of some players, unsorted
+        and uncached."""
+        with self.cursor() as c:
+            c.execute(queries.STANDINGS_OF, (tournament_id, tuple(player_ids)))
+            standings = queries.standingsRows(c.fetchall())
+        return standings
+
+    def standingsFeed(self, tournament_ids):
+        """Returns a StandingsFeed of tournaments, fed by the Standings
+        triggers' notifications on a connection of its own."""
+        return StandingsFeed(self, tournament_ids, Listener(self.factory()))
+
+    def iterStandings(self, tournament_id, fetch_size=1000):
+        """Yields playerStandings() tuples in order without reading them all
+        into memory or the cache."""
+        return self._stream(queries.STANDINGS, (tournament_id,), fetch_size,
+                            queries.standingsRow)
+
+    def iterPlayers(self, tournament_id, fetch_size=1000, external_ids=False):
+        """Yields the (id, name) of every player in a tournament by id, or
+        (id, name, external_id) with external_ids."""
+        return self._stream(queries.PLAYERS_EXTERNAL if external_ids else
+                            queries.PLAYERS, (tournament_id,), fetch_size)
+
+    def standingsMany(self, tournament_ids):
+        """Returns a dict of playerStandings() lists by tournament id, read
+        with one query."""
+        if not tournament_ids:
+            return {}
+        with self.cursor() as c:
+            c.execute(queries.STANDINGS_MANY, (tuple(tournament_ids),))
+            rows = c.fetchall()
+        return queries.groupByTournament(tournament_ids, rows,
+                                         queries.standingsRow)
+
+    def rebuildStandings(self, tournament_id=0):
+        """Recomputes the Standings table from Matches.
+
+        Returns a list of the (tournament_id, player_id) rows that were out
+        of date.
+        """
+        with self.cursor() as c:
+            c.execute(queries.REBUILD_STANDINGS, (tournament_id,))
+            stale = c.fetchall()
+            if stale:
+                self._invalidate(tournament_id)
+        return stale
+
+    def reportMatch(self, tournament_id, winner, loser):
+        """Records the outcome of a single match between two players."""
+        with self.cursor() as c:
+            c.execute(queries.INSERT_MATCH, (tournament_id, winner, loser))
+            self._invalidate(tournament_id)
+
+    def getMatches(self, tournament_id):
+        """Returns (winner, loser) tuples for every match in a tournament."""
+        with self.cursor() as c:
+            c.execute(queries.MATCHES, (tournament_id,))
+            matches = c.fetchall()
+        return matches
+
+    def iterMatches(self, tournament_id, fetch_size=1000):
+        """Yields getMatches() tuples without reading them all into
+        memory."""
+        return self._stream(queries.MATCHES, (tournament_id,), fetch_size)
+
+    def matchesSince(self, tournament_id, last_id):
+        """Returns the (id, winner, loser) of a tournament's matches after
+        last_id, in id order, and the number of matches it has."""
+        with self.cursor() as c:
+            c.execute(queries.MATCHES_SINCE, (tournament_id, last_id))
+            rows = c.fetchall()
+            c.execute(queries.COUNT_MATCHES, (tournament_id,))
+            count = c.fetchone()[0]
+        return rows, count
+
+    @contextlib.contextmanager
+    def pairingState(self, tournament_id):
+        """Yields the tournament's pairing_state.PairingState, caught up with
+        its latest matches.
+
+        The connection is taken before the state, as every caller takes
+        them, so that two threads never wait on each other.
+        """
+        with self.cursor():
+            with self.states.state(tournament_id,
+                                   self.matchesSince) as state:
+                yield state
+
+    def checkPairingState(self, tournament_id):
+        """Rebuilds a tournament's pairing state from Matches and returns
+        how the kept state differed."""
+        with self.cursor():
+            return self.states.check(tournament_id, self.matchesSince)
+
+    def matchesMany(self, tournament_ids):
+        """Returns a dict of getMatches() lists by tournament id, read with
+        one query."""
+        if not tournament_ids:
+            return {}
+        with self.cursor() as c:
+            c.execute(queries.MATCHES_MANY, (tuple(tournament_ids),))
+            rows = c.fetchall()
+        return queries.groupByTournament(tournament_ids, rows)
+
+    def reportMatchesMany(self, results):
+        """Records (tournament_id, winner, loser) results across any number
+        of tournaments with one insert."""
+        if not results:
+            return
+        with self.cursor() as c:
+            self._insertMatches(
+                c, [(tournament_id, None, winner, loser)
+                    for (tournament_id, winner, loser) in results])
+            for tournament_id in set(row[0] for row in results):
+                self._invalidate(tournament_id)
+
+    def reportMatches(self, tournament_id, results):
+        """Records many (winner, loser) results in one transaction."""
+        if not results:
+            return
+        with self.cursor() as c:
+            self._insertMatches(
+                c, [(tournament_id, None, winner, loser)
+                    for (winner, loser) in results])
+            self._invalidate(tournament_id)
+
+    def lastRound(self, tournament_id):
+        """Returns the number of the last round recorded, or 0."""
+        with self.cursor() as c:
+            c.execute(queries.LAST_ROUND, (tournament_id,))
+            last_round = c.fetchone()[0]
+        return last_round
+
+    def recordRound(self, tournament_id, number, matches, matches_seen):
+        """Records a round's (winner, loser) matches in one transaction.
+
+        Returns:
+          recorded:  False if exactly these matches were already recorded as
+            this round, as when a call is retried after its commit
+            succeeded, and True otherwise
+
+        Raises:
+          ValueError:  if the round was recorded with other matches, or the
+            tournament no longer has matches_seen matches
+        """
+        with self.cursor() as c:
+            # Serialise rounds of the same tournament.
+            c.execute(self.LOCK_TOURNAMENT, (tournament_id,))
+            c.execute(queries.ROUND_MATCHES, (tournament_id, number))
+            recorded = [tuple(row) for row in c.fetchall()]
+            if recorded:
+                if sorted(recorded) == sorted(matches):
+                    return False
+                raise ValueError(
+                    "Round %d of tournament %d has already been recorded." %
+                    (number, tournament_id))
+            c.execute(queries.COUNT_MATCHES, (tournament_id,))
+            if c.fetchone()[0] != matches_seen:
+                raise ValueError(
+                    "Tournament %d has changed since round %d was paired." %
+                    (tournament_id, number))
+            self._insertMatches(
+                c, [(tournament_id, number, winner, loser)
+                    for (winner, loser) in matches])
+            self._invalidate(tournament_id)
+        return True
+
+    def _insertMatches(self, c, rows):
+        """Inserts (tournament_id, round, winner, loser) rows."""
+        if rows:
+            execute_values(c, queries.INSERT_MATCHES, rows,
+                           page_size=len(rows))
+
+    def numberOfMatchesPlayed(self, tournament_id, player1_id, player2_id):
+        """Returns the number of matches two players have played."""
+        with self.cursor() as c:
+            c.execute(queries.MATCHES_BETWEEN,
+                      (player1_id, player2_id, player1_id, player2_id,
+                       tournament_id))
+            number_played = c.rowcount
+        return number_played
+
+    def hasBye(self, tournament_id, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        with self.cursor() as c:
+            c.execute(queries.BYES, (player_id, tournament_id))
+            has_bye = c.rowcount > 0
+        return has_bye
+
+    def getOpponentMatchWins(self, tournament_id, player_id):
+        """Returns the total number of wins of all of a player's opponents."""
+        with self.cursor() as c:
+            # Get all matches the player has played
+            c.execute(queries.PLAYER_MATCHES,
+                      (player_id, player_id, tournament_id))
+            opponents = queries.opponents(player_id, c.fetchall())
+            if len(opponents) == 0:
+                return 0
+            # Get the total number of wins for the players in the list
+            c.execute(queries.OPPONENT_WINS, (tournament_id, tuple(opponents)))
+            opponent_match_wins = c.fetchone()[0]
+        return opponent_match_wins
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+#
+# snapshot.py -- a tournament saved as packed arrays, loaded by mapping
+#
+# A snapshot file is a 32-byte header followed by little-endian 32-bit
+# arrays of the player ids, the offsets of their names, the match winners,
+# the match losers (0 for a 'Bye') and the offsets of the players' external
+# ids, then the UTF-8 names, the external ids (empty for a player without
+# one) and the tournament's name. Version 1 files, which have no external
+# ids, can still be read. Loading maps the file and reads the arrays in place,
+# so no Python object is made per player or per match until one is asked
+# for.
+#
+# NumPy is optional. With it the arrays are views of the mapped file, and
+# the standings and the graph pairing checks rematches against are worked
+# out with array operations; without it the arrays are copied into
+# array.array and walked in Python.
+#
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+import pairing
+import tiebreaks
+import utils
+from planner import PairingPlanner
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'TSNP'
+VERSION = 2
+
+# magic, version, flags, tournament id, players, matches, names bytes,
+# tournament name bytes, external ids bytes (0 in version 1)
+HEADER = struct.Struct('<4sHHIIIIII')
+
+
+def _int32(values=()):
+    """Returns an array.array of 32-bit signed integers."""
+    for typecode in ('i', 'l'):
+        if array.array(typecode).itemsize == 4:
+            return array.array(typecode, values)
+    raise ValueError("No 32-bit array type on this platform.")
+
+
+def _bytes(values):
+    """Returns an array's contents as little-endian bytes."""
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def _encode(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def _decode(data):
+    """Returns UTF-8 bytes as the str playerStandings() names are."""
+    if str is bytes:
+        return data
+    return data.decode('utf-8')
+
+
+def replaceFile(source, path):
+    """Renames a file over another and syncs the directory, so the new file
+    is in place, whole, even after a crash.
+
+    On Python 3 os.replace swaps the file atomically. Python 2 only has
+    os.rename, which is atomic on POSIX but will not replace a file on
+    Windows; there the old file is first moved aside to path + '.old', and
+    moved back if the rename fails.
+
+    Args:
+      source:  the path of the new file, already written and synced
+      path:  the path to give it
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, path)
+    elif os.name == 'nt' and os.path.exists(path):
+        old = path + '.old'
+        if os.path.exists(old):
+            os.remove(old)
+        os.rename(path, old)
+        try:
+            os.rename(source, path)
+        except OSError:
+            os.rename(old, path)
+            raise
+        os.remove(old)
+    else:
+        os.rename(source, path)
+    if os.name != 'nt':
+        # Windows cannot open a directory to sync it
+        directory = os.open(os.path.dirname(os.path.abspath(path)),
+                            os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class SnapshotGraph(object):
+    """A read-only match graph over a snapshot's winners and losers.
+
+    Each pair of opponents is one 64-bit key in a sorted NumPy array, found
+    by binary search, so no set of opponents is built for each player.
+
+    Args:
+      winners:  the winner of every match
+      losers:  the loser of every match, 0 for a 'Bye'
+    """
+
+    def __init__(self, winners, losers):
+        winners = numpy.asarray(winners, dtype=numpy.int64)
+        losers = numpy.asarray(losers, dtype=numpy.int64)
+        real = losers != 0
+        a = winners[real]
+        b = losers[real]
+        # A rematch repeats its key, which the search does not mind
+        self._keys = numpy.sort(numpy.minimum(a, b) << 32 |
+                                numpy.maximum(a, b))
+        self.byes = set(winners[~real].tolist())
+
+    def havePlayed(self, player1_id, player2_id):
+        """Returns true/false if the two players have played each other."""
+        key = (min(player1_id, player2_id) << 32 |
+               max(player1_id, player2_id))
+        i = self._keys.searchsorted(key)
+        return bool(i < len(self._keys) and self._keys[i] == key)
+
+    def hasBye(self, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        return player_id in self.byes
+
+
+def writeSnapshot(out, tournament_id, players, matches, name=''):
+    """Writes a tournament to a file as a snapshot.
+
+    Args:
+      out:  a file object open for writing in binary mode
+      tournament_id:  the id of the tournament
+      players:  (id, name) or (id, name, external_id) tuples of the
+        tournament's players, with an external_id of None for a player
+        without one
+      matches:  the tournament's (winner, loser) tuples, in the order they
+        were reported
+      name (optional):  the tournament's name
+
+    Returns:
+      A (players, matches) tuple of the numbers written.
+    """
+    ids = _int32()
+    offsets = _int32([0])
+    external_offsets = _int32([0])
+    names = []
+    external_ids = []
+    size = external_size = 0
+    for player in players:
+        encoded = _encode(player[1])
+        ids.append(player[0])
+        names.append(encoded)
+        size += len(encoded)
+        offsets.append(size)
+        encoded = _encode(player[2] or '') if len(player) > 2 else b''
+        external_ids.append(encoded)
+        external_size += len(encoded)
+        external_offsets.append(external_size)
+    winners = _int32()
+    losers = _int32()
+    for (winner, loser) in matches:
+        winners.append(winner)
+        losers.append(loser)
+    title = _encode(name)
+    out.write(HEADER.pack(MAGIC, VERSION, 0, tournament_id, len(ids),
+                          len(winners), size, len(title), external_size))
+    for values in (ids, offsets, winners, losers, external_offsets):
+        out.write(_bytes(values))
+    out.write(b''.join(names))
+    out.write(b''.join(external_ids))
+    out.write(title)
+    return len(ids), len(winners)
+
+
+class Snapshot(object):
+    """A snapshot file, mapped into memory.
+
+    The arrays are read in place, and standings(), graph(), pairings() and
+    planner() work the tournament out from them each time they are called.
+    Close the snapshot when done. With NumPy, arrays taken from it keep the
+    file mapped until they are freed.
+
+    Args:
+      path:  the path of the snapshot file
+
+    Attributes:
+      tournament_id:  the id the tournament had when it was saved
+      name:  the tournament's name
+      player_ids:  the players' ids, in the order they were saved
+      winners:  the winner of every match, in the order reported
+      losers:  the loser of every match, 0 for a 'Bye'
+
+    Raises:
+      ValueError:  if the file is not a snapshot or is cut short
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() < HEADER.size:
+                raise ValueError("%s is not a tournament snapshot." % path)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load(path)
+        except Exception:
+            self._map.close()
+            raise
+
+    def __len__(self):
+        return len(self.winners)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmaps the file, unless arrays taken from it are still in use."""
+        self.player_ids = self.winners = self.losers = None
+        self._offsets = self._external_offsets = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+    def players(self):
+        """Returns the (id, name) tuples of the players."""
+        return list(zip(self.player_ids.tolist(), self.names()))
+
+    def names(self):
+        """Returns the players' names, in the order of player_ids."""
+        return self._strings(self._names_at, self._offsets)
+
+    def externalIds(self):
+        """Returns the players' external ids, in the order of player_ids,
+        with None for a player without one."""
+        if self._external_offsets is None:
+            return [None] * len(self.player_ids)
+        return [external_id or None for external_id in
+                self._strings(self._external_at, self._external_offsets)]
+
+    def _strings(self, start, offsets):
+        """Returns the strings of a string table by their offsets."""
+        offsets = offsets.tolist()
+        data = self._map[start:start + offsets[-1]]
+        text = _decode(data)
+        if len(text) == len(data):
+            # Every name is ASCII, so the byte offsets are string offsets
+            data, text = text, None
+        names = [data[offsets[i]:offsets[i + 1]]
+                 for i in range(len(offsets) - 1)]
+        if text is None:
+            return names
+        return [_decode(name) for name in names]
+
+    def matches(self):
+        """Returns the (winner, loser) tuples of the matches."""
+        return list(zip(self.winners.tolist(), self.losers.tolist()))
+
+    def standings(self):
+        """Returns the standings as playerStandings() would have.
+
+        Returns:
+          A list of (id, name, wins, matches, omw) tuples in standings order.
+        """
+        ids = self.player_ids.tolist()
+        columns = tiebreaks.computeFromArrays(ids, self.winners, self.losers,
+                                              ('wins', 'matches', 'omw'))
+        wins, played, omw = (columns['wins'], columns['matches'],
+                             columns['omw'])
+        names = self.names()
+        if numpy is None:
+            order = sorted(range(len(ids)),
+                           key=lambda i: (-wins[i], -omw[i], ids[i]))
+            return [(ids[i], names[i], wins[i], played[i], omw[i])
+                    for i in order]
+        order = numpy.lexsort((self.player_ids, -numpy.asarray(omw),
+                               -numpy.asarray(wins)))
+        columns = [numpy.asarray(column)[order].tolist()
+                   for column in (ids, wins, played, omw)]
+        order = order.tolist()
+        columns.insert(1, [names[i] for i in order])
+        return list(zip(*columns))
+
+    def graph(self):
+        """Returns a graph of who has played whom and who has had a 'Bye',
+        which the pairing algorithms can pair with.
+
+        With NumPy it is a read-only SnapshotGraph over the arrays; without,
+        the MatchGraph matchGraph() returns.
+        """
+        if numpy is None:
+            return self.matchGraph()
+        return SnapshotGraph(self.winners, self.losers)
+
+    def matchGraph(self):
+        """Returns the tournament's pairing.MatchGraph, with a set of
+        opponents for each player."""
+        return pairing.MatchGraph(zip(self.winners.tolist(),
+                                      self.losers.tolist()))
+
+    def pairings(self, algorithm='greedy'):
+        """Pairs the next round as swissPairings would, without writing.
+
+        Args:
+          algorithm (optional):  'greedy' or 'matching', as for swissPairings
+
+        Returns:
+          A (bye, pairings) tuple: the id of the player who would get a
+          'Bye', or None, and the pairings.
+        """
+        if algorithm not in pairing.ALGORITHMS:
+            raise ValueError("Unknown pairing algorithm: %r." % (algorithm,))
+        pool = utils.StandingsPool(self.standings())
+        bye, pairings = pairing.pairField(pool, self.graph(), algorithm)
+        return (None if bye is None else bye.id), pairings
+
+    def planner(self):
+        """Returns a planner.PairingPlanner for the next round."""
+        return PairingPlanner(self.standings(), self.matchGraph())
+
+    def _load(self, path):
+        (magic, version, flags, self.tournament_id, players, matches,
+         names_size, title_size,
+         external_size) = HEADER.unpack(self._map[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError("%s is not a tournament snapshot." % path)
+        if version not in (1, VERSION):
+            raise ValueError("%s is a version %d snapshot; only versions 1 "
+                             "to %d can be read." % (path, version, VERSION))
+        counts = [players, players + 1, matches, matches]
+        if version > 1:
+            counts.append(players + 1)
+        at = HEADER.size
+        sections = []
+        for count in counts:
+            sections.append((at, count))
+            at += 4 * count
+        self._names_at = at
+        at += names_size
+        self._external_at = at
+        at += external_size
+        if len(self._map) != at + title_size:
+            raise ValueError("%s is cut short or has been changed." % path)
+        self.name = _decode(self._map[at:at + title_size])
+        arrays = [self._array(start, count) for (start, count) in sections]
+        (self.player_ids, self._offsets, self.winners,
+         self.losers) = arrays[:4]
+        self._external_offsets = arrays[4] if version > 1 else None
+
+    def _array(self, start, count):
+        """Returns the count 32-bit integers at an offset of the file."""
+        if numpy is not None:
+            return numpy.frombuffer(self._map, dtype='<i4', count=count,
+                                    offset=start)
+        values = _int32()
+        data = self._map[start:start + 4 * count]
+        if hasattr(values, 'frombytes'):
+            values.frombytes(data)
+        else:
+            values.fromstring(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# sqlite_session.py -- the tournament queries on an SQLite database
+#
+
+import os
+import sqlite3
+
+import queries
+from feed import StandingsFeed
+from queries import cleanName
+from session import TournamentSession
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'tournament_sqlite.sql')
+
+# The oldest SQLite with UPDATE ... FROM, RETURNING and ON CONFLICT upserts
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# f_RebuildStandings from tournament.sql, in two statements. Every %s is the
+# tournament id.
+INSERT_MISSING_STANDINGS = """INSERT INTO Standings (tournament_id, player_id)
+    SELECT tp.tournament_id, tp.player_id FROM Tournaments_Players tp
+    WHERE (%s = 0 OR tp.tournament_id = %s) AND NOT EXISTS (
+        SELECT 1 FROM Standings s
+        WHERE s.tournament_id = tp.tournament_id
+        AND s.player_id = tp.player_id
+    );"""
+
+REBUILD_STANDINGS = """WITH m AS (
+        SELECT tournament_id, winner, loser FROM Matches
+        WHERE %s = 0 OR tournament_id = %s
+    ), w AS (
+        SELECT tournament_id, winner AS id, COUNT(*) AS wins
+        FROM m GROUP BY tournament_id, winner
+    ), l AS (
+        SELECT tournament_id, loser AS id, COUNT(*) AS losses
+        FROM m GROUP BY tournament_id, loser
+    ), o AS (
+        SELECT tournament_id, winner AS id, loser AS opponent FROM m
+        UNION
+        SELECT tournament_id, loser, winner FROM m
+    ), omw AS (
+        SELECT o.tournament_id, o.id, SUM(w.wins) AS omw
+        FROM o JOIN w ON w.tournament_id = o.tournament_id
+        AND w.id = o.opponent
+        GROUP BY o.tournament_id, o.id
+    ), r AS (
+        SELECT s.tournament_id, s.player_id,
+            COALESCE(w.wins, 0) AS wins, COALESCE(l.losses, 0) AS losses,
+            COALESCE(omw.omw, 0) AS omw
+        FROM Standings s
+        LEFT JOIN w ON w.tournament_id = s.tournament_id
+            AND w.id = s.player_id
+        LEFT JOIN l ON l.tournament_id = s.tournament_id
+            AND l.id = s.player_id
+        LEFT JOIN omw ON omw.tournament_id = s.tournament_id
+            AND omw.id = s.player_id
+        WHERE %s = 0 OR s.tournament_id = %s
+    )
+    UPDATE Standings SET wins = r.wins, losses = r.losses, omw = r.omw
+    FROM r
+    WHERE Standings.tournament_id = r.tournament_id
+    AND Standings.player_id = r.player_id
+    AND (Standings.wins <> r.wins OR Standings.losses <> r.losses
+         OR Standings.omw <> r.omw)
+    RETURNING Standings.tournament_id, Standings.player_id;"""
+
+
+class SQLiteCursor(object):
+    """An sqlite3 cursor that takes the psycopg2 queries in queries.py.
+
+    Each %s placeholder becomes a ? and a tuple argument is expanded into a
+    parenthesised list, as psycopg2 adapts it. SELECT results are fetched
+    straight away so that rowcount counts them, as it does in psycopg2,
+    unless the cursor streams them like a psycopg2 named cursor.
+
+    Args:
+      cursor:  the sqlite3 cursor
+      stream (optional):  leave SELECT results in SQLite for fetchmany()
+    """
+
+    def __init__(self, cursor, stream=False):
+        self._cursor = cursor
+        self._stream = stream
+        self._rows = None
+
+    def execute(self, query, args=()):
+        query, params = self._translate(query, args)
+        self._cursor.execute(query, params)
+        self._rows = None
+        if self._cursor.description is not None and not self._stream:
+            self._rows = self._cursor.fetchall()
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(self._translate(query, rows[0])[0], rows)
+        self._rows = None
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows or [], []
+        return rows
+
+    def fetchmany(self, size):
+        if self._rows is None:
+            return self._cursor.fetchmany(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def rowcount(self):
+        if self._rows is not None:
+            return len(self._rows)
+        return self._cursor.rowcount
+
+    def _translate(self, query, args):
+        parts = query.split('%s')
+        sql = [parts[0]]
+        params = []
+        for (arg, part) in zip(args or (), parts[1:]):
+            if isinstance(arg, tuple):
+                sql.append('(' + ', '.join('?' * len(arg)) + ')')
+                params.extend(arg)
+            else:
+                sql.append('?')
+                params.append(arg)
+            sql.append(part)
+        return ''.join(sql), params
+
+
+class SQLiteConnection(object):
+    """An sqlite3 connection whose cursors are SQLiteCursors.
+
+    Like a psycopg2 connection, the first cursor opens a transaction that
+    lasts until commit() or rollback(). Transactions take the database's
+    write lock up front, so two sessions never deadlock upgrading a read.
+
+    Raises:
+      RuntimeError:  if the sqlite3 module's SQLite is older than
+        MIN_SQLITE_VERSION
+    """
+
+    def __init__(self, path, timeout=5.0):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                "The SQLite backend needs SQLite %s or later; this Python's "
+                "sqlite3 module has %s." %
+                ('.'.join(map(str, MIN_SQLITE_VERSION)),
+                 sqlite3.sqlite_version))
+        # Transactions are begun and ended here, not by the sqlite3 module.
+        self._DB = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                                   check_same_thread=False)
+        # Names come back as str, as they do from psycopg2.
+        self._DB.text_factory = str
+        self._DB.execute("PRAGMA foreign_keys = ON;")
+        with open(SCHEMA) as schema:
+            self._DB.executescript(schema.read())
+        self._in_transaction = False
+        self.closed = False
+
+    def cursor(self, name=None):
+        """Returns a cursor, which streams its rows if it is named."""
+        if not self._in_transaction:
+            self._DB.execute("BEGIN IMMEDIATE;")
+            self._in_transaction = True
+        return SQLiteCursor(self._DB.cursor(), stream=name is not None)
+
+    def commit(self):
+        self._end("COMMIT;")
+
+    def rollback(self):
+        self._end("ROLLBACK;")
+
+    def _end(self, statement):
+        if self._in_transaction:
+            self._in_transaction = False
+            self._DB.execute(statement)
+
+    def close(self):
+        self._DB.close()
+        self.closed = True
+
+
+class SQLiteSession(TournamentSession):
+    """Runs the tournament queries on an SQLite database file.
+
+    The schema (tournament_sqlite.sql) is created on first use. Pass
+    ':memory:' for a private database that lives as long as the session,
+    which then holds a single connection.
+
+    Args:
+      path (optional):  the database file
+      **session_args:  passed through to session.TournamentSession
+    """
+
+    # Transactions already hold the database's write lock.
+    LOCK_TOURNAMENT = "SELECT id FROM Tournaments WHERE id = %s;"
+
+    # SQLite has no TRUNCATE.
+    DELETE_TOURNAMENTS = queries.DELETE_TOURNAMENTS
+    DELETE_ALL_MATCHES = queries.DELETE_ALL_MATCHES
+    DELETE_PLAYERS = queries.DELETE_PLAYERS
+
+    # The sqlite3 module keeps its own cache of compiled statements.
+    STATEMENTS = None
+
+    def __init__(self, path='tournament.db', **session_args):
+        if path == ':memory:':
+            # Every connection to ':memory:' is a separate database.
+            session_args.update(maxconn=1, idle_timeout=float('inf'))
+        self.path = path
+        TournamentSession.__init__(
+            self, lambda: SQLiteConnection(path), **session_args)
+
+    def registerPlayers(self, tournament_id, names, external_ids=None):
+        """Adds many players to a tournament; returns their ids in order.
+
+        Names with an external id are linked to the player already
+        registered under it, if there is one.
+        """
+        external_ids = queries.externalIds(names, external_ids)
+        if not names:
+            return []
+        with self.cursor() as c:
+            ids = []
+            for (name, external_id) in zip(names, external_ids):
+                if external_id is None:
+                    c.execute(queries.INSERT_PLAYER, (cleanName(name),))
+                else:
+                    c.execute(queries.UPSERT_PLAYER,
+                              (cleanName(name), external_id))
+                ids.append(c.fetchone()[0])
+            c.executemany(queries.REGISTER_PLAYER,
+                          [(tournament_id, i) for i in ids])
+            self._invalidate(tournament_id)
+        return ids
+
+    def standingsFeed(self, tournament_ids):
+        """Returns a StandingsFeed of tournaments. SQLite has no
+        notifications, so it is fed the changes made through this
+        session only."""
+        return StandingsFeed(self, tournament_ids, self.changes.subscribe())
+
+    def rebuildStandings(self, tournament_id=0):
+        """Recomputes the Standings table from Matches.
+
+        Returns a list of the (tournament_id, player_id) rows that were out
+        of date.
+        """
+        with self.cursor() as c:
+            c.execute(INSERT_MISSING_STANDINGS, (tournament_id,) * 2)
+            c.execute(REBUILD_STANDINGS, (tournament_id,) * 4)
+            stale = sorted(c.fetchall())
+            if stale:
+                self._invalidate(tournament_id)
+        return stale
+
+    def _insertMatches(self, c, rows):
+        """Inserts (tournament_id, round, winner, loser) rows."""
+        if rows:
+            c.executemany(queries.INSERT_ROUND_MATCH, rows)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# statements.py -- the hot queries, prepared once per connection
+#
+# PostgreSQL parses and plans every statement it is sent. The queries below
+# run many times per round, so each connection prepares them the first time
+# it runs them and afterwards only sends EXECUTE with the arguments.
+#
+
+import re
+import threading
+import weakref
+
+import psycopg2.errorcodes
+import psycopg2.extensions
+
+import queries
+
+PREPARED_NAMES = "SELECT name FROM pg_prepared_statements;"
+
+
+class StatementRegistry(object):
+    """Prepared statements by the queries.py text they stand in for.
+
+    Each connection prepares a statement the first time it runs it. The
+    first time the registry sees a connection, such as one the pool opens
+    after a connection is lost, it reads the names the connection already
+    has prepared from pg_prepared_statements, so a statement is never
+    prepared twice. If the server has dropped a connection's statements
+    (DISCARD ALL, say), the call that finds one missing reads them again
+    and prepares only the missing ones (see PreparingCursor).
+
+    Args:
+      statements:  (name, query) tuples, or (name, query, prepared) where
+        the query's text cannot be prepared as it is. Otherwise each %s of
+        the query becomes a numbered parameter.
+    """
+
+    def __init__(self, statements):
+        self._statements = {}
+        for statement in statements:
+            name, query = statement[:2]
+            n = query.count('%s')
+            if len(statement) > 2:
+                prepared = statement[2]
+            else:
+                numbers = iter(range(1, n + 1))
+                prepared = re.sub('%s', lambda match: '$%d' % next(numbers),
+                                  query)
+            self._statements[query] = (
+                name, 'PREPARE %s AS %s' % (name, prepared),
+                'EXECUTE %s (%s);' % (name, ', '.join(['%s'] * n)))
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def cursor(self, DB, c):
+        """Returns c, a cursor on DB, running the registered queries by
+        name."""
+        return PreparingCursor(c, self, DB)
+
+    def lookup(self, query):
+        """Returns (name, PREPARE, EXECUTE) for a query, or None."""
+        return self._statements.get(query)
+
+    def prepared(self, DB):
+        """Returns the set of statement names DB has prepared, read from the
+        server the first time DB is seen."""
+        with self._lock:
+            names = self._prepared.get(DB)
+        if names is not None:
+            return names
+        c = DB.cursor()
+        try:
+            c.execute(PREPARED_NAMES)
+            names = set(row[0] for row in c.fetchall())
+        finally:
+            c.close()
+        with self._lock:
+            return self._prepared.setdefault(DB, names)
+
+    def forget(self, DB):
+        """Forgets what DB has prepared, so it is read from the server
+        again."""
+        with self._lock:
+            self._prepared.pop(DB, None)
+
+
+class PreparingCursor(object):
+    """A cursor that runs registered queries as prepared statements.
+
+    When a statement the server has dropped is the first of its
+    transaction, the failed transaction is rolled back, which loses
+    nothing, and the statement is prepared again and run a second time.
+    Later in a transaction the error is raised, as the transaction cannot
+    go on, and the next transaction prepares the statement again.
+    """
+
+    def __init__(self, cursor, registry, DB):
+        self._cursor = cursor
+        self._registry = registry
+        self._DB = DB
+
+    def execute(self, query, args=()):
+        statement = self._registry.lookup(query)
+        if statement is None:
+            return self._cursor.execute(query, args)
+        name, prepare, execute = statement
+        # Arrays take the place of the tuples psycopg2 expands for IN.
+        args = [list(arg) if isinstance(arg, tuple) else arg
+                for arg in args or ()]
+        first = (self._DB.get_transaction_status() ==
+                 psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self._prepare(name, prepare)
+        try:
+            return self._cursor.execute(execute, args)
+        except psycopg2.Error as e:
+            if e.pgcode != psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME:
+                raise
+            self._registry.forget(self._DB)
+            if not first:
+                raise
+        self._DB.rollback()
+        self._prepare(name, prepare)
+        return self._cursor.execute(execute, args)
+
+    def _prepare(self, name, prepare):
+        """Prepares a statement on the connection unless it is already."""
+        prepared = self._registry.prepared(self._DB)
+        if name not in prepared:
+            self._cursor.execute(prepare)
+            prepared.add(name)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# The statements run on every pairing, report and standings read
+HOT = StatementRegistry([
+    ('tournament_standings', queries.STANDINGS),
+    ('tournament_matches', queries.MATCHES),
+    ('tournament_matches_since', queries.MATCHES_SINCE),
+    ('tournament_count_matches', queries.COUNT_MATCHES),
+    ('tournament_matches_between', queries.MATCHES_BETWEEN),
+    ('tournament_byes', queries.BYES),
+    ('tournament_player_matches', queries.PLAYER_MATCHES),
+    ('tournament_opponent_wins', queries.OPPONENT_WINS,
+     """SELECT COUNT(winner) FROM Matches
+    WHERE tournament_id = $1 AND winner = ANY($2);"""),
+    ('tournament_insert_match', queries.INSERT_MATCH),
+])
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- standings and tiebreakers computed in bulk from matches
+#
+# NumPy is optional. With it every column is computed with array operations
+# in one pass over the matches; without it the same figures are computed in
+# plain Python.
+#
+
+from __future__ import division
+
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A player's match-win percentage never counts for less than this, so that
+# playing a winless opponent is not punished too hard.
+MIN_MATCH_WIN_PCT = 1.0 / 3
+
+# The columns computeTiebreaks returns, in the order tiebreakRows() puts them
+# after the id and name.
+COLUMNS = ('wins', 'matches', 'omw', 'omw_pct', 'oomw_pct', 'buchholz',
+           'sonneborn_berger')
+
+
+def computeTiebreaks(player_ids, matches, vectorized=None):
+    """Computes every player's record and tiebreakers from their matches.
+
+    A 'Bye' (a loser of 0) counts as a win and a match played, as in the
+    standings, but not as an opponent. OMW sums each distinct opponent's
+    wins once, as the Standings table does. The other tiebreakers count an
+    opponent once for every match against them:
+
+      omw_pct:  the mean match-win percentage of the player's opponents,
+        each at least MIN_MATCH_WIN_PCT
+      oomw_pct:  the mean omw_pct of the player's opponents
+      buchholz:  the sum of the player's opponents' wins
+      sonneborn_berger:  the sum of the wins of the opponents the player
+        beat
+
+    Args:
+      player_ids:  the ids of the players to compute figures for
+      matches:  the tournament's (winner, loser) tuples
+      vectorized (optional):  True to use NumPy, False to use plain Python.
+        Defaults to NumPy when it is installed.
+
+    Returns:
+      A dict of lists by column name (see COLUMNS), each in the same order
+      as player_ids.
+    """
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized:
+        return _computeVectorized(player_ids, matches)
+    return _computePython(player_ids, matches)
+
+
+def computeFromArrays(player_ids, winners, losers, columns=COLUMNS,
+                      vectorized=None):
+    """Computes what computeTiebreaks does from the matches' winners and
+    losers as two integer arrays, such as a snapshot holds, without making
+    a tuple for each match.
+
+    Args:
+      player_ids:  the ids of the players to compute figures for
+      winners:  the winner of every match
+      losers:  the loser of every match, 0 for a 'Bye'
+      columns (optional):  the columns to compute, from COLUMNS
+      vectorized (optional):  as for computeTiebreaks
+
+    Returns:
+      A dict of lists by column name, as computeTiebreaks returns, of the
+      columns asked for.
+    """
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized:
+        computed = _computeArrays(player_ids,
+                                  numpy.asarray(winners, dtype=numpy.int64),
+                                  numpy.asarray(losers, dtype=numpy.int64),
+                                  columns)
+        return dict((name, values.tolist())
+                    for (name, values) in computed.items())
+    computed = _computePython(player_ids, zip(winners, losers))
+    return dict((name, computed[name]) for name in columns)
+
+
+def _computeVectorized(player_ids, matches):
+    """computeTiebreaks with NumPy arrays indexed by player."""
+    pairs = numpy.fromiter(itertools.chain.from_iterable(matches),
+                           dtype=numpy.int64, count=2 * len(matches))
+    pairs = pairs.reshape(-1, 2)
+    computed = _computeArrays(player_ids, pairs[:, 0], pairs[:, 1])
+    return dict((name, values.tolist()) for (name, values) in computed.items())
+
+
+def _unique(values):
+    """Returns the distinct values of an int64 array, sorted."""
+    values = numpy.sort(values)
+    if len(values):
+        values = values[numpy.concatenate(([True], values[1:] != values[:-1]))]
+    return values
+
+
+def _computeArrays(player_ids, winners, losers, columns=COLUMNS):
+    """Returns a dict of NumPy arrays of the columns asked for, in the
+    order of player_ids, from int64 arrays of winners and losers."""
+    at = numpy.array(player_ids, dtype=numpy.int64)
+    real = losers != 0
+    # Every id is replaced by its place among the ids seen, so the arrays
+    # are as long as there are players, however large their ids are
+    keys = _unique(numpy.concatenate((at, winners, losers)))
+    n = len(keys)
+    at = keys.searchsorted(at)
+    winners = keys.searchsorted(winners)
+    losers = keys.searchsorted(losers)
+    # The winner and loser of every match that was not a 'Bye'
+    a = winners[real]
+    b = losers[real]
+
+    wins = numpy.bincount(winners, minlength=n)
+    played = wins + numpy.bincount(b, minlength=n)
+    computed = {'wins': wins, 'matches': played}
+
+    def opponentsTotal(values):
+        return (numpy.bincount(a, weights=values[b], minlength=n) +
+                numpy.bincount(b, weights=values[a], minlength=n))
+
+    if 'omw' in columns:
+        # Each distinct pair of opponents once, encoded as low * n + high
+        met = _unique(numpy.minimum(a, b) * n + numpy.maximum(a, b))
+        low, high = met // n, met % n
+        computed['omw'] = (
+            numpy.bincount(low, weights=wins[high], minlength=n) +
+            numpy.bincount(high, weights=wins[low], minlength=n))
+    if 'omw_pct' in columns or 'oomw_pct' in columns:
+        games = numpy.maximum(
+            numpy.bincount(a, minlength=n) + numpy.bincount(b, minlength=n),
+            1)
+        mwp = numpy.maximum(wins / numpy.maximum(played, 1),
+                            MIN_MATCH_WIN_PCT)
+        computed['omw_pct'] = opponentsTotal(mwp) / games
+        computed['oomw_pct'] = opponentsTotal(computed['omw_pct']) / games
+    if 'buchholz' in columns:
+        computed['buchholz'] = opponentsTotal(wins)
+    if 'sonneborn_berger' in columns:
+        computed['sonneborn_berger'] = numpy.bincount(
+            a, weights=wins[b], minlength=n)
+
+    return dict((name, values[at] if name in ('omw_pct', 'oomw_pct') else
+                 values[at].astype(numpy.int64))
+                for (name, values) in computed.items() if name in columns)
+
+
+def _computePython(player_ids, matches):
+    """computeTiebreaks with dicts, for when NumPy is not installed."""
+    wins = {}
+    played = {}
+    # Every opponent of each player, once per match, and the ones they beat
+    faced = {}
+    beaten = {}
+    for (winner, loser) in matches:
+        wins[winner] = wins.get(winner, 0) + 1
+        played[winner] = played.get(winner, 0) + 1
+        if loser == 0:
+            continue
+        played[loser] = played.get(loser, 0) + 1
+        faced.setdefault(winner, []).append(loser)
+        faced.setdefault(loser, []).append(winner)
+        beaten.setdefault(winner, []).append(loser)
+
+    def mean(values):
+        return sum(values) / len(values) if values else 0.0
+
+    mwp = dict((p, max(wins.get(p, 0) / played[p], MIN_MATCH_WIN_PCT))
+               for p in played)
+    omw_pct = dict((p, mean([mwp[o] for o in faced.get(p, ())]))
+                   for p in played)
+    columns = dict((name, []) for name in COLUMNS)
+    for p in player_ids:
+        opponents = faced.get(p, ())
+        columns['wins'].append(wins.get(p, 0))
+        columns['matches'].append(played.get(p, 0))
+        columns['omw'].append(sum(wins.get(o, 0) for o in set(opponents)))
+        columns['omw_pct'].append(omw_pct.get(p, 0.0))
+        columns['oomw_pct'].append(mean([omw_pct[o] for o in opponents]))
+        columns['buchholz'].append(sum(wins.get(o, 0) for o in opponents))
+        columns['sonneborn_berger'].append(
+            sum(wins.get(o, 0) for o in beaten.get(p, ())))
+    return columns
+
+
+def tiebreakRows(standings, matches, order=('wins', 'omw'), vectorized=None):
+    """Returns standings rows extended with tiebreakers, sorted.
+
+    Args:
+      standings:  playerStandings() tuples; only their ids and names are
+        used
+      matches:  the tournament's (winner, loser) tuples
+      order (optional):  the columns to rank by, highest first, before the
+        player id. The default ranks as playerStandings() does.
+      vectorized (optional):  as for computeTiebreaks
+
+    Returns:
+      A list of (id, name, wins, matches, omw, omw_pct, oomw_pct, buchholz,
+      sonneborn_berger) tuples.
+    """
+    for column in order:
+        if column not in COLUMNS:
+            raise ValueError("Unknown tiebreak column: %r." % (column,))
+    player_ids = [row[0] for row in standings]
+    columns = computeTiebreaks(player_ids, matches, vectorized)
+    rows = [(row[0], row[1]) + tuple(columns[name][i] for name in COLUMNS)
+            for (i, row) in enumerate(standings)]
+    positions = [COLUMNS.index(column) + 2 for column in order]
+    rows.sort(key=lambda row: tuple(-row[i] for i in positions) + (row[0],))
+    return rows
@@ -3,16 +3,164 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import multiprocessing
+import os
+import threading
+
 import psycopg2
-import bleach
+import export
+import instrumentation
+import pairing
+import planner
+import rounds
+import snapshot
+import tiebreaks
 import utils
+from instrumentation import instrumented
+from memory_session import MemorySession
+from queries import DSN
+from routing import RoutingSession
+from session import TournamentSession
+from sqlite_session import SQLiteSession
+
+_session = None
+_session_lock = threading.Lock()
 
 
+@instrumented
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    This always opens a new connection. The functions below borrow theirs
+    from the pool kept by the module's TournamentSession instead.
+    """
+    return psycopg2.connect(DSN)
+
+
+def newSession(backend=None, replicas=None):
+    """Returns a new session on one of the storage backends.
+
+    Args:
+      backend (optional):  'postgresql' for a pool of connect() connections,
+        'sqlite' for the SQLite file named by the TOURNAMENT_SQLITE_PATH
+        environment variable (tournament.db by default), or 'memory' to keep
+        everything in process. Defaults to the TOURNAMENT_BACKEND
+        environment variable, or 'postgresql' if it is not set.
+      replicas (optional):  for 'postgresql', the DSNs of read replicas to
+        send read-only calls to (see routing.RoutingSession). Defaults to
+        the TOURNAMENT_REPLICAS environment variable, a list of DSNs
+        separated by semicolons.
+
+    Returns:
+      A TournamentSession, SQLiteSession, MemorySession or, with replicas,
+      RoutingSession.
+    """
+    if backend is None:
+        backend = os.environ.get('TOURNAMENT_BACKEND', 'postgresql')
+    if backend == 'postgresql':
+        if replicas is None:
+            replicas = [dsn.strip() for dsn in
+                        os.environ.get('TOURNAMENT_REPLICAS', '').split(';')
+                        if dsn.strip()]
+        if not replicas:
+            return TournamentSession(connect)
+        return RoutingSession(TournamentSession(connect), [
+            TournamentSession(lambda dsn=dsn: psycopg2.connect(dsn),
+                              cache_entries=0, state_entries=0)
+            for dsn in replicas])
+    if backend == 'sqlite':
+        return SQLiteSession(
+            os.environ.get('TOURNAMENT_SQLITE_PATH', 'tournament.db'))
+    if backend == 'memory':
+        return MemorySession()
+    raise ValueError("Unknown storage backend: %r." % (backend,))
+
+
+def getSession():
+    """Returns the session used by the module-level functions.
+
+    The session is created by newSession() on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = newSession()
+        return _session
+
+
+def setSession(session):
+    """Replaces the session used by the module-level functions.
+
+    Args:
+      session:  a TournamentSession, SQLiteSession, MemorySession or
+        RoutingSession, or None to fall back to the default one on the
+        next call. The previous session's idle connections are closed.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None and _session is not session:
+            _session.close()
+        _session = session
+
+
+def cacheStats():
+    """Returns the counters of the session's standings cache.
+
+    Returns:
+      A dict with the number of cache hits, misses, evictions and
+      invalidations, and the entries and standings rows currently cached.
+    """
+    return getSession().cache.stats()
+
+
+def routingStats():
+    """Returns the read routing counters of a session with replicas.
+
+    Returns:
+      A dict with the reads made on each replica, the reads made on the
+      primary, how many of those were to read a tournament just changed and
+      how many fell back from a replica that failed. None if the session
+      has no replicas.
+    """
+    session = getSession()
+    if not isinstance(session, RoutingSession):
+        return None
+    return session.stats()
+
+
+def enableInstrumentation(log=False):
+    """Starts recording the module's calls, SQL statements and rows.
+
+    Recording is off by default and costs one check per call while off.
+    Enabling it again starts the figures from zero.
+
+    Args:
+      log (optional):  also log every call as a JSON record on the
+        'tournament' logger at INFO level
+    """
+    instrumentation.enable(log)
 
 
+def disableInstrumentation():
+    """Stops recording. stats() keeps returning what was recorded."""
+    instrumentation.disable()
+
+
+def stats():
+    """Returns what has been recorded since enableInstrumentation().
+
+    Returns:
+      A dict with the total 'statements' run, 'rows' fetched and
+      'connections' opened, and under 'functions' a dict by function name of
+      each one's 'calls', 'seconds', 'max_seconds', 'statements', 'rows' and
+      'connections'. A function's figures include the functions it calls,
+      and swissPairings' pairing step is recorded as 'pairing.<algorithm>'.
+      Empty if instrumentation has never been enabled.
+    """
+    return instrumentation.stats()
+
+
+@instrumented
 def createTournament(name):
     """Add a tournament to the database.
 
@@ -22,36 +170,64 @@ def createTournament(name):
     Returns:
       id_of_new_row:  the id of the newly created tournament
     """
-    DB = connect()
-    c = DB.cursor()
-    c.execute(
-        "INSERT INTO Tournaments (name) VALUES (%s) RETURNING id;",
-        (bleach.clean(name),))
-    id_of_new_row = c.fetchone()[0]
-    c.execute(
-        """INSERT INTO Tournaments_Players (tournament_id, player_id)
-        VALUES (%s, 0);""", (id_of_new_row,))
-    DB.commit()
-    DB.close()
-    return id_of_new_row
+    return getSession().createTournament(name)
 
 
+@instrumented
 def deleteTournaments():
     """Remove all the matches, players, and tournaments from the database."""
-    DB = connect()
-    c = DB.cursor()
-    query = "DELETE FROM Matches;"
-    c.execute(query)
-    query = "DELETE FROM Tournaments_Players;"
-    c.execute(query)
-    query = "DELETE FROM Players WHERE id <> 0;"
-    c.execute(query)
-    query = "DELETE FROM Tournaments;"
-    c.execute(query)
-    DB.commit()
-    DB.close()
+    getSession().deleteTournaments()
+
+
+@instrumented
+def deleteTournament(tournament_id):
+    """Remove one tournament, its matches and its registrations.
 
+    Only the tournament's own rows are touched. Its players' records are
+    kept; deletePlayers() removes them.
+
+    Args:
+      tournament_id:  the id of the tournament to delete
+    """
+    getSession().deleteTournament(tournament_id)
+
+
+@instrumented
+def archiveTournament(tournament_id):
+    """Move a finished tournament out of the tables used by play.
+
+    The tournament, its final standings (with each player's name) and its
+    matches are copied into the archive tables and then deleted as
+    deleteTournament() deletes them, all in one transaction.
+
+    Args:
+      tournament_id:  the id of the tournament to archive
 
+    Returns:
+      The number of matches archived.
+
+    Raises:
+      ValueError:  if there is no such tournament
+    """
+    return getSession().archiveTournament(tournament_id)
+
+
+@instrumented
+def archivedStandings(tournament_id):
+    """Returns the final standings of an archived tournament.
+
+    Args:
+      tournament_id:  the id of the archived tournament
+
+    Returns:
+      A list of (id, name, wins, matches, OMWs) tuples as playerStandings()
+      returned them when the tournament was archived, or an empty list if
+      it was not archived.
+    """
+    return getSession().archivedStandings(tournament_id)
+
+
+@instrumented
 def deleteMatches(tournament_id=0):
     """Remove all the match records for a tournament from the database.
 
@@ -59,30 +235,16 @@ def deleteMatches(tournament_id=0):
       tournament_id (optional):  the id of the tournament to delete matches
         from. Pass 0 or leave blank to delete all matches in the DB.
     """
-    DB = connect()
-    c = DB.cursor()
-    if tournament_id == 0:
-        query = "DELETE FROM Matches;"
-    else:
-        query = "DELETE FROM Matches WHERE tournament_id = %s;",
-        (tournament_id,)
-    c.execute(query)
-    DB.commit()
-    DB.close()
+    getSession().deleteMatches(tournament_id)
 
 
+@instrumented
 def deletePlayers():
     """Remove all the player records from the database except for 'Bye'."""
-    DB = connect()
-    c = DB.cursor()
-    query = "DELETE FROM Tournaments_Players;"
-    c.execute(query)
-    query = "DELETE FROM Players WHERE id <> 0;"
-    c.execute(query)
-    DB.commit()
-    DB.close()
+    getSession().deletePlayers()
 
 
+@instrumented
 def countPlayers(tournament_id=0):
     """Returns the number of players currently registered.
 
@@ -93,48 +255,86 @@ def countPlayers(tournament_id=0):
     Returns:
       number_of_players:  the player count
     """
-    DB = connect()
-    c = DB.cursor()
-    if tournament_id == 0:
-        c.execute("SELECT COUNT(id) as num FROM Players WHERE id <> 0;")
-    else:
-        c.execute(
-            """SELECT COUNT(player_id) as num FROM Tournaments_Players
-            WHERE tournament_id = %s AND player_id <> 0;""", (tournament_id,))
-    row = c.fetchone()
-    number_of_players = row[0]
-    DB.close()
-    return number_of_players
+    return getSession().countPlayers(tournament_id)
 
 
-def registerPlayer(tournament_id, name):
+@instrumented
+def registerPlayer(tournament_id, name, external_id=None):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
     should be handled by your SQL database schema, not in your Python code.)
+    A player registered with an external_id is added once: registering the
+    same external_id again, in any tournament, links to that player and
+    updates their name.
 
     Args:
       tournament_id:  the id of the tournament that the player will be
         registered in
       name:  the player's full name (need not be unique).
+      external_id (optional):  a string that identifies the person across
+        tournaments, such as a federation or membership number
 
     Returns:
-      id_of_new_row:  the id of the newly created player
+      id_of_new_row:  the id of the newly created (or linked) player
     """
-    DB = connect()
-    c = DB.cursor()
-    c.execute(
-        "INSERT INTO Players (name) VALUES (%s) RETURNING id;",
-        (bleach.clean(name),))
-    id_of_new_row = c.fetchone()[0]
-    c.execute(
-        """INSERT INTO Tournaments_Players (tournament_id, player_id)
-        VALUES (%s, %s);""", (tournament_id, id_of_new_row))
-    DB.commit()
-    DB.close()
-    return id_of_new_row
+    return getSession().registerPlayer(tournament_id, name, external_id)
+
+
+@instrumented
+def registerPlayers(tournament_id, names, external_ids=None):
+    """Adds many players to the tournament database at once.
 
+    All of the players are inserted in a single transaction, so either every
+    player is registered or none are.
 
+    Args:
+      tournament_id:  the id of the tournament that the players will be
+        registered in
+      names:  a list of the players' full names
+      external_ids (optional):  a list of an external id (or None) for each
+        name, as for registerPlayer
+
+    Returns:
+      ids:  a list of the new (or linked) players' ids, in the same order as
+        names
+
+    Raises:
+      ValueError:  if external_ids is not as long as names or repeats an id
+    """
+    return getSession().registerPlayers(tournament_id, names, external_ids)
+
+
+@instrumented
+def findPlayers(external_ids):
+    """Looks up the players registered under external ids, in one query.
+
+    Args:
+      external_ids:  a list of external ids
+
+    Returns:
+      A dict of (id, name) tuples by external id. Unknown ids are left out.
+    """
+    return getSession().findPlayers(external_ids)
+
+
+@instrumented
+def playerHistory(player_id):
+    """Returns a player's results in every tournament they are in.
+
+    Archived tournaments are included.
+
+    Args:
+      player_id:  the id of the player
+
+    Returns:
+      A list of (tournament_id, wins, matches, OMWs) tuples sorted by
+      tournament id.
+    """
+    return getSession().playerHistory(player_id)
+
+
+@instrumented
 def playerStandings(tournament_id):
     """Returns a list of the players and their win records, sorted by wins.
 
@@ -153,19 +353,29 @@ def playerStandings(tournament_id):
         opponent match wins:  the number of matches the player's opponents have
           won
     """
-    DB = connect()
-    c = DB.cursor()
-    c.execute("""SELECT id, name, wins, wins + losses AS matches
-       FROM v_WinsAndLosses WHERE tournament_id = %s;""", (tournament_id,))
-    rows = c.fetchall()
-    standings = [(row[0], str(row[1]), row[2], row[3],
-                 getOpponentMatchWins(tournament_id, row[0])) for row in rows]
-    DB.close()
-    # Sort the tuple by wins and opponent match wins
-    results = sorted(standings, key=lambda element: (-element[2], -element[4]))
-    return results
+    return getSession().playerStandings(tournament_id)
+
+
+@instrumented
+def rebuildStandings(tournament_id=0):
+    """Recomputes the standings of a tournament from its match records.
+
+    The standings are normally kept up to date as each match is reported.
+    This rebuilds them from scratch, which also verifies that they were
+    correct.
+
+    Args:
+      tournament_id (optional):  the id of the tournament to rebuild. Pass 0
+        or leave blank to rebuild every tournament in the DB.
+
+    Returns:
+      A list of (tournament_id, player_id) tuples for the rows that were out
+      of date. An empty list means the standings were already correct.
+    """
+    return getSession().rebuildStandings(tournament_id)
 
 
+@instrumented
 def reportMatch(tournament_id, winner, loser):
     """Records the outcome of a single match between two players.
 
@@ -174,15 +384,265 @@ def reportMatch(tournament_id, winner, loser):
       winner:  the id of the player who won
       loser:  the id of the player who lost
     """
-    DB = connect()
-    c = DB.cursor()
-    c.execute(
-        """INSERT INTO Matches (tournament_id, winner, loser)
-        VALUES (%s, %s, %s);""", (tournament_id, winner, loser))
-    DB.commit()
-    DB.close()
+    getSession().reportMatch(tournament_id, winner, loser)
+
 
+@instrumented
+def getMatches(tournament_id):
+    """Returns every match played in a tournament.
+
+    Args:
+      tournament_id:  the id of the tournament to get matches for
+
+    Returns:
+      A list of (winner, loser) tuples in the order they were reported. A
+      loser of 0 is a 'Bye'.
+    """
+    return getSession().getMatches(tournament_id)
+
+
+# The iter functions are generators that run their query as they are
+# iterated, so they are not instrumented themselves; the export functions
+# that consume them are.
+def iterStandings(tournament_id, fetch_size=1000):
+    """Yields a tournament's standings without holding them all in memory.
+
+    The rows are read from a server-side cursor fetch_size at a time, in
+    the order playerStandings() returns them. The connection is held until
+    the last row has been read or the generator is closed.
+
+    Args:
+      tournament_id:  the id of the tournament to get standings for
+      fetch_size (optional):  the number of rows fetched at a time
+
+    Returns:
+      An iterator of playerStandings() tuples.
+    """
+    return getSession().iterStandings(tournament_id, fetch_size)
+
+
+def iterMatches(tournament_id, fetch_size=1000):
+    """Yields a tournament's matches without holding them all in memory.
+
+    Args:
+      tournament_id:  the id of the tournament to get matches for
+      fetch_size (optional):  the number of rows fetched at a time
+
+    Returns:
+      An iterator of getMatches() tuples, in the order they were reported.
+    """
+    return getSession().iterMatches(tournament_id, fetch_size)
+
+
+def iterPlayers(tournament_id, fetch_size=1000, external_ids=False):
+    """Yields the players of a tournament without holding them all in memory.
+
+    Args:
+      tournament_id:  the id of the tournament to get players for
+      fetch_size (optional):  the number of rows fetched at a time
+      external_ids (optional):  True to add each player's external id, or
+        None if they have none
+
+    Returns:
+      An iterator of (id, name) tuples sorted by id, or of
+      (id, name, external_id) tuples with external_ids.
+    """
+    return getSession().iterPlayers(tournament_id, fetch_size, external_ids)
+
+
+@instrumented
+def exportStandings(tournament_id, out, format='csv', fetch_size=1000):
+    """Writes a tournament's standings to a file as they are read.
+
+    Args:
+      tournament_id:  the id of the tournament to export
+      out:  a file object open for writing
+      format (optional):  'csv' or 'jsonl'
+      fetch_size (optional):  the number of rows fetched at a time
 
+    Returns:
+      The number of rows written.
+
+    Raises:
+      ValueError:  if the format is unknown
+    """
+    return export.writeRows(iterStandings(tournament_id, fetch_size),
+                            export.STANDINGS_COLUMNS, out, format)
+
+
+@instrumented
+def exportMatches(tournament_id, out, format='csv', fetch_size=1000):
+    """Writes a tournament's matches to a file as they are read.
+
+    Args:
+      tournament_id:  the id of the tournament to export
+      out:  a file object open for writing
+      format (optional):  'csv' or 'jsonl'
+      fetch_size (optional):  the number of rows fetched at a time
+
+    Returns:
+      The number of rows written.
+
+    Raises:
+      ValueError:  if the format is unknown
+    """
+    return export.writeRows(iterMatches(tournament_id, fetch_size),
+                            export.MATCHES_COLUMNS, out, format)
+
+
+@instrumented
+def exportPlayers(tournament_id, out, format='csv', fetch_size=1000):
+    """Writes a tournament's players to a file as they are read.
+
+    Args:
+      tournament_id:  the id of the tournament to export
+      out:  a file object open for writing
+      format (optional):  'csv' or 'jsonl'
+      fetch_size (optional):  the number of rows fetched at a time
+
+    Returns:
+      The number of rows written.
+
+    Raises:
+      ValueError:  if the format is unknown
+    """
+    return export.writeRows(iterPlayers(tournament_id, fetch_size),
+                            export.PLAYERS_COLUMNS, out, format)
+
+
+@instrumented
+def saveSnapshot(tournament_id, path, name='', fetch_size=1000):
+    """Saves a tournament's players and matches to a snapshot file.
+
+    The rows, with the players' external ids, are streamed into packed
+    arrays (see snapshot.py). The file is written and synced to disk under
+    a temporary name and then renamed (see snapshot.replaceFile), so a
+    snapshot already at path is only ever replaced by a complete one. If
+    saving fails the temporary file is removed.
+
+    Args:
+      tournament_id:  the id of the tournament to save
+      path:  the path of the snapshot file
+      name (optional):  the tournament's name, kept in the snapshot
+      fetch_size (optional):  the number of rows fetched at a time
+
+    Returns:
+      A (players, matches) tuple of the numbers saved.
+    """
+    temporary = path + '.tmp'
+    try:
+        with getSession().cursor():
+            with open(temporary, 'wb') as out:
+                counts = snapshot.writeSnapshot(
+                    out, tournament_id,
+                    iterPlayers(tournament_id, fetch_size, True),
+                    iterMatches(tournament_id, fetch_size), name)
+                out.flush()
+                os.fsync(out.fileno())
+        snapshot.replaceFile(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return counts
+
+
+def openSnapshot(path):
+    """Maps a snapshot file for reading, without touching the database.
+
+    Args:
+      path:  the path of a file saveSnapshot() wrote
+
+    Returns:
+      A snapshot.Snapshot, whose standings(), graph() and planner() work
+      the tournament out from its arrays. Close it when done.
+
+    Raises:
+      ValueError:  if the file is not a snapshot
+    """
+    return snapshot.Snapshot(path)
+
+
+@instrumented
+def restoreSnapshot(path, name=None):
+    """Adds a tournament saved by saveSnapshot() back to the database.
+
+    The players are registered again under their external ids, so those
+    with one are linked to the player already registered under it, and the
+    rest get new ids. The matches are reported in their order, all in one
+    transaction.
+
+    Args:
+      path:  the path of the snapshot file
+      name (optional):  the new tournament's name. Defaults to the name
+        saved in the snapshot.
+
+    Returns:
+      The id of the new tournament.
+
+    Raises:
+      ValueError:  if the file is not a snapshot
+    """
+    with openSnapshot(path) as saved:
+        players = saved.players()
+        external_ids = saved.externalIds()
+        matches = saved.matches()
+        if name is None:
+            name = saved.name
+    with getSession().cursor():
+        tournament_id = createTournament(name)
+        new_ids = registerPlayers(tournament_id,
+                                  [player_name for (player_id, player_name)
+                                   in players], external_ids)
+        ids = dict(zip([player_id for (player_id, player_name) in players],
+                       new_ids))
+        ids[0] = 0
+        reportMatches(tournament_id, [(ids[winner], ids[loser])
+                                      for (winner, loser) in matches])
+    return tournament_id
+
+
+def watchStandings(tournament_ids):
+    """Returns a feed of the changes to tournaments' standings.
+
+    Iterating over the feed yields, as standings change, a
+    (tournament_id, deltas) tuple for each tournament with a list of
+    feed.StandingsDelta tuples, (id, name, wins, matches, OMWs, rank,
+    old_rank), for the players whose standings or rank changed. The feed
+    reads only those players again, so a display can follow a tournament
+    without polling playerStandings(). On PostgreSQL changes made by any
+    process are fed; on the other backends, those made through this
+    session.
+
+        with watchStandings([tournament_id]) as feed:
+            for (tournament_id, deltas) in feed:
+                ...
+
+    Args:
+      tournament_ids:  a list of the ids of the tournaments to follow
+
+    Returns:
+      A feed.StandingsFeed. poll(timeout) waits for the next changes for
+      at most timeout seconds; close() stops it.
+    """
+    return getSession().standingsFeed(tournament_ids)
+
+
+@instrumented
+def reportMatches(tournament_id, results):
+    """Records the outcomes of many matches at once.
+
+    All of the results are inserted in a single transaction, so either every
+    result is recorded or none are.
+
+    Args:
+      tournament_id:  the id of the tournament to add the matches to
+      results:  a list of (winner, loser) tuples of player ids
+    """
+    getSession().reportMatches(tournament_id, results)
+
+
+@instrumented
 def numberOfMatchesPlayed(tournament_id, player1_id, player2_id):
     """Returns the number of matches two players have played.
 
@@ -194,18 +654,10 @@ def numberOfMatchesPlayed(tournament_id, player1_id, player2_id):
     Returns:
       number_played:  the number of matches played between the two players
     """
-    DB = connect()
-    c = DB.cursor()
-    c.execute("""SELECT id FROM Matches
-            WHERE (winner = %s OR winner = %s)
-            AND (loser = %s OR loser = %s)
-            AND tournament_id = %s;""",
-              (player1_id, player2_id, player1_id, player2_id, tournament_id))
-    number_played = c.rowcount
-    DB.close()
-    return number_played
+    return getSession().numberOfMatchesPlayed(tournament_id, player1_id, player2_id)
 
 
+@instrumented
 def havePlayedBefore(tournament_id, player1_id, player2_id):
     """Returns true/false if players have played before.
 
@@ -224,6 +676,7 @@ def havePlayedBefore(tournament_id, player1_id, player2_id):
         return True
 
 
+@instrumented
 def hasBye(tournament_id, player_id):
     """ Returns true/false if player has had a 'Bye'.
 
@@ -234,17 +687,10 @@ def hasBye(tournament_id, player_id):
     Returns:
       has_bye:  boolean - whether or not the player has had a 'Bye'
     """
-
-    DB = connect()
-    c = DB.cursor()
-    c.execute("""SELECT id FROM Matches WHERE winner = %s
-              AND loser = 0 AND tournament_id = %s;""",
-              (player_id, tournament_id))
-    has_bye = True if c.rowcount > 0 else False
-    DB.close()
-    return has_bye
+    return getSession().hasBye(tournament_id, player_id)
 
 
+@instrumented
 def getOpponentMatchWins(tournament_id, player_id):
     """ Returns the total number of wins of all of a player's opponents.
 
@@ -255,34 +701,43 @@ def getOpponentMatchWins(tournament_id, player_id):
     Returns:
       opponent_match_wins:  the total number of wins of a player's opponents
     """
-    DB = connect()
-    c = DB.cursor()
-    # Get all matches the player has played
-    c.execute("""SELECT winner, loser FROM Matches
-              WHERE (winner = %s OR loser = %s) AND tournament_id = %s;""",
-              (player_id, player_id, tournament_id))
-    rows = c.fetchall()
-    # Loop through the result set and create a list of opponents
-    if len(rows) > 0:
-        opponents = []
-        for row in rows:
-            if row[0] == player_id:
-                opponents.append(row[1])
-            else:
-                opponents.append(row[0])
-        # Get the total number of wins for the players in the list
-        c.execute("""SELECT COUNT(winner) FROM Matches
-                  WHERE tournament_id = %s AND winner IN %s;""",
-                  (tournament_id, tuple(opponents)))
-        result = c.fetchone()
-        opponent_match_wins = result[0]
-    else:
-        opponent_match_wins = 0
-    DB.close()
-    return opponent_match_wins
+    return getSession().getOpponentMatchWins(tournament_id, player_id)
+
+
+@instrumented
+def tiebreakStandings(tournament_id, order=('wins', 'omw')):
+    """Returns the standings with every player's tiebreakers.
+
+    The tiebreakers are computed in one pass over the tournament's matches,
+    with NumPy when it is installed. By default the players are ranked as
+    playerStandings() ranks them.
+
+    Args:
+      tournament_id:  the id of the tournament to get standings for
+      order (optional):  the columns to rank by, highest first, before the
+        player id. Any of 'wins', 'matches', 'omw', 'omw_pct', 'oomw_pct',
+        'buchholz' and 'sonneborn_berger'.
+
+    Returns:
+      A list of tuples, each of which contains the (id, name, wins, matches,
+      OMWs) of playerStandings() followed by:
+        omw_pct:  the mean match-win percentage of the player's opponents
+        oomw_pct:  the mean omw_pct of the player's opponents
+        buchholz:  the sum of the player's opponents' wins
+        sonneborn_berger:  the sum of the wins of the opponents the player
+          beat
+
+    Raises:
+      ValueError:  if order names an unknown column
+    """
+    with getSession().cursor():
+        standings = playerStandings(tournament_id)
+        matches = getMatches(tournament_id)
+    return tiebreaks.tiebreakRows(standings, matches, order)
 
 
-def swissPairings(tournament_id):
+@instrumented
+def swissPairings(tournament_id, algorithm='greedy'):
     """Returns a list of pairs of players for the next round of a match.
 
     Each player appears once in the pairings. If there is an odd number of
@@ -292,6 +747,10 @@ def swissPairings(tournament_id):
 
     Args:
       tournament_id:  the id of the tournament to pair
+      algorithm (optional):  'greedy' pairs each player with the nearest
+        player below them they have not played. 'matching' uses a maximum
+        weight matching, which never leaves a player unpaired when a full
+        pairing without rematches exists.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -300,32 +759,232 @@ def swissPairings(tournament_id):
         id2:  the second player's unique id
         name2:  the second player's name
     """
-    standings = playerStandings(tournament_id)
-    # If we have an odd number of players, loop through
-    if len(standings) % 2 == 1:
-        for player in standings:
-            player_id = player[0]
-            # And give the first player who has not already had one a 'Bye'
-            if not hasBye(tournament_id, player_id):
-                reportMatch(tournament_id, player_id, 0)
-                # Remove the player from the list
-                standings = utils.tuple_without(standings, player)
-                break
-    # Create a list of tuples to return
-    pairings = []
-    # Loop over standings while it's populated
-    while len(standings) > 0:
-        # Put the first player in a variable and remove him from standings
-        first_player = standings[0]
-        standings = utils.tuple_without(standings, standings[0])
-        # Iterate through the standings minus the first player
-        for player in standings:
-            #  If the first player has not played the current player
-            if not havePlayedBefore(tournament_id, first_player[0], player[0]):
-                # Then we have our pair. Add them to the list.
-                pairings.append([first_player[0], str(first_player[1]),
-                                player[0], str(player[1])])
-                # And delete the current player from standings.
-                standings = utils.tuple_without(standings, player)
-                break
+    # Hold one connection for the whole pairing so the standings, the match
+    # history and the bye are all read and written in a single transaction.
+    with getSession().cursor():
+        bye, pairings = _pairField(tournament_id, algorithm)[:2]
+        if bye is not None:
+            reportMatch(tournament_id, bye.id, 0)
+        return pairings
+
+
+def _pairField(tournament_id, algorithm):
+    """Pairs a tournament's next round without writing anything.
+
+    Every rematch and bye check is made against the tournament's match
+    graph, which the session keeps between rounds and brings up to date
+    with only the matches recorded since it was last used.
+
+    Returns:
+      A (bye, pairings, matches_seen) tuple: the PlayerRecord of the player
+      who should get a 'Bye' (or None), the pairings as swissPairings returns
+      them, and the number of matches the tournament had.
+    """
+    if algorithm not in pairing.ALGORITHMS:
+        raise ValueError("Unknown pairing algorithm: %r." % (algorithm,))
+    session = getSession()
+    with session.cursor():
+        pool = utils.StandingsPool(playerStandings(tournament_id))
+        with session.pairingState(tournament_id) as state:
+            # If we have an odd number of players, the first player who has
+            # not already had one gets a 'Bye'
+            bye, pairings = instrumentation.call('pairing.' + algorithm,
+                                                 pairing.pairField, pool,
+                                                 state.graph, algorithm)
+            return bye, pairings, state.matches
+
+
+@instrumented
+def planPairings(tournament_id):
+    """Returns a planner for a tournament's next round.
+
+    The planner reads the standings and match graph once, here, and then
+    pairs the round under any number of hypothetical results without
+    touching the database.
+
+    Args:
+      tournament_id:  the id of the tournament
+
+    Returns:
+      A planner.PairingPlanner. Its plan(results, algorithm) returns the
+      (bye, pairings) swissPairings would give if the (winner, loser)
+      results were reported, and its standings(results) the standings.
+    """
+    session = getSession()
+    with session.cursor():
+        standings = playerStandings(tournament_id)
+        with session.pairingState(tournament_id) as state:
+            return planner.PairingPlanner(standings, state.graph)
+
+
+@instrumented
+def previewPairings(tournament_id, results=(), algorithm='greedy'):
+    """Returns the pairings swissPairings would give after some results,
+    without recording the results or the 'Bye'.
+
+    Args:
+      tournament_id:  the id of the tournament
+      results (optional):  hypothetical (winner, loser) tuples, such as a
+        Round's results() and the outcomes still to be played
+      algorithm (optional):  'greedy' or 'matching', as for swissPairings
+
+    Returns:
+      A (bye, pairings) tuple: the id of the player who would get a 'Bye',
+      or None, and the pairings.
+    """
+    return planPairings(tournament_id).plan(results, algorithm)
+
+
+@instrumented
+def checkPairingState(tournament_id):
+    """Checks the pairing state kept for a tournament against its matches.
+
+    The state is rebuilt from the Matches table, compared with the one kept
+    and replaced by the rebuilt one.
+
+    Args:
+      tournament_id:  the id of the tournament to check
+
+    Returns:
+      A sorted list of the differences found, empty if there were none:
+        ('opponents', player_id):  the player's opponents differed
+        ('byes', player_id):  whether the player had a 'Bye' differed
+        ('matches', 0):  the number of matches differed
+    """
+    return getSession().checkPairingState(tournament_id)
+
+
+def pairingStateStats():
+    """Returns the counters of the session's pairing states.
+
+    Returns:
+      A dict with the number of states brought up to date, rebuilt and
+      evicted, the number of matches applied to them, and the number of
+      tournaments' states currently kept.
+    """
+    return getSession().states.stats()
+
+
+@instrumented
+def swissPairingsMany(tournament_ids, algorithm='greedy', processes=None):
+    """Pairs the next round of many tournaments at once.
+
+    The standings and matches of every tournament are read with two
+    queries, the tournaments are paired in parallel across a pool of worker
+    processes, and every 'Bye' is recorded in one batched insert, all in a
+    single transaction. Each tournament is paired exactly as swissPairings
+    would pair it.
+
+    Args:
+      tournament_ids:  the ids of the tournaments to pair
+      algorithm (optional):  'greedy' or 'matching', as for swissPairings
+      processes (optional):  the number of worker processes. None uses one
+        per CPU; 1 pairs every tournament in this process.
+
+    Returns:
+      A dict of swissPairings() lists by tournament id.
+    """
+    if algorithm not in pairing.ALGORITHMS:
+        raise ValueError("Unknown pairing algorithm: %r." % (algorithm,))
+    # Each tournament once, in the order given
+    seen = set()
+    tournament_ids = [t for t in tournament_ids
+                      if not (t in seen or seen.add(t))]
+    session = getSession()
+    with session.cursor():
+        standings = session.standingsMany(tournament_ids)
+        matches = session.matchesMany(tournament_ids)
+        jobs = [(standings.get(t, []), matches.get(t, []), algorithm)
+                for t in tournament_ids]
+        results = instrumentation.call('pairing.' + algorithm + '.many',
+                                       _mapPairings, jobs, processes)
+        session.reportMatchesMany([(t, bye, 0) for (t, (bye, pairings))
+                                   in zip(tournament_ids, results)
+                                   if bye is not None])
+    return dict((t, pairings) for (t, (bye, pairings))
+                in zip(tournament_ids, results))
+
+
+def _mapPairings(jobs, processes):
+    """Runs pairing.pairTournament over jobs, in worker processes when
+    there is more than one job and more than one process to run them."""
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        return [pairing.pairTournament(job) for job in jobs]
+    workers = multiprocessing.Pool(processes)
+    try:
+        # A few chunks per worker keeps them busy when field sizes differ.
+        chunksize = max(1, len(jobs) // (processes * 4))
+        return workers.map(pairing.pairTournament, jobs, chunksize)
+    finally:
+        workers.close()
+        workers.join()
+
+
+@instrumented
+def startRound(tournament_id):
+    """Starts the next round of a tournament.
+
+    Nothing is written until the round is closed: pair it with pairRound(),
+    add its results with submitResults() and record it with closeRound().
+
+    Args:
+      tournament_id:  the id of the tournament
+
+    Returns:
+      A rounds.Round numbered one after the last round recorded.
+    """
+    return rounds.Round(tournament_id,
+                        getSession().lastRound(tournament_id) + 1)
+
+
+@instrumented
+def pairRound(round, algorithm='greedy'):
+    """Pairs a round as swissPairings does, without recording the 'Bye'.
+
+    The 'Bye' is recorded with the round's results by closeRound(). Pairing
+    a round again replaces its pairings and drops its results.
+
+    Args:
+      round:  a Round from startRound()
+      algorithm (optional):  'greedy' or 'matching', as for swissPairings
+
+    Returns:
+      A list of (id1, name1, id2, name2) pairs, as swissPairings returns.
+    """
+    bye, pairings, matches_seen = _pairField(round.tournament_id, algorithm)
+    round.setPairings(pairings, None if bye is None else bye.id,
+                      matches_seen)
     return pairings
+
+
+@instrumented
+def submitResults(round, results):
+    """Adds results to a round. Nothing is written until closeRound().
+
+    Args:
+      round:  a Round from startRound(), already paired
+      results:  a list of (winner, loser) tuples, each for one of the
+        round's pairs. Results may be submitted in several calls.
+    """
+    round.addResults(results)
+
+
+@instrumented
+def closeRound(round):
+    """Records a round's 'Bye' and results in a single transaction.
+
+    Every pair must have a result. If the tournament has had other matches
+    recorded since the round was paired, nothing is written. Closing a round
+    again, as when retrying after an error, does not record it twice.
+
+    Args:
+      round:  a Round from startRound(), paired and with all its results
+    """
+    if round.closed:
+        return
+    getSession().recordRound(round.tournament_id, round.number,
+                             round.matches(), round.matches_seen)
+    round.closed = True
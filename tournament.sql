@@ -9,12 +9,17 @@ CREATE DATABASE tournament;
 -- Connect to the DB
 \c tournament;
 
--- Create the players table
+-- Create the players table. A player registered with an external
+-- identifier (a federation or membership number, say) is linked to by every
+-- later registration under the same identifier instead of being added again.
 CREATE TABLE Players (
 	id serial primary key,
-	name text
+	name text,
+	external_id text
 );
 
+CREATE UNIQUE INDEX Players_external_id_idx ON Players (external_id);
+
 -- Insert a record for 'Bye'
 INSERT INTO Players (id, name) VALUES (0, 'Bye');
 
@@ -31,29 +36,262 @@ CREATE TABLE Tournaments_Players (
     primary key (tournament_id, player_id)
 );
 
--- Create the matches table
+-- Create the matches table. Matches recorded by closeRound() carry their
+-- round number; matches reported one at a time have none.
 CREATE TABLE Matches (
 	id serial primary key,
     tournament_id integer references Tournaments(id),
 	winner integer references Players(id),
-	loser integer references Players(id)
+	loser integer references Players(id),
+    round integer
 );
 
+-- Index the matches of a tournament by winner, by loser, by round and in
+-- the order they were recorded
+CREATE INDEX Matches_tournament_winner_idx ON Matches (tournament_id, winner);
+CREATE INDEX Matches_tournament_loser_idx ON Matches (tournament_id, loser);
+CREATE INDEX Matches_tournament_round_idx ON Matches (tournament_id, round);
+CREATE INDEX Matches_tournament_id_idx ON Matches (tournament_id, id);
+
 -- Create a view that returns tournament_id, id, name, wins, and losses for each player
+-- Only the matches of the player's own tournament are counted, so filtering
+-- on tournament_id reads that tournament's rows and nothing else.
 CREATE VIEW v_WinsAndLosses AS
-    SELECT w.tournament_id, w.id, w.name, w.wins, l.losses
-    FROM (
-        SELECT tp1.tournament_id, p1.id, p1.name, COUNT(m1.winner) AS wins
-        FROM ((Players p1 LEFT JOIN Tournaments_Players tp1 ON p1.id = tp1.player_id)
-        LEFT JOIN Matches m1 ON p1.id = m1.winner)
-        GROUP BY tp1.tournament_id, p1.id, p1.name
-    ) w
-    INNER JOIN (
-        SELECT tp2.tournament_id, p2.id, p2.name, COUNT(m2.loser) AS losses
-        FROM ((Players p2 LEFT JOIN Tournaments_Players tp2 ON p2.id = tp2.player_id)
-        LEFT JOIN Matches m2 ON p2.id = m2.loser)
-        GROUP BY tp2.tournament_id, p2.id, p2.name
-    ) l
-    ON w.id = l.id
-    WHERE w.id <> 0
-    ORDER BY w.wins DESC;
+    SELECT tp.tournament_id, p.id, p.name,
+        (SELECT COUNT(*) FROM Matches m
+         WHERE m.tournament_id = tp.tournament_id AND m.winner = p.id) AS wins,
+        (SELECT COUNT(*) FROM Matches m
+         WHERE m.tournament_id = tp.tournament_id AND m.loser = p.id) AS losses
+    FROM Tournaments_Players tp INNER JOIN Players p ON p.id = tp.player_id
+    WHERE p.id <> 0;
+
+-- Create a function that returns id, name, wins, and losses for each player
+-- in one tournament, aggregating only that tournament's matches
+CREATE FUNCTION f_WinsAndLosses(integer)
+RETURNS TABLE (id integer, name text, wins bigint, losses bigint) AS $$
+    SELECT p.id, p.name, COALESCE(w.wins, 0), COALESCE(l.losses, 0)
+    FROM Tournaments_Players tp
+    INNER JOIN Players p ON p.id = tp.player_id
+    LEFT JOIN (
+        SELECT winner, COUNT(*) AS wins FROM Matches
+        WHERE tournament_id = $1 GROUP BY winner
+    ) w ON w.winner = p.id
+    LEFT JOIN (
+        SELECT loser, COUNT(*) AS losses FROM Matches
+        WHERE tournament_id = $1 GROUP BY loser
+    ) l ON l.loser = p.id
+    WHERE tp.tournament_id = $1 AND p.id <> 0;
+$$ LANGUAGE sql STABLE;
+
+-- Create the standings table, which holds each player's wins, losses and
+-- opponent match wins and is kept up to date as matches are reported
+CREATE TABLE Standings (
+    tournament_id integer,
+    player_id integer,
+    wins integer NOT NULL DEFAULT 0,
+    losses integer NOT NULL DEFAULT 0,
+    omw integer NOT NULL DEFAULT 0,
+    primary key (tournament_id, player_id),
+    foreign key (tournament_id, player_id)
+        references Tournaments_Players (tournament_id, player_id)
+        ON DELETE CASCADE
+);
+
+CREATE INDEX Standings_order_idx
+    ON Standings (tournament_id, wins DESC, omw DESC, player_id);
+
+-- Index each player's standings across tournaments, for playerHistory()
+CREATE INDEX Standings_player_idx ON Standings (player_id);
+
+-- Give every player registered in a tournament an empty standings row
+CREATE FUNCTION f_StandingsPlayerInsert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO Standings (tournament_id, player_id)
+    VALUES (NEW.tournament_id, NEW.player_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsPlayerInsert
+    AFTER INSERT ON Tournaments_Players
+    FOR EACH ROW EXECUTE PROCEDURE f_StandingsPlayerInsert();
+
+-- Recompute the standings of one tournament (or of all when passed 0) from
+-- the Matches table. Returns the rows that were out of date.
+CREATE FUNCTION f_RebuildStandings(integer)
+RETURNS TABLE (tournament_id integer, player_id integer) AS $$
+    INSERT INTO Standings (tournament_id, player_id)
+    SELECT tp.tournament_id, tp.player_id FROM Tournaments_Players tp
+    WHERE ($1 = 0 OR tp.tournament_id = $1) AND NOT EXISTS (
+        SELECT 1 FROM Standings s
+        WHERE s.tournament_id = tp.tournament_id
+        AND s.player_id = tp.player_id
+    );
+    WITH m AS (
+        SELECT tournament_id, winner, loser FROM Matches
+        WHERE $1 = 0 OR tournament_id = $1
+    ), w AS (
+        SELECT tournament_id, winner AS id, COUNT(*) AS wins
+        FROM m GROUP BY tournament_id, winner
+    ), l AS (
+        SELECT tournament_id, loser AS id, COUNT(*) AS losses
+        FROM m GROUP BY tournament_id, loser
+    ), o AS (
+        SELECT tournament_id, winner AS id, loser AS opponent FROM m
+        UNION
+        SELECT tournament_id, loser, winner FROM m
+    ), omw AS (
+        SELECT o.tournament_id, o.id, SUM(w.wins) AS omw
+        FROM o JOIN w ON w.tournament_id = o.tournament_id
+        AND w.id = o.opponent
+        GROUP BY o.tournament_id, o.id
+    ), r AS (
+        SELECT s.tournament_id, s.player_id,
+            COALESCE(w.wins, 0) AS wins, COALESCE(l.losses, 0) AS losses,
+            COALESCE(omw.omw, 0) AS omw
+        FROM Standings s
+        LEFT JOIN w ON w.tournament_id = s.tournament_id
+            AND w.id = s.player_id
+        LEFT JOIN l ON l.tournament_id = s.tournament_id
+            AND l.id = s.player_id
+        LEFT JOIN omw ON omw.tournament_id = s.tournament_id
+            AND omw.id = s.player_id
+        WHERE $1 = 0 OR s.tournament_id = $1
+    )
+    UPDATE Standings s SET wins = r.wins, losses = r.losses, omw = r.omw
+    FROM r
+    WHERE s.tournament_id = r.tournament_id AND s.player_id = r.player_id
+    AND (s.wins, s.losses, s.omw) IS DISTINCT FROM (r.wins, r.losses, r.omw)
+    RETURNING s.tournament_id, s.player_id;
+$$ LANGUAGE sql;
+
+-- Update the standings for newly reported matches. For a single match the
+-- winner's extra win raises the OMW of each of their distinct opponents by
+-- one, and the first match between two players adds each one's wins to the
+-- other's OMW. A batch of matches rebuilds its tournaments' standings.
+--
+-- The tournaments are locked first, so matches reported at the same time
+-- update the standings one after another, each reading the last one's
+-- results. NO KEY UPDATE does not wait for the KEY SHARE lock the foreign
+-- key check of every other insert holds on the tournament.
+CREATE FUNCTION f_StandingsMatchInsert() RETURNS trigger AS $$
+DECLARE
+    m Matches%ROWTYPE;
+    n integer;
+BEGIN
+    PERFORM 1 FROM Tournaments
+    WHERE id IN (SELECT tournament_id FROM new_matches)
+    ORDER BY id FOR NO KEY UPDATE;
+    SELECT COUNT(*) INTO n FROM new_matches;
+    IF n > 1 THEN
+        PERFORM f_RebuildStandings(t.tournament_id)
+        FROM (SELECT DISTINCT tournament_id FROM new_matches) t;
+        RETURN NULL;
+    ELSIF n = 0 THEN
+        RETURN NULL;
+    END IF;
+    SELECT * INTO m FROM new_matches;
+    IF NOT EXISTS (
+        SELECT 1 FROM Matches
+        WHERE tournament_id = m.tournament_id AND id <> m.id
+        AND ((winner = m.winner AND loser = m.loser)
+             OR (winner = m.loser AND loser = m.winner))
+    ) THEN
+        UPDATE Standings s SET omw = s.omw + o.wins
+        FROM Standings o
+        WHERE s.tournament_id = m.tournament_id
+        AND o.tournament_id = m.tournament_id
+        AND ((s.player_id = m.winner AND o.player_id = m.loser)
+             OR (s.player_id = m.loser AND o.player_id = m.winner));
+    END IF;
+    UPDATE Standings SET wins = wins + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.winner;
+    UPDATE Standings SET losses = losses + 1
+    WHERE tournament_id = m.tournament_id AND player_id = m.loser;
+    UPDATE Standings SET omw = omw + 1
+    WHERE tournament_id = m.tournament_id AND player_id IN (
+        SELECT loser FROM Matches
+        WHERE tournament_id = m.tournament_id AND winner = m.winner
+        UNION
+        SELECT winner FROM Matches
+        WHERE tournament_id = m.tournament_id AND loser = m.winner
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsMatchInsert
+    AFTER INSERT ON Matches
+    REFERENCING NEW TABLE AS new_matches
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsMatchInsert();
+
+-- Tell the listeners on the 'standings' channel whose standings changed, as
+-- '<tournament_id> <player_id> ...', or as the tournament id alone when too
+-- many players changed to list. TRUNCATE sends '0', for every tournament.
+-- Notifications are only delivered when the transaction commits.
+CREATE FUNCTION f_StandingsNotify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('standings', '0');
+    ELSE
+        PERFORM pg_notify('standings', c.tournament_id || CASE
+            WHEN COUNT(*) <= 500 THEN
+                ' ' || string_agg(c.player_id::text, ' '
+                                  ORDER BY c.player_id)
+            ELSE '' END)
+        FROM changed c GROUP BY c.tournament_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_StandingsNotifyInsert
+    AFTER INSERT ON Standings
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+CREATE TRIGGER t_StandingsNotifyUpdate
+    AFTER UPDATE ON Standings
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+CREATE TRIGGER t_StandingsNotifyDelete
+    AFTER DELETE ON Standings
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+CREATE TRIGGER t_StandingsNotifyTruncate
+    AFTER TRUNCATE ON Standings
+    FOR EACH STATEMENT EXECUTE PROCEDURE f_StandingsNotify();
+
+-- Archived tournaments, moved out of the tables above by archiveTournament()
+-- so that they stay small. The archive keeps its own copy of each player's
+-- name and has no foreign keys, so players can be deleted afterwards.
+CREATE TABLE Archived_Tournaments (
+    id integer primary key,
+    name text
+);
+
+CREATE TABLE Archived_Standings (
+    tournament_id integer,
+    player_id integer,
+    name text,
+    wins integer NOT NULL,
+    losses integer NOT NULL,
+    omw integer NOT NULL,
+    primary key (tournament_id, player_id)
+);
+
+CREATE TABLE Archived_Matches (
+    id integer primary key,
+    tournament_id integer,
+    round integer,
+    winner integer,
+    loser integer
+);
+
+CREATE INDEX Archived_Matches_tournament_idx
+    ON Archived_Matches (tournament_id, id);
+
+CREATE INDEX Archived_Standings_player_idx
+    ON Archived_Standings (player_id);
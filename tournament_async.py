@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- an asyncio variant of tournament.py (Python 3 only)
+#
+# The public API of tournament.py, with every function a coroutine, bar the
+# SYNC_ONLY streams, rounds and batches below. It
+# runs psycopg2's asynchronous connections on the event loop, so one loop
+# can serve many tournaments at once without tying up a thread per query.
+# Statements and row shaping come from queries.py, as the blocking session's
+# do.
+#
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+
+import psycopg2
+import psycopg2.extensions
+
+import pairing
+import queries
+import tiebreaks
+import utils
+from cache import StandingsCache
+from pool import PoolTimeout
+from queries import DSN, cleanName
+
+_session = None
+
+# The public TournamentSession methods with no coroutine here: the streams,
+# the pairing state and rounds, the feeds and the many-tournament batches
+# are served by the blocking session, and the rest are class constants.
+SYNC_ONLY = frozenset([
+    'DELETE_ALL_MATCHES', 'DELETE_PLAYERS', 'DELETE_TOURNAMENTS',
+    'LOCK_TOURNAMENT', 'STATEMENTS', 'checkPairingState', 'iterMatches',
+    'iterPlayers', 'iterStandings', 'lastRound', 'matchesMany',
+    'matchesSince', 'pairingState', 'recordRound', 'reportMatchesMany',
+    'standingsFeed', 'standingsMany', 'standingsOf'])
+
+# The public AsyncTournamentSession methods with no blocking counterpart.
+ASYNC_ONLY = frozenset(['playerStandingsMany', 'swissPairings'])
+
+
+async def _wait(DB):
+    """Waits on the event loop until an asynchronous connection is ready."""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = DB.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("Bad poll state: %s." % state)
+        ready = loop.create_future()
+        add(DB.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(DB.fileno())
+
+
+class AsyncCursor(object):
+    """A psycopg2 cursor on an asynchronous connection whose execute() is
+    awaited. Rows are fetched exactly as from a blocking cursor."""
+
+    def __init__(self, DB):
+        self._DB = DB
+        self._cursor = DB.cursor()
+
+    async def execute(self, query, args=None):
+        self._cursor.execute(query, args)
+        await _wait(self._DB)
+
+    async def executeValues(self, query, rows, template):
+        """Runs a 'VALUES %s' statement for many rows in one round trip.
+
+        psycopg2.extras.execute_values blocks, so the VALUES list is
+        composed here with mogrify() instead.
+        """
+        encoding = psycopg2.extensions.encodings[self._DB.encoding]
+        values = ",".join(self._cursor.mogrify(template, row).decode(encoding)
+                          for row in rows)
+        await self.execute(query.replace("%s", values, 1))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class AsyncConnectionPool(object):
+    """A bounded pool of asynchronous psycopg2 connections for one event loop.
+
+    Args:
+      dsn:  the connection string passed to psycopg2.connect()
+      maxconn:  the most connections the pool will have open at once
+      maxidle (optional):  the most idle connections kept for reuse
+    """
+
+    def __init__(self, dsn, maxconn=8, maxidle=None):
+        if maxconn < 1:
+            raise ValueError("maxconn must be at least 1.")
+        self._dsn = dsn
+        self.maxconn = maxconn
+        self.maxidle = maxconn if maxidle is None else maxidle
+        self._idle = []
+        self._in_use = 0
+        self._cond = None
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+
+    def _condition(self):
+        # Created on first use so the pool can be built outside the loop.
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def checkout(self, timeout=None):
+        """Returns a connection, opening one if the pool has room.
+
+        Args:
+          timeout (optional):  seconds to wait for a connection to be
+            returned when maxconn are already in use. None waits forever.
+        """
+        cond = self._condition()
+        async with cond:
+            try:
+                await asyncio.wait_for(
+                    cond.wait_for(
+                        lambda: self._idle or self._in_use < self.maxconn),
+                    timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeout(
+                    "No connection became free within %s seconds." % timeout)
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self.checkouts += 1
+        if conn is not None and not conn.closed:
+            return conn
+        try:
+            conn = psycopg2.connect(self._dsn, async_=1)
+            await _wait(conn)
+        except BaseException:
+            await self._release()
+            raise
+        self.connections_opened += 1
+        return conn
+
+    async def checkin(self, conn, discard=False):
+        """Returns a connection to the pool, closing it if discard is true,
+        it is still busy or the pool already holds maxidle idle ones."""
+        if (discard or conn.closed or conn.isexecuting() or
+                len(self._idle) >= self.maxidle):
+            self._close(conn)
+        else:
+            self._idle.append(conn)
+        await self._release()
+
+    async def _release(self):
+        cond = self._condition()
+        async with cond:
+            self._in_use -= 1
+            cond.notify()
+
+    def closeAll(self):
+        """Closes every idle connection."""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Returns a dict of the pool's counters and current size."""
+        return {'in_use': self._in_use,
+                'idle': len(self._idle),
+                'connections_opened': self.connections_opened,
+                'connections_closed': self.connections_closed,
+                'checkouts': self.checkouts}
+
+    def _close(self, conn):
+        if not conn.closed:
+            conn.close()
+        self.connections_closed += 1
+
+
+# The connection a task is using and the tournaments its open transaction
+# has changed.
+_Transaction = collections.namedtuple('_Transaction', 'DB invalidated')
+
+
+class AsyncTournamentSession(object):
+    """Runs the tournament queries over a pool of asynchronous connections.
+
+    The asyncio counterpart of session.TournamentSession. Calls made while
+    the same task already holds a connection (swissPairings calling
+    playerStandings and reportMatch, for instance) share that connection
+    and its transaction. A connection runs one statement at a time, so
+    tasks started inside a transaction must not run queries concurrently
+    with it.
+
+    Args:
+      dsn (optional):  the connection string passed to psycopg2.connect()
+      cache_entries (optional):  the most tournaments' standings cached.
+        Pass 0 to disable the cache.
+      cache_rows (optional):  the most standings rows cached in total
+      **pool_args:  passed through to AsyncConnectionPool
+    """
+
+    def __init__(self, dsn=DSN, cache_entries=128, cache_rows=100000,
+                 **pool_args):
+        self.pool = AsyncConnectionPool(dsn, **pool_args)
+        self.cache = StandingsCache(cache_entries, cache_rows)
+        self._current = contextvars.ContextVar('transaction', default=None)
+
+    @contextlib.asynccontextmanager
+    async def cursor(self):
+        """Yields an AsyncCursor, committing (or rolling back) when the block
+        ends.
+
+        Only the outermost block in a task checks a connection out of the
+        pool and commits; nested blocks run inside the same transaction.
+        """
+        current = self._current.get()
+        if current is not None:
+            yield AsyncCursor(current.DB)
+            return
+        DB = await self.pool.checkout()
+        current = _Transaction(DB, set())
+        token = self._current.set(current)
+        broken = False
+        try:
+            c = AsyncCursor(DB)
+            await c.execute("BEGIN;")
+            yield c
+            await c.execute("COMMIT;")
+        except BaseException:
+            # A cancelled task can leave a statement running.
+            if DB.isexecuting():
+                broken = True
+            else:
+                try:
+                    await AsyncCursor(DB).execute("ROLLBACK;")
+                except Exception:
+                    broken = True
+            raise
+        finally:
+            self._current.reset(token)
+            await self.pool.checkin(DB, discard=broken)
+            for tournament_id in current.invalidated:
+                self.cache.invalidate(tournament_id)
+
+    def _invalidate(self, tournament_id=0):
+        """Drops a tournament's cached standings (every tournament's when 0)
+        once the current transaction ends."""
+        self._current.get().invalidated.add(tournament_id)
+
+    def _cacheable(self, tournament_id):
+        """Returns true/false if this task may use the cached standings,
+        which it may not once its open transaction has changed them."""
+        current = self._current.get()
+        return current is None or (tournament_id not in current.invalidated
+                                   and 0 not in current.invalidated)
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+        self.pool.closeAll()
+
+    async def createTournament(self, name):
+        """Adds a tournament and returns its id."""
+        async with self.cursor() as c:
+            await c.execute(queries.CREATE_TOURNAMENT, (cleanName(name),))
+            id_of_new_row = c.fetchone()[0]
+            await c.execute(queries.REGISTER_BYE, (id_of_new_row,))
+        return id_of_new_row
+
+    async def deleteTournaments(self):
+        """Removes all the matches, players, and tournaments."""
+        async with self.cursor() as c:
+            for query in queries.DELETE_TOURNAMENTS:
+                await c.execute(query)
+            self._invalidate()
+
+    async def deleteMatches(self, tournament_id=0):
+        """Removes the matches of one tournament, or of all when 0."""
+        async with self.cursor() as c:
+            if tournament_id == 0:
+                for query in queries.DELETE_ALL_MATCHES:
+                    await c.execute(query)
+            else:
+                for query in queries.DELETE_MATCHES:
+                    await c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+
+    async def deleteTournament(self, tournament_id):
+        """Removes one tournament with its matches and registrations."""
+        async with self.cursor() as c:
+            for query in queries.DELETE_TOURNAMENT:
+                await c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+
+    async def archiveTournament(self, tournament_id):
+        """Moves a tournament into the archive tables.
+
+        Returns:
+          The number of matches archived.
+
+        Raises:
+          ValueError:  if there is no such tournament
+        """
+        async with self.cursor() as c:
+            await c.execute(queries.ARCHIVE_TOURNAMENT[0], (tournament_id,))
+            if c.rowcount == 0:
+                raise ValueError("There is no tournament %d to archive." %
+                                 tournament_id)
+            for query in queries.ARCHIVE_TOURNAMENT[1:]:
+                await c.execute(query, (tournament_id,))
+            archived = c.rowcount
+            for query in queries.DELETE_TOURNAMENT:
+                await c.execute(query, (tournament_id,))
+            self._invalidate(tournament_id)
+        return archived
+
+    async def archivedStandings(self, tournament_id):
+        """Returns an archived tournament's final playerStandings()."""
+        async with self.cursor() as c:
+            await c.execute(queries.ARCHIVED_STANDINGS, (tournament_id,))
+            standings = queries.standingsRows(c.fetchall())
+        return standings
+
+    async def deletePlayers(self):
+        """Removes all the player records except for 'Bye'."""
+        async with self.cursor() as c:
+            for query in queries.DELETE_PLAYERS:
+                await c.execute(query)
+            self._invalidate()
+
+    async def countPlayers(self, tournament_id=0):
+        """Returns the number of players in a tournament, or in all when 0."""
+        async with self.cursor() as c:
+            if tournament_id == 0:
+                await c.execute(queries.COUNT_ALL_PLAYERS)
+            else:
+                await c.execute(queries.COUNT_PLAYERS, (tournament_id,))
+            number_of_players = c.fetchone()[0]
+        return number_of_players
+
+    async def registerPlayer(self, tournament_id, name, external_id=None):
+        """Adds a player to a tournament and returns the player's id, which
+        is that of the player already registered under external_id if
+        there is one."""
+        async with self.cursor() as c:
+            if external_id is None:
+                await c.execute(queries.INSERT_PLAYER, (cleanName(name),))
+            else:
+                await c.execute(queries.UPSERT_PLAYER,
+                                (cleanName(name), external_id))
+            id_of_new_row = c.fetchone()[0]
+            await c.execute(queries.REGISTER_PLAYER,
+                            (tournament_id, id_of_new_row))
+            self._invalidate(tournament_id)
+        return id_of_new_row
+
+    async def registerPlayers(self, tournament_id, names, external_ids=None):
+        """Adds many players to a tournament; returns their ids in order.
+
+        Names with an external id are linked to the player already
+        registered under it, if there is one.
+        """
+        external_ids = queries.externalIds(names, external_ids)
+        if not names:
+            return []
+        new = [(cleanName(name),)
+               for (name, e) in zip(names, external_ids) if e is None]
+        known = [(cleanName(name), e)
+                 for (name, e) in zip(names, external_ids) if e is not None]
+        async with self.cursor() as c:
+            new_ids = []
+            if new:
+                await c.executeValues(queries.INSERT_PLAYERS, new, "(%s)")
+                # Serial ids are handed out in insert order.
+                new_ids = sorted(row[0] for row in c.fetchall())
+            linked = {}
+            if known:
+                await c.executeValues(queries.UPSERT_PLAYERS, known,
+                                      "(%s, %s)")
+                linked = dict(c.fetchall())
+            new_ids = iter(new_ids)
+            ids = [next(new_ids) if e is None else linked[e]
+                   for e in external_ids]
+            await c.executeValues(queries.REGISTER_PLAYERS,
+                                  [(tournament_id, i) for i in ids],
+                                  "(%s, %s)")
+            self._invalidate(tournament_id)
+        return ids
+
+    async def findPlayers(self, external_ids):
+        """Returns a dict of (id, name) by external id for the players
+        registered under any of external_ids."""
+        if not external_ids:
+            return {}
+        async with self.cursor() as c:
+            await c.execute(queries.FIND_PLAYERS, (tuple(external_ids),))
+            rows = c.fetchall()
+        return dict((row[0], (row[1], str(row[2]))) for row in rows)
+
+    async def playerHistory(self, player_id):
+        """Returns (tournament_id, wins, matches, OMWs) tuples, by tournament
+        id, for every live and archived tournament a player is in."""
+        async with self.cursor() as c:
+            await c.execute(queries.PLAYER_HISTORY, (player_id, player_id))
+            history = c.fetchall()
+        return history
+
+    async def playerStandings(self, tournament_id):
+        """Returns (id, name, wins, matches, OMWs) tuples sorted by wins."""
+        cacheable = self._cacheable(tournament_id)
+        if cacheable:
+            standings = self.cache.get(tournament_id)
+            if standings is not None:
+                return standings
+            token = self.cache.token(tournament_id)
+        async with self.cursor() as c:
+            await c.execute(queries.STANDINGS, (tournament_id,))
+            standings = queries.standingsRows(c.fetchall())
+        if cacheable:
+            self.cache.put(tournament_id, standings, token)
+        return standings
+
+    async def playerStandingsMany(self, tournament_ids):
+        """Reads the standings of many tournaments concurrently.
+
+        Each tournament is read in its own task on its own pooled
+        connection, outside any transaction the caller has open.
+
+        Returns:
+          A dict of playerStandings() lists by tournament id.
+        """
+        async def detached(tournament_id):
+            # The task runs in a copy of the caller's context.
+            self._current.set(None)
+            return await self.playerStandings(tournament_id)
+        tournament_ids = list(tournament_ids)
+        results = await asyncio.gather(
+            *[detached(tournament_id) for tournament_id in tournament_ids])
+        return dict(zip(tournament_ids, results))
+
+    async def rebuildStandings(self, tournament_id=0):
+        """Recomputes the Standings table from Matches; returns the
+        (tournament_id, player_id) rows that were out of date."""
+        async with self.cursor() as c:
+            await c.execute(queries.REBUILD_STANDINGS, (tournament_id,))
+            stale = c.fetchall()
+            if stale:
+                self._invalidate(tournament_id)
+        return stale
+
+    async def reportMatch(self, tournament_id, winner, loser):
+        """Records the outcome of a single match between two players."""
+        async with self.cursor() as c:
+            await c.execute(queries.INSERT_MATCH,
+                            (tournament_id, winner, loser))
+            self._invalidate(tournament_id)
+
+    async def getMatches(self, tournament_id):
+        """Returns (winner, loser) tuples for every match in a tournament."""
+        async with self.cursor() as c:
+            await c.execute(queries.MATCHES, (tournament_id,))
+            matches = c.fetchall()
+        return matches
+
+    async def reportMatches(self, tournament_id, results):
+        """Records many (winner, loser) results in one transaction."""
+        if not results:
+            return
+        async with self.cursor() as c:
+            await c.executeValues(
+                queries.INSERT_MATCHES,
+                [(tournament_id, None, winner, loser)
+                 for (winner, loser) in results],
+                "(%s, %s, %s, %s)")
+            self._invalidate(tournament_id)
+
+    async def numberOfMatchesPlayed(self, tournament_id, player1_id,
+                                    player2_id):
+        """Returns the number of matches two players have played."""
+        async with self.cursor() as c:
+            await c.execute(queries.MATCHES_BETWEEN,
+                            (player1_id, player2_id, player1_id, player2_id,
+                             tournament_id))
+            number_played = c.rowcount
+        return number_played
+
+    async def hasBye(self, tournament_id, player_id):
+        """Returns true/false if the player has had a 'Bye'."""
+        async with self.cursor() as c:
+            await c.execute(queries.BYES, (player_id, tournament_id))
+            has_bye = c.rowcount > 0
+        return has_bye
+
+    async def getOpponentMatchWins(self, tournament_id, player_id):
+        """Returns the total number of wins of all of a player's opponents."""
+        async with self.cursor() as c:
+            await c.execute(queries.PLAYER_MATCHES,
+                            (player_id, player_id, tournament_id))
+            opponents = queries.opponents(player_id, c.fetchall())
+            if len(opponents) == 0:
+                return 0
+            await c.execute(queries.OPPONENT_WINS,
+                            (tournament_id, tuple(opponents)))
+            opponent_match_wins = c.fetchone()[0]
+        return opponent_match_wins
+
+    async def swissPairings(self, tournament_id, algorithm='greedy'):
+        """Returns the next round's pairs, giving a 'Bye' on an odd field."""
+        if algorithm not in pairing.ALGORITHMS:
+            raise ValueError("Unknown pairing algorithm: %r." % (algorithm,))
+        async with self.cursor():
+            pool = utils.StandingsPool(
+                await self.playerStandings(tournament_id))
+            graph = pairing.MatchGraph(await self.getMatches(tournament_id))
+            # Paired as the blocking session pairs; only the reads and the
+            # 'Bye' are made on the event loop
+            bye, pairings = pairing.pairField(pool, graph, algorithm)
+            if bye is not None:
+                await self.reportMatch(tournament_id, bye.id, 0)
+            return pairings
+
+
+def getSession():
+    """Returns the AsyncTournamentSession used by the module-level functions.
+
+    The session is created on first use. Its pool belongs to the event loop
+    that first uses it.
+    """
+    global _session
+    if _session is None:
+        _session = AsyncTournamentSession()
+    return _session
+
+
+def setSession(session):
+    """Replaces the AsyncTournamentSession used by the module-level
+    functions, closing the previous session's idle connections.
+
+    Args:
+      session:  an AsyncTournamentSession, or None to fall back to the
+        default one on the next call
+    """
+    global _session
+    if _session is not None and _session is not session:
+        _session.close()
+    _session = session
+
+
+def cacheStats():
+    """Returns the counters of the session's standings cache."""
+    return getSession().cache.stats()
+
+
+async def createTournament(name):
+    """Add a tournament to the database; returns its id."""
+    return await getSession().createTournament(name)
+
+
+async def deleteTournaments():
+    """Remove all the matches, players, and tournaments from the database."""
+    await getSession().deleteTournaments()
+
+
+async def deleteMatches(tournament_id=0):
+    """Remove the match records of a tournament, or of all when 0."""
+    await getSession().deleteMatches(tournament_id)
+
+
+async def deleteTournament(tournament_id):
+    """Remove one tournament with its matches and registrations."""
+    await getSession().deleteTournament(tournament_id)
+
+
+async def archiveTournament(tournament_id):
+    """Moves a tournament into the archive tables; returns the number of
+    matches archived."""
+    return await getSession().archiveTournament(tournament_id)
+
+
+async def archivedStandings(tournament_id):
+    """Returns an archived tournament's final playerStandings()."""
+    return await getSession().archivedStandings(tournament_id)
+
+
+async def deletePlayers():
+    """Remove all the player records from the database except for 'Bye'."""
+    await getSession().deletePlayers()
+
+
+async def countPlayers(tournament_id=0):
+    """Returns the number of players in a tournament, or in all when 0."""
+    return await getSession().countPlayers(tournament_id)
+
+
+async def registerPlayer(tournament_id, name, external_id=None):
+    """Adds a player to a tournament; returns the player's id.
+
+    See tournament.registerPlayer.
+    """
+    return await getSession().registerPlayer(tournament_id, name, external_id)
+
+
+async def registerPlayers(tournament_id, names, external_ids=None):
+    """Adds many players to a tournament in one transaction; returns their
+    ids in the same order as names."""
+    return await getSession().registerPlayers(tournament_id, names,
+                                              external_ids)
+
+
+async def findPlayers(external_ids):
+    """Returns a dict of (id, name) by external id for the players
+    registered under any of external_ids."""
+    return await getSession().findPlayers(external_ids)
+
+
+async def playerHistory(player_id):
+    """Returns (tournament_id, wins, matches, OMWs) tuples for every live
+    and archived tournament a player is in."""
+    return await getSession().playerHistory(player_id)
+
+
+async def playerStandings(tournament_id):
+    """Returns (id, name, wins, matches, OMWs) tuples sorted by wins."""
+    return await getSession().playerStandings(tournament_id)
+
+
+async def playerStandingsMany(tournament_ids):
+    """Returns a dict of playerStandings() by tournament id, reading the
+    tournaments concurrently."""
+    return await getSession().playerStandingsMany(tournament_ids)
+
+
+async def tiebreakStandings(tournament_id, order=('wins', 'omw')):
+    """Returns the standings with every player's tiebreakers.
+
+    See tournament.tiebreakStandings.
+    """
+    async with getSession().cursor():
+        standings = await playerStandings(tournament_id)
+        matches = await getMatches(tournament_id)
+    return tiebreaks.tiebreakRows(standings, matches, order)
+
+
+async def rebuildStandings(tournament_id=0):
+    """Recomputes the standings from the match records; returns the
+    (tournament_id, player_id) rows that were out of date."""
+    return await getSession().rebuildStandings(tournament_id)
+
+
+async def reportMatch(tournament_id, winner, loser):
+    """Records the outcome of a single match between two players."""
+    await getSession().reportMatch(tournament_id, winner, loser)
+
+
+async def getMatches(tournament_id):
+    """Returns (winner, loser) tuples for every match in a tournament."""
+    return await getSession().getMatches(tournament_id)
+
+
+async def reportMatches(tournament_id, results):
+    """Records many (winner, loser) results in one transaction."""
+    await getSession().reportMatches(tournament_id, results)
+
+
+async def numberOfMatchesPlayed(tournament_id, player1_id, player2_id):
+    """Returns the number of matches two players have played."""
+    return await getSession().numberOfMatchesPlayed(
+        tournament_id, player1_id, player2_id)
+
+
+async def havePlayedBefore(tournament_id, player1_id, player2_id):
+    """Returns true/false if players have played before."""
+    return await numberOfMatchesPlayed(
+        tournament_id, player1_id, player2_id) > 0
+
+
+async def hasBye(tournament_id, player_id):
+    """Returns true/false if player has had a 'Bye'."""
+    return await getSession().hasBye(tournament_id, player_id)
+
+
+async def getOpponentMatchWins(tournament_id, player_id):
+    """Returns the total number of wins of all of a player's opponents."""
+    return await getSession().getOpponentMatchWins(tournament_id, player_id)
+
+
+async def swissPairings(tournament_id, algorithm='greedy'):
+    """Returns a list of (id1, name1, id2, name2) pairs for the next round.
+
+    See tournament.swissPairings.
+    """
+    return await getSession().swissPairings(tournament_id, algorithm)
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py, the scenarios of tournament_test.py
+
+import asyncio
+
+import session
+from tournament_async import *
+
+
+async def testDeleteMatches():
+    await deleteMatches()
+    print("1. Old matches can be deleted.")
+
+
+async def testDelete():
+    await deleteMatches()
+    await deletePlayers()
+    print("2. Player records can be deleted.")
+
+
+async def testCount():
+    await deleteMatches()
+    await deletePlayers()
+    c = await countPlayers()
+    if c == '0':
+        raise TypeError(
+            "countPlayers() should return numeric zero, not string '0'.")
+    if c != 0:
+        raise ValueError("After deleting, countPlayers should return zero.")
+    print("3. After deleting, countPlayers() returns zero.")
+
+
+async def testRegister():
+    await deleteMatches()
+    await deletePlayers()
+    tourney_id = await createTournament("Swiss Spectacular")
+    await registerPlayer(tourney_id, "Chandra Nalaar")
+    c = await countPlayers(tourney_id)
+    if c != 1:
+        raise ValueError(
+            "After one player registers, countPlayers() should be 1.")
+    print("4. After registering a player, countPlayers() returns 1.")
+
+
+async def testRegisterCountDelete():
+    # await deleteMatches()
+    # await deletePlayers()
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    await registerPlayer(tourney_id, "Markov Chaney")
+    await registerPlayer(tourney_id, "Joe Malik")
+    await registerPlayer(tourney_id, "Mao Tsu-hsi")
+    await registerPlayer(tourney_id, "Atlanta Hope")
+    c = await countPlayers(tourney_id)
+    if c != 4:
+        raise ValueError(
+            "After registering four players, countPlayers should be 4.")
+    await deletePlayers()
+    c = await countPlayers()
+    if c != 0:
+        raise ValueError("After deleting, countPlayers should return zero.")
+    print("5. Players can be registered and deleted.")
+
+
+async def testStandingsBeforeMatches():
+    # await deleteMatches()
+    # await deletePlayers()
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    await registerPlayer(tourney_id, "Melpomene Murray")
+    await registerPlayer(tourney_id, "Randy Schwartz")
+    standings = await playerStandings(tourney_id)
+    if len(standings) < 2:
+        raise ValueError("Players should appear in playerStandings even before "
+                         "they have played any matches.")
+    elif len(standings) > 2:
+        raise ValueError("Only registered players should appear in standings.")
+    if len(standings[0]) != 5:
+        raise ValueError("Each playerStandings row should have five columns.")
+    [(id1, name1, wins1, matches1, OMWs1), (id2, name2, wins2, matches2, OMWs2)] = standings
+    if matches1 != 0 or matches2 != 0 or wins1 != 0 or wins2 != 0:
+        raise ValueError(
+            "Newly registered players should have no matches or wins.")
+    if set([name1, name2]) != set(["Melpomene Murray", "Randy Schwartz"]):
+        raise ValueError("Registered players' names should appear in standings, "
+                         "even if they have no matches played.")
+    print("6. Newly registered players appear in the standings with no matches.")
+
+
+async def testReportMatches():
+    # await deleteMatches()
+    # await deletePlayers()
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    await registerPlayer(tourney_id, "Bruno Walton")
+    await registerPlayer(tourney_id, "Boots O'Neal")
+    await registerPlayer(tourney_id, "Cathy Burton")
+    await registerPlayer(tourney_id, "Diane Grant")
+    standings = await playerStandings(tourney_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    await reportMatch(tourney_id, id1, id2)
+    await reportMatch(tourney_id, id3, id4)
+    standings = await playerStandings(tourney_id)
+    for (i, n, w, m, o) in standings:
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+        elif i in (id2, id4) and w != 0:
+            raise ValueError(
+                "Each match loser should have zero wins recorded.")
+    print("7. After a match, players have updated standings.")
+
+
+async def testPairings():
+    # await deleteMatches()
+    # await deletePlayers()
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    await registerPlayer(tourney_id, "Twilight Sparkle")
+    await registerPlayer(tourney_id, "Fluttershy")
+    await registerPlayer(tourney_id, "Applejack")
+    await registerPlayer(tourney_id, "Pinkie Pie")
+    standings = await playerStandings(tourney_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    await reportMatch(tourney_id, id1, id2)
+    await reportMatch(tourney_id, id3, id4)
+    pairings = await swissPairings(tourney_id)
+    if len(pairings) != 2:
+        raise ValueError(
+            "For four players, swissPairings should return two pairs.")
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4)] = pairings
+    correct_pairs = set([frozenset([id1, id3]), frozenset([id2, id4])])
+    actual_pairs = set([frozenset([pid1, pid2]), frozenset([pid3, pid4])])
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "After one match, players with one win should be paired.")
+    print("8. After one match, players with one win are paired.")
+
+
+async def testNoRematches():
+    await deleteTournaments()
+    tourney_id = await createTournament("Flintstones Tourney")
+    fred_id = await registerPlayer(tourney_id, "Fred Flintstone")
+    barney_id = await registerPlayer(tourney_id, "Barney Rubble")
+    wilma_id = await registerPlayer(tourney_id, "Wilma Flintstone")
+    betty_id = await registerPlayer(tourney_id, "Betty Rubble")
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, barney_id, fred_id)
+    await reportMatch(tourney_id, barney_id, fred_id)
+    await reportMatch(tourney_id, wilma_id, betty_id)
+    # Fred 3W, Barney 2W, Wilma 1W, Betty 0W
+    # Since Fred and Barney have played, Fred should play Wilma and
+    # Barney should play Betty
+    pairings = await swissPairings(tourney_id)
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4)] = pairings
+    correct_pairs = set([frozenset([fred_id, wilma_id]),
+                        frozenset([barney_id, betty_id])])
+    actual_pairs = set([frozenset([pid1, pid2]),
+                        frozenset([pid3, pid4])])
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "Players should not rematch. Standing are incorrect.")
+    print("9. Rematches between players are prevented.")
+
+
+async def testBye():
+    await deleteTournaments()
+    tourney_id = await createTournament("Flintstones Tourney")
+    await registerPlayer(tourney_id, "Fred Flintstone")
+    await registerPlayer(tourney_id, "Barney Rubble")
+    await registerPlayer(tourney_id, "Wilma Flintstone")
+    await registerPlayer(tourney_id, "Betty Rubble")
+    await registerPlayer(tourney_id, "Pebbles Flinstone")
+    pairings = await swissPairings(tourney_id)
+    if len(pairings) != 2:
+        raise ValueError(
+            "For five players, swissPairings should return two pairs.")
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4)] = pairings
+    # Play a round according to the pairings
+    await reportMatch(tourney_id, pid1, pid2)
+    await reportMatch(tourney_id, pid3, pid4)
+    standings = await playerStandings(tourney_id)
+    number_of_byes = 0
+    # Check to see that each player has played one match and count the
+    # numer of byes
+    for player in standings:
+        if player[3] != 1:
+            raise ValueError(
+                "Each player should have played one match after the first round.")
+        if await hasBye(tourney_id, player[0]):
+            number_of_byes += 1
+    if number_of_byes != 1:
+        raise ValueError(
+                "One player should have a bye after the first round.")
+    print("10. After one round of five players, each player has played one", "match and one player has a bye.")
+
+
+async def testOpponentMatchWins():
+    await deleteTournaments()
+    tourney_id = await createTournament("Flintstones Tourney")
+    fred_id = await registerPlayer(tourney_id, "Fred Flintstone")
+    barney_id = await registerPlayer(tourney_id, "Barney Rubble")
+    wilma_id = await registerPlayer(tourney_id, "Wilma Flintstone")
+    pebbles_id = await registerPlayer(tourney_id, "Pebbles Flintstone")
+    bambam_id = await registerPlayer(tourney_id, "Bam Bam Rubble")
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, fred_id, barney_id)
+    await reportMatch(tourney_id, barney_id, fred_id)
+    await reportMatch(tourney_id, barney_id, fred_id)
+    await reportMatch(tourney_id, fred_id, wilma_id)
+    await reportMatch(tourney_id, barney_id, pebbles_id)
+    await reportMatch(tourney_id, fred_id, bambam_id)
+    await reportMatch(tourney_id, barney_id, bambam_id)
+    # Fred 5W, Barney 4W, Wilma 0W, Pebbles 0W, Bam Bam 0W
+    # Bam Bam 9 OMW, Wilma 5 OMW, Pebbles 4 OMW
+    standings = await playerStandings(tourney_id)
+    (id1, id2, id3, id4, id5) = (row[0] for row in standings)
+    correct_order = (fred_id, barney_id, bambam_id, wilma_id, pebbles_id)
+    actual_order = (id1, id2, id3, id4, id5)
+    if correct_order != actual_order:
+        raise ValueError(
+            "Player standings have not obeyed Opponent Match Win rules.")
+    print("11. Opponent Match Win rules have been observed in standings.")
+
+
+async def testMultipleTournaments():
+    await deleteTournaments()
+    # Flinstones tourney
+    flinstones_tourney_id = await createTournament("Flintstones Tourney")
+    fred_id = await registerPlayer(flinstones_tourney_id, "Fred Flintstone")
+    barney_id = await registerPlayer(flinstones_tourney_id, "Barney Rubble")
+    wilma_id = await registerPlayer(flinstones_tourney_id, "Wilma Flintstone")
+    betty_id = await registerPlayer(flinstones_tourney_id, "Betty Rubble")
+    pebbles_id = await registerPlayer(flinstones_tourney_id, "Pebbles Flintstone")
+    bambam_id = await registerPlayer(flinstones_tourney_id, "Bam Bam Rubble")
+    # Space Ghost tourney
+    space_ghost_tourney_id = await createTournament("Space Ghost Tourney")
+    space_ghost_id = await registerPlayer(space_ghost_tourney_id, "Space Ghost")
+    zorak_id = await registerPlayer(space_ghost_tourney_id, "Zorak")
+    brak_id = await registerPlayer(space_ghost_tourney_id, "Brak")
+    moltar_id = await registerPlayer(space_ghost_tourney_id, "Moltar")
+    # Player counts
+    flinstones_count = await countPlayers(flinstones_tourney_id)
+    space_ghost_count = await countPlayers(space_ghost_tourney_id)
+    # Standings
+    flintstones_standings = await playerStandings(flinstones_tourney_id)
+    space_ghost_standings = await playerStandings(space_ghost_tourney_id)
+    # Check that the counts are correct
+    if flinstones_count != 6:
+        raise ValueError(
+            "After registering six players, countPlayers should be 6.")
+    if space_ghost_count != 4:
+        raise ValueError(
+            "After registering four players, countPlayers should be 4.")
+    # Check to see that the players in each tourney are correct
+    [fid1, fid2, fid3, fid4, fid5, fid6] = [row[0] for row in flintstones_standings]
+    flinstones_correct_players = set([fred_id, barney_id, wilma_id,
+                                      betty_id, pebbles_id, bambam_id])
+    flinstones_actual_players = set([fid1, fid2, fid3, fid4, fid5, fid6])
+    [sgid1, sgid2, sgid3, sgid4] = [row[0] for row in space_ghost_standings]
+    space_ghost_correct_players = set([space_ghost_id, zorak_id,
+                                       brak_id, moltar_id])
+    space_ghost_actual_players = set([sgid1, sgid2, sgid3, sgid4])
+    if flinstones_correct_players != flinstones_actual_players:
+        raise ValueError("Players in the Flintstones standings are incorrect.")
+    if space_ghost_correct_players != space_ghost_actual_players:
+        raise ValueError("Players in the Space Ghost standings are incorrect.")
+    print("12. Multiple tournaments can be stored simultaneously.")
+
+
+async def testStandingsOpponentMatchWins():
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    other_id = await createTournament("Other Tourney")
+    ids = [await registerPlayer(tourney_id, "Player %d" % i) for i in range(6)]
+    other_ids = [await registerPlayer(other_id, "Other %d" % i) for i in range(2)]
+    await reportMatch(tourney_id, ids[0], ids[1])
+    await reportMatch(tourney_id, ids[0], ids[1])
+    await reportMatch(tourney_id, ids[2], ids[3])
+    await reportMatch(tourney_id, ids[0], ids[2])
+    await reportMatch(tourney_id, ids[4], ids[5])
+    await reportMatch(tourney_id, ids[1], ids[4])
+    await reportMatch(tourney_id, ids[5], 0)
+    await reportMatch(other_id, other_ids[0], other_ids[1])
+    for (i, n, w, m, o) in await playerStandings(tourney_id):
+        if o != await getOpponentMatchWins(tourney_id, i):
+            raise ValueError(
+                "Standings should agree with getOpponentMatchWins().")
+    if await rebuildStandings() != []:
+        raise ValueError(
+            "Rebuilding the standings should find nothing out of date.")
+    await deleteMatches(tourney_id)
+    for (i, n, w, m, o) in await playerStandings(tourney_id):
+        if w != 0 or m != 0 or o != 0:
+            raise ValueError(
+                "After deleting matches, standings should be empty.")
+    other_wins = [w for (i, n, w, m, o) in await playerStandings(other_id)]
+    if other_wins != [1, 0] or await rebuildStandings() != []:
+        raise ValueError(
+            "Deleting one tournament's matches should not touch another's.")
+    print("13. Standings agree with getOpponentMatchWins() and a rebuild.")
+
+
+async def testMatchingPairings():
+    await deleteTournaments()
+    tourney_id = await createTournament("Flintstones Tourney")
+    fred_id = await registerPlayer(tourney_id, "Fred Flintstone")
+    barney_id = await registerPlayer(tourney_id, "Barney Rubble")
+    wilma_id = await registerPlayer(tourney_id, "Wilma Flintstone")
+    betty_id = await registerPlayer(tourney_id, "Betty Rubble")
+    await reportMatch(tourney_id, fred_id, wilma_id)
+    await reportMatch(tourney_id, barney_id, betty_id)
+    await reportMatch(tourney_id, wilma_id, betty_id)
+    # Fred, Wilma and Barney have one win each and Wilma has played Betty,
+    # so pairing Fred with Barney would strand Wilma and Betty
+    pairings = await swissPairings(tourney_id, algorithm='matching')
+    if len(pairings) != 2:
+        raise ValueError(
+            "The matching algorithm should pair every player.")
+    correct_pairs = set([frozenset([fred_id, betty_id]),
+                        frozenset([barney_id, wilma_id])])
+    actual_pairs = set([frozenset([pid1, pid2])
+                        for (pid1, pname1, pid2, pname2) in pairings])
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "The matching algorithm should pair without rematches.")
+    print("14. The matching algorithm pairs every player without rematches.")
+
+
+async def testBulkRegisterAndReport():
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    names = ["Player %d" % i for i in range(8)]
+    ids = await registerPlayers(tourney_id, names)
+    if await countPlayers(tourney_id) != 8 or len(set(ids)) != 8:
+        raise ValueError("registerPlayers should register every player.")
+    standings = await playerStandings(tourney_id)
+    if [n for (i, n, w, m, o) in sorted(standings)] != names:
+        raise ValueError("registerPlayers should return ids in name order.")
+    await reportMatches(tourney_id, [(ids[0], ids[1]), (ids[2], ids[3]),
+                               (ids[4], ids[5]), (ids[6], ids[7])])
+    for (i, n, w, m, o) in await playerStandings(tourney_id):
+        if m != 1 or w != (1 if ids.index(i) % 2 == 0 else 0):
+            raise ValueError("reportMatches should record every result.")
+    print("15. Players and results can be registered and reported in bulk.")
+
+
+async def testStandingsCache():
+    await deleteTournaments()
+    tourney_id = await createTournament("Swiss Spectacular")
+    id1 = await registerPlayer(tourney_id, "Bruno Walton")
+    id2 = await registerPlayer(tourney_id, "Boots O'Neal")
+    await playerStandings(tourney_id)
+    hits = cacheStats()['hits']
+    await playerStandings(tourney_id)
+    if cacheStats()['hits'] != hits + 1:
+        raise ValueError("Repeated playerStandings should hit the cache.")
+    await reportMatch(tourney_id, id1, id2)
+    [(pid1, n1, w1, m1, o1), (pid2, n2, w2, m2, o2)] = \
+        await playerStandings(tourney_id)
+    if (pid1, w1, m1, pid2, w2, m2) != (id1, 1, 1, id2, 0, 1):
+        raise ValueError("reportMatch should invalidate cached standings.")
+    id3 = await registerPlayer(tourney_id, "Cathy Burton")
+    if len(await playerStandings(tourney_id)) != 3:
+        raise ValueError("registerPlayer should invalidate cached standings.")
+    await deleteMatches(tourney_id)
+    if [w for (i, n, w, m, o) in await playerStandings(tourney_id)] != [0, 0, 0]:
+        raise ValueError("deleteMatches should invalidate cached standings.")
+    print("16. Standings are cached until the tournament changes.")
+
+
+async def testConcurrentStandings():
+    await deleteTournaments()
+    tourney_ids = [await createTournament("Tourney %d" % t) for t in range(8)]
+    for (t, tourney_id) in enumerate(tourney_ids):
+        ids = await registerPlayers(
+            tourney_id, ["Player %d" % i for i in range(t + 2)])
+        await reportMatch(tourney_id, ids[-1], ids[0])
+    many = await playerStandingsMany(tourney_ids)
+    for (t, tourney_id) in enumerate(tourney_ids):
+        standings = many[tourney_id]
+        if len(standings) != t + 2 or standings[0][2] != 1:
+            raise ValueError(
+                "playerStandingsMany should read every tournament's standings.")
+    if getSession().pool.stats()['in_use'] != 0:
+        raise ValueError("Every connection should be back in the pool.")
+    print("17. Standings of many tournaments can be read concurrently.")
+
+
+async def testArchive():
+    await deleteTournaments()
+    kept = await createTournament("Kept Tourney")
+    finished = await createTournament("Finished Tourney")
+    deleted = await createTournament("Deleted Tourney")
+    for tourney_id in (kept, finished, deleted):
+        await registerPlayers(tourney_id, ["Player %d" % i for i in range(5)])
+        for round_number in range(2):
+            await reportMatches(tourney_id, [
+                (id1, id2) for (id1, n1, id2, n2)
+                in await swissPairings(tourney_id)])
+    kept_standings = await playerStandings(kept)
+    final_standings = await playerStandings(finished)
+    if await archiveTournament(finished) != len(await getMatches(kept)):
+        raise ValueError("archiveTournament should return the number of "
+                         "matches archived.")
+    if await archivedStandings(finished) != final_standings:
+        raise ValueError("archivedStandings should return the standings as "
+                         "they were when archived.")
+    await deleteTournament(deleted)
+    for tourney_id in (finished, deleted):
+        if await playerStandings(tourney_id) or await getMatches(tourney_id):
+            raise ValueError("Archived and deleted tournaments should leave "
+                             "no standings or matches.")
+    if await playerStandings(kept) != kept_standings:
+        raise ValueError("Archiving and deleting a tournament should not "
+                         "change the others.")
+    try:
+        await archiveTournament(finished)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Archiving a tournament twice should raise a "
+                         "ValueError.")
+    print("18. Tournaments can be deleted and archived one at a time.")
+
+
+async def testExternalIds():
+    await deleteTournaments()
+    first = await createTournament("First Open")
+    second = await createTournament("Second Open")
+    ann, bob, cid = await registerPlayers(first, ["Ann", "Bob", "Cid"],
+                                          ["A-1", "B-2", None])
+    if await registerPlayer(second, "Ann Smith", "A-1") != ann:
+        raise ValueError("Registering an external id again should link to "
+                         "the same player.")
+    bob2, dee = await registerPlayers(second, ["Bob", "Dee"], ["B-2", "D-4"])
+    if bob2 != bob or dee in (ann, bob, cid):
+        raise ValueError("registerPlayers should link known external ids "
+                         "and add the others.")
+    if await countPlayers() != 4:
+        raise ValueError("Linked players should not be added again.")
+    if (await findPlayers(["A-1", "D-4", "X-9"]) !=
+            {"A-1": (ann, "Ann Smith"), "D-4": (dee, "Dee")}):
+        raise ValueError("findPlayers should return the id and latest name "
+                         "of each known external id.")
+    await reportMatch(first, ann, bob)
+    await reportMatch(second, ann, bob)
+    await archiveTournament(first)
+    if await playerHistory(bob) != [(first, 0, 1, 1), (second, 0, 1, 1)]:
+        raise ValueError("playerHistory should list a player's live and "
+                         "archived tournaments.")
+    print("19. Players registered under an external id are linked.")
+
+
+async def testTiebreaks():
+    await deleteTournaments()
+    tourney_id = await createTournament("Tiebreak Tourney")
+    await registerPlayers(tourney_id, ["A", "B", "C", "D", "E"])
+    ids = dict((name, id) for (id, name, w, m, omw)
+               in await playerStandings(tourney_id))
+    await reportMatches(tourney_id, [(ids[w], ids[l]) for (w, l) in
+                                     [("A", "B"), ("C", "D"), ("A", "C"),
+                                      ("E", "B")]])
+    rows = await tiebreakStandings(tourney_id)
+    if [row[:5] for row in rows] != await playerStandings(tourney_id):
+        raise ValueError(
+            "tiebreakStandings should start with playerStandings' columns.")
+    if ([row[1] for row in await tiebreakStandings(tourney_id, ("buchholz",))]
+            [0] != "B"):
+        raise ValueError("tiebreakStandings should rank by the given order.")
+    print("20. Tiebreakers are computed from the standings and matches.")
+
+
+async def testParity():
+    def public(cls):
+        return set(name for name in dir(cls) if not name.startswith('_'))
+    blocking = public(session.TournamentSession)
+    asynchronous = public(AsyncTournamentSession)
+    if blocking - asynchronous != SYNC_ONLY:
+        raise ValueError("Only SYNC_ONLY should be missing from "
+                         "AsyncTournamentSession, not: %s" %
+                         sorted((blocking - asynchronous) ^ SYNC_ONLY))
+    if asynchronous - blocking != ASYNC_ONLY:
+        raise ValueError("Only ASYNC_ONLY should be missing from "
+                         "TournamentSession, not: %s" %
+                         sorted((asynchronous - blocking) ^ ASYNC_ONLY))
+    print("21. The async session has every method of the blocking one.")
+
+
+async def main():
+    await testDeleteMatches()
+    await testDelete()
+    await testCount()
+    await testRegister()
+    await testRegisterCountDelete()
+    await testStandingsBeforeMatches()
+    await testReportMatches()
+    await testPairings()
+    await testNoRematches()
+    await testBye()
+    await testOpponentMatchWins()
+    await testMultipleTournaments()
+    await testStandingsOpponentMatchWins()
+    await testMatchingPairings()
+    await testBulkRegisterAndReport()
+    await testStandingsCache()
+    await testConcurrentStandings()
+    await testArchive()
+    await testExternalIds()
+    await testTiebreaks()
+    await testParity()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
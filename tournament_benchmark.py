@@ -0,0 +1,1206 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py
+#
+# Usage:  python tournament_benchmark.py <benchmark> [--players N] [--rounds N]
+#
+# Each benchmark wipes the tournament database before it runs, so point it at
+# a scratch database and not at one holding real events.
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import export
+import pairing
+import queries
+import tiebreaks
+import tournament
+import utils
+from routing import RoutingSession
+from session import TournamentSession
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no allocation tracing; memory columns read n/a.
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows; the simulation reports no peak RSS there.
+    resource = None
+
+
+def playRounds(tourney_id, rounds, rng, on_round=None):
+    """Pairs and plays a number of rounds with random winners.
+
+    Args:
+      tourney_id:  the id of the tournament to play
+      rounds:  the number of rounds to play
+      rng:  a random.Random used to decide every match
+      on_round (optional):  called with the round number after each round
+    """
+    for round_number in range(1, rounds + 1):
+        for (id1, name1, id2, name2) in tournament.swissPairings(tourney_id):
+            if rng.random() < 0.5:
+                id1, id2 = id2, id1
+            tournament.reportMatch(tourney_id, id1, id2)
+        if on_round is not None:
+            on_round(round_number)
+
+
+def newTournament(players):
+    """Wipes the database and registers a fresh tournament's players.
+
+    Returns:
+      tourney_id:  the id of the new tournament
+    """
+    tournament.deleteTournaments()
+    tourney_id = tournament.createTournament("Benchmark")
+    for i in range(players):
+        tournament.registerPlayer(tourney_id, "Player %d" % i)
+    return tourney_id
+
+
+def benchPool(args):
+    """Connections opened and wall time per round, unpooled vs pooled."""
+    sessions = (("unpooled", {'maxidle': 0}), ("pooled", {}))
+    print("%-10s %6s %12s %12s" % ("session", "round", "connections",
+                                   "seconds"))
+    for label, pool_args in sessions:
+        session = TournamentSession(tournament.connect, **pool_args)
+        tournament.setSession(session)
+        tourney_id = newTournament(args.players)
+        state = {'opened': session.pool.connections_opened,
+                 'started': time.time()}
+
+        def report(round_number):
+            opened = session.pool.connections_opened
+            now = time.time()
+            print("%-10s %6d %12d %12.3f" % (
+                label, round_number, opened - state['opened'],
+                now - state['started']))
+            state.update(opened=opened, started=now)
+
+        playRounds(tourney_id, args.rounds, random.Random(args.seed), report)
+    tournament.setSession(None)
+
+
+def playRoundsAtomically(tourney_id, rounds, rng):
+    """playRounds through the Round API, one transaction per round."""
+    for round_number in range(rounds):
+        this_round = tournament.startRound(tourney_id)
+        results = []
+        for (id1, name1, id2, name2) in tournament.pairRound(this_round):
+            if rng.random() < 0.5:
+                id1, id2 = id2, id1
+            results.append((id1, id2))
+        tournament.submitResults(this_round, results)
+        tournament.closeRound(this_round)
+
+
+def benchRound(args):
+    """Round trips and wall time per round, per-match commits vs the Round
+    API's single transaction."""
+    print("%-12s %8s %12s %12s" % ("api", "rounds", "round trips",
+                                   "seconds"))
+    for label, play in (("per match", playRounds),
+                        ("round", playRoundsAtomically)):
+        recorder = CallRecorder()
+        tournament.setSession(TournamentSession(countingConnect(recorder)))
+        tourney_id = newTournament(args.players)
+        started = time.time()
+        recorder.call(label, play, tourney_id, args.rounds,
+                      random.Random(args.seed))
+        elapsed = time.time() - started
+        print("%-12s %8d %12d %12.3f" % (
+            label, args.rounds, recorder.round_trips[label], elapsed))
+    tournament.setSession(None)
+
+
+def benchMany(args):
+    """swissPairings one tournament at a time vs swissPairingsMany across
+    worker processes, on the same late round of many tournaments."""
+    tournaments = args.tournaments or 64
+
+    def setUp():
+        tournament.deleteTournaments()
+        ids = []
+        for t in range(tournaments):
+            tourney_id = tournament.createTournament("Benchmark %d" % t)
+            tournament.registerPlayers(
+                tourney_id, ["Player %d" % i for i in range(args.players)])
+            ids.append(tourney_id)
+        rng = random.Random(args.seed)
+        for round_number in range(args.rounds):
+            paired = tournament.swissPairingsMany(ids, args.algorithm, 1)
+            for tourney_id in ids:
+                results = []
+                for (id1, name1, id2, name2) in paired[tourney_id]:
+                    if rng.random() < 0.5:
+                        id1, id2 = id2, id1
+                    results.append((id1, id2))
+                tournament.reportMatches(tourney_id, results)
+        return ids
+
+    def sequential(ids):
+        return dict((t, tournament.swissPairings(t, args.algorithm))
+                    for t in ids)
+
+    cpus = multiprocessing.cpu_count()
+    runs = [("sequential", sequential)]
+    for processes in sorted(set([1, 2, 4, cpus])):
+        runs.append(("%d processes" % processes,
+                     lambda ids, p=processes: tournament.swissPairingsMany(
+                         ids, args.algorithm, p)))
+    print("%d CPUs, %d tournaments of %d players, %s pairing" % (
+        cpus, tournaments, args.players, args.algorithm))
+    print("%-14s %12s %10s" % ("run", "seconds", "identical"))
+    expected = None
+    for label, run in runs:
+        ids = setUp()
+        started = time.time()
+        paired = run(ids)
+        elapsed = time.time() - started
+        # Ids differ between set ups; compare names in tournament order.
+        paired = [[(name1, name2) for (id1, name1, id2, name2) in paired[t]]
+                  for t in ids]
+        if expected is None:
+            expected = paired
+        print("%-14s %12.3f %10s" % (label, elapsed, paired == expected))
+
+
+def benchState(args):
+    """Rows read and seconds spent pairing, with the pairing state rebuilt
+    every round vs kept between rounds."""
+    print("%-10s %8s %8s %12s %12s" % ("state", "players", "rounds",
+                                       "rows read", "seconds"))
+    for label, state_entries in (("rebuilt", 0), ("kept", 128)):
+        tournament.setSession(TournamentSession(tournament.connect,
+                                                state_entries=state_entries))
+        tourney_id = newTournament(args.players)
+        tournament.enableInstrumentation()
+        rng = random.Random(args.seed)
+        for round_number in range(args.rounds):
+            results = []
+            for (id1, name1, id2, name2) in tournament.swissPairings(
+                    tourney_id):
+                if rng.random() < 0.5:
+                    id1, id2 = id2, id1
+                results.append((id1, id2))
+            tournament.reportMatches(tourney_id, results)
+        tournament.disableInstrumentation()
+        record = tournament.stats()['functions']['swissPairings']
+        print("%-10s %8d %8d %12d %12.3f" % (
+            label, args.players, args.rounds, record['rows'],
+            record['seconds']))
+    tournament.setSession(None)
+
+
+def lookUpPlayers(tourney_id):
+    """Asks the per-player questions a pairing tool asks between rounds."""
+    player_ids = [row[0] for row in tournament.playerStandings(tourney_id)]
+    for (i, player_id) in enumerate(player_ids):
+        tournament.hasBye(tourney_id, player_id)
+        tournament.getOpponentMatchWins(tourney_id, player_id)
+        tournament.havePlayedBefore(tourney_id, player_id,
+                                    player_ids[i - 1])
+
+
+def planningMilliseconds(c, statement, params):
+    """Returns the planning time EXPLAIN ANALYZE reports for a statement."""
+    c.execute("EXPLAIN (ANALYZE) " + statement, params)
+    for (line,) in c.fetchall():
+        if line.startswith("Planning Time:"):
+            return float(line.split()[2])
+    return 0.0
+
+
+def hotQueries(tourney_id, player_ids):
+    """The hot queries with the arguments of a round's lookups."""
+    yield (queries.STANDINGS, (tourney_id,))
+    yield (queries.MATCHES, (tourney_id,))
+    yield (queries.COUNT_MATCHES, (tourney_id,))
+    for (i, player_id) in enumerate(player_ids):
+        other_id = player_ids[i - 1]
+        yield (queries.BYES, (player_id, tourney_id))
+        yield (queries.PLAYER_MATCHES, (player_id, player_id, tourney_id))
+        yield (queries.OPPONENT_WINS, (tourney_id, (player_id, other_id)))
+        yield (queries.MATCHES_BETWEEN,
+               (player_id, other_id, player_id, other_id, tourney_id))
+
+
+def benchPrepared(args):
+    """Wall time of a full tournament run, and the planning time EXPLAIN
+    ANALYZE reports for one round's hot queries, with the hot queries sent
+    as text vs run as prepared statements."""
+    print("%-10s %8s %8s %12s %14s" % ("queries", "players", "rounds",
+                                       "seconds", "planning ms"))
+    for label, prepare in (("text", False), ("prepared", True)):
+        session = TournamentSession(tournament.connect, prepare=prepare)
+        tournament.setSession(session)
+        tourney_id = newTournament(args.players)
+        started = time.time()
+        playRounds(tourney_id, args.rounds, random.Random(args.seed),
+                   lambda round_number: lookUpPlayers(tourney_id))
+        elapsed = time.time() - started
+        planning = 0.0
+        with session.cursor() as c:
+            c.execute(queries.STANDINGS, (tourney_id,))
+            player_ids = [row[0] for row in c.fetchall()]
+            for (query, params) in hotQueries(tourney_id, player_ids):
+                if prepare:
+                    # Prepares the statement if this connection has not yet
+                    c.execute(query, params)
+                    query = session.statements.lookup(query)[2]
+                    params = [list(param) if isinstance(param, tuple)
+                              else param for param in params]
+                planning += planningMilliseconds(c, query, params)
+        print("%-10s %8d %8d %12.3f %14.3f" % (
+            label, args.players, args.rounds, elapsed, planning))
+    tournament.setSession(None)
+
+
+def benchIdentity(args):
+    """Players rows and the time to count them and read a player's history
+    when one field enters many tournaments, registered by name vs by
+    external id."""
+    tournaments = args.tournaments or 200
+    print("%-13s %14s %10s %11s %9s %13s %11s" % (
+        "registered by", "registrations", "players", "register s",
+        "count ms", "history rows", "history ms"))
+    names = ["Player %d" % i for i in range(args.players)]
+    for label, external_ids in (
+            ("name", None),
+            ("external id", ["P-%d" % i for i in range(args.players)])):
+        tournament.setSession(TournamentSession(tournament.connect))
+        tournament.deleteTournaments()
+        started = time.time()
+        for i in range(tournaments):
+            tourney_id = tournament.createTournament("Event %d" % i)
+            player_id = tournament.registerPlayers(
+                tourney_id, names, external_ids)[0]
+        registering = time.time() - started
+        started = time.time()
+        for i in range(args.repeat):
+            players = tournament.countPlayers()
+        counting = (time.time() - started) / args.repeat
+        started = time.time()
+        history = tournament.playerHistory(player_id)
+        reading = time.time() - started
+        print("%-13s %14d %10d %11.3f %9.3f %13d %11.3f" % (
+            label, tournaments * args.players, players, registering,
+            counting * 1000, len(history), reading * 1000))
+    tournament.setSession(None)
+
+
+def benchReplicas(args):
+    """Scoreboard reads made during a tournament, all on the primary vs
+    routed to read replicas: reads made, their median latency and the
+    round trips they cost the primary."""
+    replicas = [dsn.strip() for dsn in args.replicas.split(';')
+                if dsn.strip()]
+    if not replicas:
+        sys.exit("The replicas benchmark needs --replicas or "
+                 "TOURNAMENT_REPLICAS.")
+    print("%-9s %8s %8s %10s %12s %12s" % (
+        "reads on", "rounds", "reads", "p50 ms", "primary rts", "seconds"))
+    for label, dsns in (("primary", []), ("replicas", replicas)):
+        writer = TournamentSession(tournament.connect)
+        tournament.setSession(writer)
+        tourney_id = newTournament(args.players)
+        player_ids = [row[0] for row in tournament.playerStandings(tourney_id)]
+        recorder = CallRecorder()
+        # Scoreboards run apart from the writer, so their session sees no
+        # writes and reads nothing back from the primary for freshness.
+        readers = TournamentSession(countingConnect(recorder), cache_entries=0)
+        if dsns:
+            readers = RoutingSession(readers, [
+                TournamentSession(lambda dsn=dsn: psycopg2.connect(dsn),
+                                  cache_entries=0, state_entries=0)
+                for dsn in dsns])
+        done = threading.Event()
+
+        def read(seed):
+            rng = random.Random(seed)
+            while not done.is_set():
+                recorder.call('read', readers.playerStandings, tourney_id)
+                recorder.call('read', readers.countPlayers, tourney_id)
+                recorder.call('read', readers.hasBye, tourney_id,
+                              rng.choice(player_ids))
+
+        threads = [threading.Thread(target=read, args=(args.seed + i,))
+                   for i in range(args.threads)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        try:
+            playRounds(tourney_id, args.rounds, random.Random(args.seed))
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        elapsed = time.time() - started
+        latencies = sorted(recorder.latencies.get('read', []))
+        print("%-9s %8d %8d %10.3f %12d %12.3f" % (
+            label, args.rounds, len(latencies),
+            percentile(latencies, 0.5) * 1000,
+            recorder.round_trips.get('read', 0), elapsed))
+        readers.close()
+    tournament.setSession(None)
+
+
+def benchFeed(args):
+    """Queries and standings rows read by displays following many
+    tournaments while one of them is played, polling playerStandings()
+    every --interval seconds vs following a standings feed."""
+    tournaments = args.tournaments or 16
+    print("%-6s %11s %9s %8s %10s %12s %9s" % (
+        "mode", "tournaments", "displays", "matches", "queries",
+        "rows read", "updates"))
+    for label in ("poll", "feed"):
+        tournament.setSession(TournamentSession(tournament.connect))
+        tournament.deleteTournaments()
+        names = ["Player %d" % i for i in range(args.players)]
+        tourney_ids = []
+        for i in range(tournaments):
+            tourney_ids.append(tournament.createTournament("Event %d" % i))
+            tournament.registerPlayers(tourney_ids[-1], names)
+        # Displays run apart from the writer, so they cannot share its
+        # cache.
+        reader = TournamentSession(tournament.connect, cache_entries=0)
+        counts = {'queries': 0, 'rows': 0, 'updates': 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def poll():
+            queries = rows = updates = 0
+            last = {}
+            while not done.is_set():
+                for tourney_id in tourney_ids:
+                    standings = reader.playerStandings(tourney_id)
+                    queries += 1
+                    rows += len(standings)
+                    updates += standings != last.get(tourney_id)
+                    last[tourney_id] = standings
+                done.wait(args.interval)
+            with lock:
+                counts.update(queries=counts['queries'] + queries,
+                              rows=counts['rows'] + rows,
+                              updates=counts['updates'] + updates)
+
+        def follow(feed):
+            updates = 0
+            try:
+                while not done.is_set():
+                    updates += len(feed.poll(0.05))
+            finally:
+                feed.close()
+            with lock:
+                counts.update(queries=counts['queries'] + feed.reads,
+                              rows=counts['rows'] + feed.rows,
+                              updates=counts['updates'] + updates)
+
+        if label == "poll":
+            threads = [threading.Thread(target=poll)
+                       for i in range(args.threads)]
+        else:
+            threads = [threading.Thread(
+                target=follow, args=(reader.standingsFeed(tourney_ids),))
+                for i in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        rng = random.Random(args.seed)
+        matches = 0
+        try:
+            # Results come in a few a second, as from real tables
+            for round_number in range(args.rounds):
+                for (id1, name1, id2, name2) in tournament.swissPairings(
+                        tourney_ids[0]):
+                    if rng.random() < 0.5:
+                        id1, id2 = id2, id1
+                    tournament.reportMatch(tourney_ids[0], id1, id2)
+                    matches += 1
+                    time.sleep(args.interval / 10)
+            # Let the displays catch up with the last result
+            time.sleep(args.interval)
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        reader.close()
+        print("%-6s %11d %9d %8d %10d %12d %9d" % (
+            label, tournaments, args.threads, matches, counts['queries'],
+            counts['rows'], counts['updates']))
+    tournament.setSession(None)
+
+
+def recomputedPlan(standings, matches, results, algorithm):
+    """Pairs a scenario from scratch: the standings worked out from every
+    match and a match graph built afresh, as each call would without a
+    planner."""
+    matches = matches + list(results)
+    names = dict((row[0], row[1]) for row in standings)
+    player_ids = sorted(names)
+    figures = tiebreaks.computeTiebreaks(player_ids, matches)
+    rows = sorted(((player_id, names[player_id], int(wins), int(played),
+                    int(omw)) for (player_id, wins, played, omw) in
+                   zip(player_ids, figures['wins'], figures['matches'],
+                       figures['omw'])),
+                  key=lambda row: (-row[2], -row[4], row[0]))
+    bye, pairings = pairing.pairField(utils.StandingsPool(rows),
+                                      pairing.MatchGraph(matches), algorithm)
+    return (None if bye is None else bye.id), pairings
+
+
+def benchWhatIf(args):
+    """What-if scenarios of the next round's results paired per second,
+    recomputing everything per scenario vs with one planner."""
+    tourney_id = newTournament(args.players)
+    rng = random.Random(args.seed)
+    playRounds(tourney_id, args.rounds, rng)
+    this_round = tournament.startRound(tourney_id)
+    pairs = tournament.pairRound(this_round)
+    bye = [] if this_round.bye is None else [(this_round.bye, 0)]
+    scenarios = [bye + [(id1, id2) if rng.random() < 0.5 else (id2, id1)
+                        for (id1, name1, id2, name2) in pairs]
+                 for i in range(args.repeat * 100)]
+    standings = tournament.playerStandings(tourney_id)
+    matches = tournament.getMatches(tourney_id)
+    print("%-11s %8s %10s %9s %13s %6s" % (
+        "paired by", "players", "scenarios", "seconds", "scenarios/s",
+        "same"))
+    expected = None
+    for label in ("recomputed", "planner"):
+        started = time.time()
+        if label == "planner":
+            planner = tournament.planPairings(tourney_id)
+            plans = [planner.plan(results, args.algorithm)
+                     for results in scenarios]
+        else:
+            plans = [recomputedPlan(standings, matches, results,
+                                    args.algorithm)
+                     for results in scenarios]
+        elapsed = time.time() - started
+        if expected is None:
+            expected = plans
+        print("%-11s %8d %10d %9.3f %13.0f %6s" % (
+            label, args.players, len(scenarios), elapsed,
+            len(scenarios) / elapsed, plans == expected))
+
+
+def benchSnapshot(args):
+    """Seconds to load a tournament's standings and match graph from the
+    database vs from a snapshot file, and to pair the next round with
+    each."""
+    tournament.deleteTournaments()
+    tourney_id = tournament.createTournament("Benchmark")
+    player_ids = tournament.registerPlayers(
+        tourney_id, ["Player %d" % i for i in range(args.players)])
+    for round_matches in chunked(randomMatches(args.players, args.rounds,
+                                               random.Random(args.seed)),
+                                 (args.players + 1) // 2):
+        tournament.reportMatches(tourney_id, [
+            (player_ids[winner - 1], player_ids[loser - 1] if loser else 0)
+            for (winner, loser) in round_matches])
+    path = "benchmark.snapshot"
+    started = time.time()
+    players, matches = tournament.saveSnapshot(tourney_id, path)
+    saving = time.time() - started
+    print("saved %d players and %d matches in %.3f s (%d bytes)" % (
+        players, matches, saving, os.path.getsize(path)))
+    print("%-10s %7s %11s %8s %7s %10s %6s" % (
+        "loaded by", "open s", "standings s", "graph s", "load s",
+        "pairing s", "same"))
+    expected = None
+    for label in ("database", "snapshot"):
+        started = time.time()
+        if label == "database":
+            opened = time.time()
+            standings = tournament.playerStandings(tourney_id)
+            ranked = time.time()
+            graph = pairing.MatchGraph(tournament.getMatches(tourney_id))
+        else:
+            saved = tournament.openSnapshot(path)
+            opened = time.time()
+            standings = saved.standings()
+            ranked = time.time()
+            graph = saved.graph()
+        loaded = time.time()
+        bye, pairings = pairing.pairField(utils.StandingsPool(standings),
+                                          graph, args.algorithm)
+        paired = time.time()
+        result = (standings, bye and bye.id, pairings)
+        if expected is None:
+            expected = result
+        print("%-10s %7.3f %11.3f %8.3f %7.3f %10.3f %6s" % (
+            label, opened - started, ranked - opened, loaded - ranked,
+            loaded - started, paired - loaded, result == expected))
+        # Free the graph so it does not slow the next load down
+        standings = graph = result = None
+    saved.close()
+    os.remove(path)
+
+
+def chunked(rows, size):
+    """Yields successive lists of size rows."""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def benchPairing(args):
+    """Wall time of swissPairings for each round of a tournament."""
+    tourney_id = newTournament(args.players)
+    print("%6s %8s %12s" % ("round", "pairs", "seconds"))
+    rng = random.Random(args.seed)
+    for round_number in range(1, args.rounds + 1):
+        started = time.time()
+        pairings = tournament.swissPairings(tourney_id)
+        elapsed = time.time() - started
+        print("%6d %8d %12.3f" % (round_number, len(pairings), elapsed))
+        for (id1, name1, id2, name2) in pairings:
+            if rng.random() < 0.5:
+                id1, id2 = id2, id1
+            tournament.reportMatch(tourney_id, id1, id2)
+
+
+def syntheticStandings(players, rounds, rng):
+    """Plays a tournament in memory with greedy pairings and random results.
+
+    Returns:
+      A (standings, graph) tuple for the round after the last one played,
+      with standings shaped like playerStandings() rows.
+    """
+    wins = dict((i, 0) for i in range(1, players + 1))
+    graph = pairing.MatchGraph()
+
+    def standings():
+        order = sorted(wins, key=lambda i: (-wins[i], i))
+        return [(i, "Player %d" % i, wins[i], 0, 0) for i in order]
+
+    for round_number in range(rounds):
+        pool = utils.StandingsPool(standings())
+        for (id1, name1, id2, name2) in pairing.greedyPairings(pool, graph):
+            if rng.random() < 0.5:
+                id1, id2 = id2, id1
+            graph.addMatch(id1, id2)
+            wins[id1] += 1
+    return standings(), graph
+
+
+def benchBulk(args):
+    """registerPlayers and reportMatches vs one call per player or match."""
+    print("%-16s %8s %12s" % ("call", "rows", "seconds"))
+    for label, bulk in (("one at a time", False), ("bulk", True)):
+        tournament.deleteTournaments()
+        tourney_id = tournament.createTournament("Benchmark")
+        names = ["Player %d" % i for i in range(args.players)]
+        started = time.time()
+        if bulk:
+            ids = tournament.registerPlayers(tourney_id, names)
+        else:
+            ids = [tournament.registerPlayer(tourney_id, name)
+                   for name in names]
+        print("%-16s %8d %12.3f" % ("registerPlayers" if bulk else
+                                    "registerPlayer", len(ids),
+                                    time.time() - started))
+        results = list(zip(ids[0::2], ids[1::2]))
+        started = time.time()
+        if bulk:
+            tournament.reportMatches(tourney_id, results)
+        else:
+            for (winner, loser) in results:
+                tournament.reportMatch(tourney_id, winner, loser)
+        print("%-16s %8d %12.3f" % ("reportMatches" if bulk else
+                                    "reportMatch", len(results),
+                                    time.time() - started))
+
+
+def benchCache(args):
+    """Scoreboard reads of playerStandings while results are reported."""
+    tourney_id = newTournament(args.players)
+    readers = 8
+    reads = [0] * readers
+    done = threading.Event()
+
+    def scoreboard(index):
+        while not done.is_set():
+            tournament.playerStandings(tourney_id)
+            reads[index] += 1
+
+    threads = [threading.Thread(target=scoreboard, args=(i,))
+               for i in range(readers)]
+    before = tournament.cacheStats()
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    playRounds(tourney_id, args.rounds, random.Random(args.seed))
+    done.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    after = tournament.cacheStats()
+    print("%d standings reads in %.2f seconds (%.0f per second)" % (
+        sum(reads), elapsed, sum(reads) / elapsed))
+    for key in ('hits', 'misses', 'evictions', 'invalidations'):
+        print("%-14s %8d" % (key, after[key] - before[key]))
+
+
+def benchMatching(args):
+    """Greedy vs maximum weight matching pairings on late rounds."""
+    print("%-10s %8s %10s %12s %12s" % ("algorithm", "players", "unpaired",
+                                        "score diff", "seconds"))
+    for players in (args.players, args.players * 4, args.players * 16):
+        standings, graph = syntheticStandings(players, args.rounds,
+                                              random.Random(args.seed))
+        wins = dict((row[0], row[2]) for row in standings)
+        for name in ('greedy', 'matching'):
+            pool = utils.StandingsPool(standings)
+            started = time.time()
+            pairings = pairing.ALGORITHMS[name](pool, graph)
+            elapsed = time.time() - started
+            diff = sum((wins[p[0]] - wins[p[2]]) ** 2 for p in pairings)
+            print("%-10s %8d %10d %12d %12.3f" % (
+                name, players, players - 2 * len(pairings), diff, elapsed))
+
+
+def randomMatches(players, rounds, rng):
+    """Returns (winner, loser) tuples for rounds of random pairings."""
+    ids = list(range(1, players + 1))
+    matches = []
+    for round_number in range(rounds):
+        rng.shuffle(ids)
+        if len(ids) % 2:
+            matches.append((ids[-1], 0))
+        matches.extend(zip(ids[0:-1:2], ids[1::2]))
+    return matches
+
+
+def benchTiebreaks(args):
+    """Tiebreakers computed with NumPy vs in plain Python."""
+    if tiebreaks.numpy is None:
+        print("NumPy is not installed; only plain Python is timed.")
+    print("%8s %8s %12s %12s %6s" % ("players", "matches", "numpy",
+                                      "python", "same"))
+    for players in (args.players, args.players * 32, args.players * 512):
+        matches = randomMatches(players, args.rounds,
+                                random.Random(args.seed))
+        player_ids = list(range(1, players + 1))
+        started = time.time()
+        python = tiebreaks.computeTiebreaks(player_ids, matches, False)
+        python_seconds = time.time() - started
+        numpy_seconds = same = None
+        if tiebreaks.numpy is not None:
+            started = time.time()
+            vectorized = tiebreaks.computeTiebreaks(player_ids, matches, True)
+            numpy_seconds = time.time() - started
+            same = all(abs(x - y) < 1e-9 for name in tiebreaks.COLUMNS
+                       for (x, y) in zip(vectorized[name], python[name]))
+        print("%8d %8d %12s %12.3f %6s" % (
+            players, len(matches),
+            "n/a" if numpy_seconds is None else "%.3f" % numpy_seconds,
+            python_seconds, "n/a" if same is None else same))
+
+
+def measure(function, *args):
+    """Runs function(*args) and returns (seconds, peak KiB, KiB retained).
+
+    Memory is traced with tracemalloc where it exists and is None otherwise.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    started = time.time()
+    result = function(*args)
+    elapsed = time.time() - started
+    peak = retained = None
+    if tracemalloc is not None:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak, retained = peak / 1024.0, current / 1024.0
+    del result
+    return elapsed, peak, retained
+
+
+def pairAdjacentByCopying(standings):
+    """First-round greedy pairing that copies the list on each removal, as
+    swissPairings did with utils.tuple_without."""
+    pairs = []
+    while standings:
+        first_player = standings[0]
+        standings = [row for row in standings if row != first_player]
+        player = standings[0]
+        pairs.append((first_player[0], player[0]))
+        standings = [row for row in standings if row != player]
+    return pairs
+
+
+def pairAdjacentFromPool(standings):
+    """The same pairing taking players out of a utils.StandingsPool."""
+    pool = utils.StandingsPool(standings)
+    pairs = []
+    while pool:
+        first_player = pool.popFirst()
+        player = pool.popFirst()
+        pairs.append((first_player.id, player.id))
+    return pairs
+
+
+# v_WinsAndLosses as tournament.sql defined it before migration 001, which
+# aggregated every tournament's matches before filtering by tournament.
+OLD_WINS_AND_LOSSES = """
+    CREATE TEMP VIEW v_OldWinsAndLosses AS
+    SELECT w.tournament_id, w.id, w.name, w.wins, l.losses
+    FROM (
+        SELECT tp1.tournament_id, p1.id, p1.name, COUNT(m1.winner) AS wins
+        FROM ((Players p1 LEFT JOIN Tournaments_Players tp1
+               ON p1.id = tp1.player_id)
+        LEFT JOIN Matches m1 ON p1.id = m1.winner)
+        GROUP BY tp1.tournament_id, p1.id, p1.name
+    ) w
+    INNER JOIN (
+        SELECT tp2.tournament_id, p2.id, p2.name, COUNT(m2.loser) AS losses
+        FROM ((Players p2 LEFT JOIN Tournaments_Players tp2
+               ON p2.id = tp2.player_id)
+        LEFT JOIN Matches m2 ON p2.id = m2.loser)
+        GROUP BY tp2.tournament_id, p2.id, p2.name
+    ) l
+    ON w.id = l.id
+    WHERE w.id <> 0
+    ORDER BY w.wins DESC;
+"""
+
+
+def populate(tournaments, players, rounds):
+    """Wipes the database and bulk loads many tournaments in SQL.
+
+    Each tournament gets its players and rounds of matches between players
+    close to each other in registration order.
+
+    Returns:
+      A list of the new tournament ids.
+    """
+    tournament.deleteTournaments()
+    with tournament.getSession().cursor() as c:
+        c.execute("""
+            WITH t AS (
+                INSERT INTO Tournaments (name)
+                SELECT 'Benchmark ' || g FROM generate_series(1, %s) g
+                RETURNING id
+            )
+            INSERT INTO Tournaments_Players (tournament_id, player_id)
+            SELECT id, 0 FROM t;""", (tournaments,))
+        c.execute("""
+            WITH p AS (
+                INSERT INTO Players (name)
+                SELECT t.id || ':Player ' || g
+                FROM Tournaments t, generate_series(1, %s) g
+                RETURNING id, name
+            )
+            INSERT INTO Tournaments_Players (tournament_id, player_id)
+            SELECT split_part(name, ':', 1)::integer, id FROM p;""",
+                  (players,))
+        c.execute("""
+            WITH r AS (
+                SELECT tournament_id, player_id, row_number() OVER (
+                    PARTITION BY tournament_id ORDER BY player_id) AS rn
+                FROM Tournaments_Players WHERE player_id <> 0
+            )
+            INSERT INTO Matches (tournament_id, winner, loser)
+            SELECT a.tournament_id, a.player_id, b.player_id
+            FROM r a CROSS JOIN generate_series(1, %s) g
+            JOIN r b ON a.tournament_id = b.tournament_id AND b.rn = a.rn + g
+            WHERE a.rn %% 2 = 1;""", (rounds,))
+        c.execute("ANALYZE;")
+        c.execute("SELECT id FROM Tournaments ORDER BY id;")
+        return [row[0] for row in c.fetchall()]
+
+
+def benchSchema(args):
+    """Per-tournament standings reads on a database of many tournaments."""
+    started = time.time()
+    ids = populate(args.tournaments or 10000, args.players, args.rounds)
+    print("Loaded %d tournaments in %.1f seconds." % (
+        len(ids), time.time() - started))
+    tourney_id = ids[len(ids) // 2]
+    queries = (
+        ("old view", "SELECT * FROM v_OldWinsAndLosses "
+                     "WHERE tournament_id = %s;"),
+        ("view", "SELECT * FROM v_WinsAndLosses WHERE tournament_id = %s;"),
+        ("function", "SELECT * FROM f_WinsAndLosses(%s);"),
+    )
+    print("%-16s %12s" % ("query", "ms"))
+    with tournament.getSession().cursor() as c:
+        c.execute(OLD_WINS_AND_LOSSES)
+        for label, query in queries:
+            started = time.time()
+            for i in range(args.repeat):
+                c.execute(query, (tourney_id,))
+                c.fetchall()
+            print("%-16s %12.2f" % (
+                label, (time.time() - started) * 1000 / args.repeat))
+    started = time.time()
+    for i in range(args.repeat):
+        tournament.playerStandings(tourney_id)
+    print("%-16s %12.2f" % (
+        "playerStandings", (time.time() - started) * 1000 / args.repeat))
+
+
+def benchArchive(args):
+    """Deleting and archiving one tournament at a time, and emptying every
+    table with DELETE vs TRUNCATE, on a database of many tournaments."""
+    started = time.time()
+    ids = populate(args.tournaments or 10000, args.players, args.rounds)
+    with tournament.getSession().cursor() as c:
+        c.execute("SELECT COUNT(*) FROM Matches;")
+        matches = c.fetchone()[0]
+    print("Loaded %d tournaments and %d matches in %.1f seconds." % (
+        len(ids), matches, time.time() - started))
+    print("%-22s %8s %12s" % ("operation", "times", "ms each"))
+    for label, function, tourney_ids in (
+            ("deleteTournament", tournament.deleteTournament,
+             ids[:args.repeat]),
+            ("archiveTournament", tournament.archiveTournament,
+             ids[args.repeat:2 * args.repeat])):
+        started = time.time()
+        for tourney_id in tourney_ids:
+            function(tourney_id)
+        print("%-22s %8d %12.1f" % (
+            label, len(tourney_ids),
+            (time.time() - started) * 1000 / len(tourney_ids)))
+    # The old deleteTournaments, rolled back so the tables can be emptied
+    # again with TRUNCATE. Deleting players checks Matches for each one
+    # without an index, so the statements are given at most a minute each.
+    DB = tournament.connect()
+    c = DB.cursor()
+    c.execute("SET statement_timeout = 60000;")
+    started = time.time()
+    try:
+        for query in queries.DELETE_TOURNAMENTS:
+            c.execute(query)
+        elapsed = "%12.1f" % ((time.time() - started) * 1000)
+    except psycopg2.extensions.QueryCanceledError:
+        elapsed = "%12s" % ("> %d" % ((time.time() - started) * 1000))
+    DB.rollback()
+    DB.close()
+    print("%-22s %8d %s" % ("DELETE every table", 1, elapsed))
+    started = time.time()
+    tournament.deleteTournaments()
+    print("%-22s %8d %12.1f" % ("TRUNCATE every table", 1,
+                                (time.time() - started) * 1000))
+
+
+def benchRemoval(args):
+    """Pairing a field by list copying vs by StandingsPool removal."""
+    print("%-10s %8s %12s %12s %12s" % ("structure", "players", "seconds",
+                                        "peak KiB", "kept KiB"))
+    for players in (args.players, args.players * 10, args.players * 100):
+        players -= players % 2
+        standings = [(i, "Player %d" % i, 0, 0, 0)
+                     for i in range(1, players + 1)]
+        for label, function in (("list", pairAdjacentByCopying),
+                                ("pool", pairAdjacentFromPool)):
+            elapsed, peak, retained = measure(function, standings)
+            print("%-10s %8d %12.3f %12s %12s" % (
+                label, players, elapsed,
+                "n/a" if peak is None else "%.1f" % peak,
+                "n/a" if retained is None else "%.1f" % retained))
+
+
+def exportMaterialized(tourney_id, kind, out):
+    """Exports rows read with playerStandings() or getMatches(), all at
+    once, as the module did before it could stream them."""
+    if kind == 'standings':
+        rows, columns = (tournament.playerStandings(tourney_id),
+                         export.STANDINGS_COLUMNS)
+    else:
+        rows, columns = (tournament.getMatches(tourney_id),
+                         export.MATCHES_COLUMNS)
+    return export.writeRows(rows, columns, out)
+
+
+def exportStreamed(tourney_id, kind, out):
+    """Exports rows with exportStandings() or exportMatches()."""
+    if kind == 'standings':
+        return tournament.exportStandings(tourney_id, out)
+    return tournament.exportMatches(tourney_id, out)
+
+
+def benchStream(args):
+    """Exporting standings and matches read all at once vs streamed."""
+    print("%-10s %-14s %8s %12s %12s %12s" % (
+        "rows", "read", "count", "seconds", "peak KiB", "kept KiB"))
+    with open(os.devnull, 'w') as out:
+        for players in (args.players * 10, args.players * 100,
+                        args.players * 1000):
+            tournament.deleteTournaments()
+            tourney_id = tournament.createTournament("Benchmark")
+            ids = tournament.registerPlayers(
+                tourney_id, ["Player %d" % i for i in range(players)])
+            matches = [(ids[winner - 1], ids[loser - 1] if loser else 0)
+                       for (winner, loser) in randomMatches(
+                           players, args.rounds, random.Random(args.seed))]
+            tournament.reportMatches(tourney_id, matches)
+            counts = {'standings': players, 'matches': len(matches)}
+            del matches
+            for kind in ('standings', 'matches'):
+                for label, function in (("all at once", exportMaterialized),
+                                        ("streamed", exportStreamed)):
+                    elapsed, peak, retained = measure(function, tourney_id,
+                                                      kind, out)
+                    print("%-10s %-14s %8d %12.3f %12s %12s" % (
+                        kind, label, counts[kind], elapsed,
+                        "n/a" if peak is None else "%.1f" % peak,
+                        "n/a" if retained is None else "%.1f" % retained))
+
+
+class CallRecorder(object):
+    """Latencies and database round trips of the public functions a
+    simulation calls, from any number of threads."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.round_trips = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call(self, name, function, *args):
+        """Returns function(*args), recording its time and round trips."""
+        self._local.statements = 0
+        started = time.time()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.time() - started
+            statements, self._local.statements = self._local.statements, None
+            with self._lock:
+                self.latencies.setdefault(name, []).append(elapsed)
+                self.round_trips[name] = (
+                    self.round_trips.get(name, 0) + statements)
+
+    def statement(self):
+        """Counts one statement sent by the calling thread."""
+        if getattr(self._local, 'statements', None) is not None:
+            self._local.statements += 1
+
+
+def countingConnect(recorder):
+    """Returns a connect() whose statements, commits and rollbacks are
+    counted as round trips on recorder."""
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, args=None):
+            recorder.statement()
+            return psycopg2.extensions.cursor.execute(self, query, args)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def commit(self):
+            recorder.statement()
+            return psycopg2.extensions.connection.commit(self)
+
+        def rollback(self):
+            recorder.statement()
+            return psycopg2.extensions.connection.rollback(self)
+
+    return lambda: psycopg2.connect(tournament.DSN,
+                                    connection_factory=CountingConnection,
+                                    cursor_factory=CountingCursor)
+
+
+def percentile(ordered, fraction):
+    """Returns the nearest-rank percentile of a sorted, non-empty list."""
+    rank = int(round(fraction * len(ordered) + 0.5)) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+def simulateTournament(recorder, index, args):
+    """Plays one full Swiss tournament through the public API.
+
+    Tournaments with an odd index get one extra player, so a simulation
+    always covers odd fields with byes as well as even ones. Results are
+    drawn from a random.Random seeded by the seed and the index alone, so
+    a run plays the same matches however its threads are scheduled.
+
+    Returns:
+      The number of matches reported, byes included.
+    """
+    rng = random.Random("%d:%d" % (args.seed, index))
+    tourney_id = recorder.call('createTournament', tournament.createTournament,
+                               "Simulation %d" % index)
+    for i in range(args.players + index % 2):
+        recorder.call('registerPlayer', tournament.registerPlayer,
+                      tourney_id, "Player %d" % i)
+    for round_number in range(args.rounds):
+        pairings = recorder.call('swissPairings', tournament.swissPairings,
+                                 tourney_id, args.algorithm)
+        for (id1, name1, id2, name2) in pairings:
+            if rng.random() < 0.5:
+                id1, id2 = id2, id1
+            recorder.call('reportMatch', tournament.reportMatch,
+                          tourney_id, id1, id2)
+        recorder.call('playerStandings', tournament.playerStandings,
+                      tourney_id)
+    return len(tournament.getMatches(tourney_id))
+
+
+def benchSimulate(args):
+    """Full Swiss tournaments played concurrently through the public API.
+
+    Reports per-function latency percentiles and round trips, wall time and
+    peak memory, as a table or (with --json) as JSON to track across
+    releases.
+    """
+    recorder = CallRecorder()
+    if args.backend == 'postgresql':
+        session = TournamentSession(countingConnect(recorder),
+                                    maxconn=args.threads)
+    else:
+        # In-process backends make no round trips.
+        session = tournament.newSession(args.backend)
+    tournament.setSession(session)
+    tournament.deleteTournaments()
+    tournaments = args.tournaments or 16
+    matches = [0] * tournaments
+    errors = []
+
+    def worker(first):
+        try:
+            for index in range(first, tournaments, args.threads):
+                matches[index] = simulateTournament(recorder, index, args)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(args.threads)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    tournament.setSession(None)
+    if errors:
+        raise errors[0]
+
+    functions = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        calls = len(latencies)
+        functions[name] = {
+            'calls': calls,
+            'mean_ms': sum(latencies) * 1000 / calls,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p90_ms': percentile(latencies, 0.90) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'round_trips': recorder.round_trips[name],
+        }
+    max_rss_kib = None
+    if resource is not None:
+        # Linux reports KiB; macOS reports bytes.
+        max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if platform.system() == 'Darwin':
+            max_rss_kib //= 1024
+    report = {
+        'benchmark': 'simulate',
+        'config': {'backend': args.backend, 'algorithm': args.algorithm,
+                   'players': args.players, 'rounds': args.rounds,
+                   'tournaments': tournaments, 'threads': args.threads,
+                   'seed': args.seed},
+        'python': platform.python_version(),
+        'seconds': elapsed,
+        'matches': sum(matches),
+        'calls': sum(f['calls'] for f in functions.values()),
+        'round_trips': sum(f['round_trips'] for f in functions.values()),
+        'max_rss_kib': max_rss_kib,
+        'functions': functions,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        print()
+        return
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2, separators=(',', ': '),
+                      sort_keys=True)
+    print("%d tournaments, %d matches, %d calls in %.2f seconds" % (
+        tournaments, report['matches'], report['calls'], elapsed))
+    print("%-16s %8s %9s %9s %9s %9s %11s" % (
+        "function", "calls", "p50 ms", "p90 ms", "p99 ms", "max ms",
+        "trips/call"))
+    for name, f in sorted(functions.items()):
+        print("%-16s %8d %9.3f %9.3f %9.3f %9.3f %11.2f" % (
+            name, f['calls'], f['p50_ms'], f['p90_ms'], f['p99_ms'],
+            f['max_ms'], float(f['round_trips']) / f['calls']))
+    if max_rss_kib is not None:
+        print("peak RSS %d KiB" % max_rss_kib)
+
+
+BENCHMARKS = {
+    'archive': benchArchive,
+    'bulk': benchBulk,
+    'cache': benchCache,
+    'feed': benchFeed,
+    'identity': benchIdentity,
+    'many': benchMany,
+    'matching': benchMatching,
+    'pairing': benchPairing,
+    'pool': benchPool,
+    'prepared': benchPrepared,
+    'removal': benchRemoval,
+    'replicas': benchReplicas,
+    'round': benchRound,
+    'schema': benchSchema,
+    'simulate': benchSimulate,
+    'snapshot': benchSnapshot,
+    'state': benchState,
+    'stream': benchStream,
+    'tiebreaks': benchTiebreaks,
+    'whatif': benchWhatIf,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks tournament.py.")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--players', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tournaments', type=int, default=None,
+                        help="10000 for schema and archive, 16 for "
+                             "simulate, 64 for many, 200 for identity, 16 "
+                             "for feed")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--algorithm', choices=sorted(pairing.ALGORITHMS),
+                        default='greedy')
+    parser.add_argument('--backend', choices=('memory', 'postgresql',
+                                              'sqlite'),
+                        default=os.environ.get('TOURNAMENT_BACKEND',
+                                               'postgresql'))
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help="seconds between polls for feed")
+    parser.add_argument('--replicas', metavar='DSNS',
+                        default=os.environ.get('TOURNAMENT_REPLICAS', ''),
+                        help="read replica DSNs separated by semicolons")
+    parser.add_argument('--json', metavar='PATH',
+                        help="write simulate results as JSON ('-' for "
+                             "stdout)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+-- Table definitions for the tournament project on SQLite.
+--
+-- The schema of tournament.sql for sqlite_session.SQLiteSession, which runs
+-- this script on every new connection. It only creates what is missing.
+
+-- Create the players table. Registrations under the same external
+-- identifier link to one player.
+CREATE TABLE IF NOT EXISTS Players (
+    id integer primary key autoincrement,
+    name text,
+    external_id text
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS Players_external_id_idx
+    ON Players (external_id);
+
+-- Insert a record for 'Bye'
+INSERT OR IGNORE INTO Players (id, name) VALUES (0, 'Bye');
+
+-- Create the tournament table
+CREATE TABLE IF NOT EXISTS Tournaments (
+    id integer primary key autoincrement,
+    name text
+);
+
+-- Create the tournaments-players table
+CREATE TABLE IF NOT EXISTS Tournaments_Players (
+    tournament_id integer references Tournaments(id),
+    player_id integer references Players(id),
+    primary key (tournament_id, player_id)
+);
+
+-- Create the matches table. Matches recorded by closeRound() carry their
+-- round number; matches reported one at a time have none.
+CREATE TABLE IF NOT EXISTS Matches (
+    id integer primary key autoincrement,
+    tournament_id integer references Tournaments(id),
+    winner integer references Players(id),
+    loser integer references Players(id),
+    round integer
+);
+
+-- Index the matches of a tournament by winner, by loser, by round and in
+-- the order they were recorded
+CREATE INDEX IF NOT EXISTS Matches_tournament_winner_idx
+    ON Matches (tournament_id, winner);
+CREATE INDEX IF NOT EXISTS Matches_tournament_loser_idx
+    ON Matches (tournament_id, loser);
+CREATE INDEX IF NOT EXISTS Matches_tournament_round_idx
+    ON Matches (tournament_id, round);
+CREATE INDEX IF NOT EXISTS Matches_tournament_id_idx
+    ON Matches (tournament_id, id);
+
+-- Create the standings table, which holds each player's wins, losses and
+-- opponent match wins and is kept up to date as matches are reported
+CREATE TABLE IF NOT EXISTS Standings (
+    tournament_id integer,
+    player_id integer,
+    wins integer NOT NULL DEFAULT 0,
+    losses integer NOT NULL DEFAULT 0,
+    omw integer NOT NULL DEFAULT 0,
+    primary key (tournament_id, player_id),
+    foreign key (tournament_id, player_id)
+        references Tournaments_Players (tournament_id, player_id)
+        ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS Standings_order_idx
+    ON Standings (tournament_id, wins DESC, omw DESC, player_id);
+
+CREATE INDEX IF NOT EXISTS Standings_player_idx ON Standings (player_id);
+
+-- Give every player registered in a tournament an empty standings row
+CREATE TRIGGER IF NOT EXISTS t_StandingsPlayerInsert
+    AFTER INSERT ON Tournaments_Players
+BEGIN
+    INSERT INTO Standings (tournament_id, player_id)
+    VALUES (NEW.tournament_id, NEW.player_id);
+END;
+
+-- Update the standings for a newly reported match, as f_StandingsMatchInsert
+-- does for a single match in tournament.sql
+CREATE TRIGGER IF NOT EXISTS t_StandingsMatchInsert
+    AFTER INSERT ON Matches
+BEGIN
+    UPDATE Standings SET omw = omw + (
+        SELECT o.wins FROM Standings o
+        WHERE o.tournament_id = NEW.tournament_id
+        AND o.player_id = CASE WHEN Standings.player_id = NEW.winner
+                               THEN NEW.loser ELSE NEW.winner END
+    )
+    WHERE tournament_id = NEW.tournament_id
+    AND player_id IN (NEW.winner, NEW.loser)
+    AND NOT EXISTS (
+        SELECT 1 FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND id <> NEW.id
+        AND ((winner = NEW.winner AND loser = NEW.loser)
+             OR (winner = NEW.loser AND loser = NEW.winner))
+    );
+    UPDATE Standings SET wins = wins + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id = NEW.winner;
+    UPDATE Standings SET losses = losses + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id = NEW.loser;
+    UPDATE Standings SET omw = omw + 1
+    WHERE tournament_id = NEW.tournament_id AND player_id IN (
+        SELECT loser FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND winner = NEW.winner
+        UNION
+        SELECT winner FROM Matches
+        WHERE tournament_id = NEW.tournament_id AND loser = NEW.winner
+    );
+END;
+
+-- Archived tournaments, moved out of the tables above by archiveTournament()
+-- so that they stay small. The archive keeps its own copy of each player's
+-- name and has no foreign keys, so players can be deleted afterwards.
+CREATE TABLE IF NOT EXISTS Archived_Tournaments (
+    id integer primary key,
+    name text
+);
+
+CREATE TABLE IF NOT EXISTS Archived_Standings (
+    tournament_id integer,
+    player_id integer,
+    name text,
+    wins integer NOT NULL,
+    losses integer NOT NULL,
+    omw integer NOT NULL,
+    primary key (tournament_id, player_id)
+);
+
+CREATE TABLE IF NOT EXISTS Archived_Matches (
+    id integer primary key,
+    tournament_id integer,
+    round integer,
+    winner integer,
+    loser integer
+);
+
+CREATE INDEX IF NOT EXISTS Archived_Matches_tournament_idx
+    ON Archived_Matches (tournament_id, id);
+
+CREATE INDEX IF NOT EXISTS Archived_Standings_player_idx
+    ON Archived_Standings (player_id);
@@ -2,6 +2,18 @@
 #
 # Test cases for tournament.py
 
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import psycopg2
+
+from routing import RoutingSession
 from tournament import *
 
 
@@ -271,6 +283,754 @@ def testMultipleTournaments():
     print "12. Multiple tournaments can be stored simultaneously."
 
 
+def testStandingsOpponentMatchWins():
+    deleteTournaments()
+    tourney_id = createTournament("Swiss Spectacular")
+    other_id = createTournament("Other Tourney")
+    ids = [registerPlayer(tourney_id, "Player %d" % i) for i in range(6)]
+    other_ids = [registerPlayer(other_id, "Other %d" % i) for i in range(2)]
+    reportMatch(tourney_id, ids[0], ids[1])
+    reportMatch(tourney_id, ids[0], ids[1])
+    reportMatch(tourney_id, ids[2], ids[3])
+    reportMatch(tourney_id, ids[0], ids[2])
+    reportMatch(tourney_id, ids[4], ids[5])
+    reportMatch(tourney_id, ids[1], ids[4])
+    reportMatch(tourney_id, ids[5], 0)
+    reportMatch(other_id, other_ids[0], other_ids[1])
+    for (i, n, w, m, o) in playerStandings(tourney_id):
+        if o != getOpponentMatchWins(tourney_id, i):
+            raise ValueError(
+                "Standings should agree with getOpponentMatchWins().")
+    if rebuildStandings() != []:
+        raise ValueError(
+            "Rebuilding the standings should find nothing out of date.")
+    deleteMatches(tourney_id)
+    for (i, n, w, m, o) in playerStandings(tourney_id):
+        if w != 0 or m != 0 or o != 0:
+            raise ValueError(
+                "After deleting matches, standings should be empty.")
+    other_wins = [w for (i, n, w, m, o) in playerStandings(other_id)]
+    if other_wins != [1, 0] or rebuildStandings() != []:
+        raise ValueError(
+            "Deleting one tournament's matches should not touch another's.")
+    print "13. Standings agree with getOpponentMatchWins() and a rebuild."
+
+
+def testMatchingPairings():
+    deleteTournaments()
+    tourney_id = createTournament("Flintstones Tourney")
+    fred_id = registerPlayer(tourney_id, "Fred Flintstone")
+    barney_id = registerPlayer(tourney_id, "Barney Rubble")
+    wilma_id = registerPlayer(tourney_id, "Wilma Flintstone")
+    betty_id = registerPlayer(tourney_id, "Betty Rubble")
+    reportMatch(tourney_id, fred_id, wilma_id)
+    reportMatch(tourney_id, barney_id, betty_id)
+    reportMatch(tourney_id, wilma_id, betty_id)
+    # Fred, Wilma and Barney have one win each and Wilma has played Betty,
+    # so pairing Fred with Barney would strand Wilma and Betty
+    pairings = swissPairings(tourney_id, algorithm='matching')
+    if len(pairings) != 2:
+        raise ValueError(
+            "The matching algorithm should pair every player.")
+    correct_pairs = set([frozenset([fred_id, betty_id]),
+                        frozenset([barney_id, wilma_id])])
+    actual_pairs = set([frozenset([pid1, pid2])
+                        for (pid1, pname1, pid2, pname2) in pairings])
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "The matching algorithm should pair without rematches.")
+    print "14. The matching algorithm pairs every player without rematches."
+
+
+def testBulkRegisterAndReport():
+    deleteTournaments()
+    tourney_id = createTournament("Swiss Spectacular")
+    names = ["Player %d" % i for i in range(8)]
+    ids = registerPlayers(tourney_id, names)
+    if countPlayers(tourney_id) != 8 or len(set(ids)) != 8:
+        raise ValueError("registerPlayers should register every player.")
+    standings = playerStandings(tourney_id)
+    if [n for (i, n, w, m, o) in sorted(standings)] != names:
+        raise ValueError("registerPlayers should return ids in name order.")
+    reportMatches(tourney_id, [(ids[0], ids[1]), (ids[2], ids[3]),
+                               (ids[4], ids[5]), (ids[6], ids[7])])
+    for (i, n, w, m, o) in playerStandings(tourney_id):
+        if m != 1 or w != (1 if ids.index(i) % 2 == 0 else 0):
+            raise ValueError("reportMatches should record every result.")
+    print "15. Players and results can be registered and reported in bulk."
+
+
+def testStandingsCache():
+    deleteTournaments()
+    tourney_id = createTournament("Swiss Spectacular")
+    id1 = registerPlayer(tourney_id, "Bruno Walton")
+    id2 = registerPlayer(tourney_id, "Boots O'Neal")
+    playerStandings(tourney_id)
+    hits = cacheStats()['hits']
+    playerStandings(tourney_id)
+    if cacheStats()['hits'] != hits + 1:
+        raise ValueError("Repeated playerStandings should hit the cache.")
+    reportMatch(tourney_id, id1, id2)
+    [(pid1, n1, w1, m1, o1), (pid2, n2, w2, m2, o2)] = \
+        playerStandings(tourney_id)
+    if (pid1, w1, m1, pid2, w2, m2) != (id1, 1, 1, id2, 0, 1):
+        raise ValueError("reportMatch should invalidate cached standings.")
+    id3 = registerPlayer(tourney_id, "Cathy Burton")
+    if len(playerStandings(tourney_id)) != 3:
+        raise ValueError("registerPlayer should invalidate cached standings.")
+    deleteMatches(tourney_id)
+    if [w for (i, n, w, m, o) in playerStandings(tourney_id)] != [0, 0, 0]:
+        raise ValueError("deleteMatches should invalidate cached standings.")
+    print "16. Standings are cached until the tournament changes."
+
+
+def testInstrumentation():
+    deleteTournaments()
+    tourney_id = createTournament("Swiss Spectacular")
+    if stats().get('functions', {}).get('createTournament'):
+        raise ValueError("Nothing should be recorded until it is enabled.")
+    enableInstrumentation()
+    try:
+        registerPlayer(tourney_id, "Bruno Walton")
+        registerPlayer(tourney_id, "Boots O'Neal")
+        registerPlayer(tourney_id, "Cathy Burton")
+        countPlayers(tourney_id)
+        swissPairings(tourney_id)
+    finally:
+        disableInstrumentation()
+    countPlayers(tourney_id)
+    functions = stats()['functions']
+    if functions['registerPlayer']['calls'] != 3:
+        raise ValueError("stats() should count every registerPlayer call.")
+    if functions['countPlayers']['calls'] != 1:
+        raise ValueError("Nothing should be recorded once it is disabled.")
+    if (functions['playerStandings']['calls'] != 1 or
+            functions['reportMatch']['calls'] != 1 or
+            functions['pairing.greedy']['calls'] != 1):
+        raise ValueError("stats() should count the calls swissPairings makes.")
+    if not isinstance(getSession(), MemorySession):
+        count = functions['countPlayers']
+        if count['statements'] != 1 or count['rows'] != 1:
+            raise ValueError("stats() should count statements and rows.")
+    print "17. Calls, statements and rows are recorded once enabled."
+
+
+def testRounds():
+    deleteTournaments()
+    tourney_id = createTournament("Flintstones Tourney")
+    for name in ("Fred Flintstone", "Barney Rubble", "Wilma Flintstone",
+                 "Betty Rubble", "Pebbles Flintstone"):
+        registerPlayer(tourney_id, name)
+    first = startRound(tourney_id)
+    pairings = pairRound(first)
+    if len(pairings) != 2 or getMatches(tourney_id) != []:
+        raise ValueError("pairRound should pair without writing the bye.")
+    [(pid1, pname1, pid2, pname2), (pid3, pname3, pid4, pname4)] = pairings
+    submitResults(first, [(pid1, pid2)])
+    try:
+        submitResults(first, [(pid3, pid4), (pid1, pid3)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("submitResults should reject unpaired results.")
+    submitResults(first, [(pid4, pid3)])
+    closeRound(first)
+    closeRound(first)
+    standings = playerStandings(tourney_id)
+    if [m for (i, n, w, m, o) in standings] != [1] * 5:
+        raise ValueError("closeRound should record the bye and every result.")
+    if len(getMatches(tourney_id)) != 3:
+        raise ValueError("Closing a round again should not record it twice.")
+    second = startRound(tourney_id)
+    if (first.number, second.number) != (1, 2):
+        raise ValueError("Rounds should be numbered from one.")
+    pairings = pairRound(second)
+    reportMatch(tourney_id, pid1, pid4)
+    submitResults(second, [(p[0], p[2]) for p in pairings])
+    try:
+        closeRound(second)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round paired before other matches were "
+                         "reported should not be recorded.")
+    if len(getMatches(tourney_id)) != 4:
+        raise ValueError("A round that fails to close should write nothing.")
+    print "18. Rounds are paired, played and recorded in one transaction."
+
+
+def testSwissPairingsMany():
+    deleteTournaments()
+    sequential = []
+    batched = []
+    for players in (5, 6, 7):
+        for tourney_ids in (sequential, batched):
+            tourney_id = createTournament("%d Player Tourney" % players)
+            registerPlayers(tourney_id,
+                            ["Player %d" % i for i in range(players)])
+            tourney_ids.append(tourney_id)
+    for round_number in range(3):
+        expected = [swissPairings(t) for t in sequential]
+        paired = swissPairingsMany(batched, processes=2)
+        if sorted(paired) != sorted(batched):
+            raise ValueError(
+                "swissPairingsMany should pair every tournament.")
+        actual = [paired[t] for t in batched]
+        for (pairings, other) in zip(expected, actual):
+            if ([(n1, n2) for (i1, n1, i2, n2) in pairings] !=
+                    [(n1, n2) for (i1, n1, i2, n2) in other]):
+                raise ValueError(
+                    "swissPairingsMany should pair as swissPairings does.")
+        for (tourney_ids, results) in ((sequential, expected),
+                                       (batched, actual)):
+            for (tourney_id, pairings) in zip(tourney_ids, results):
+                reportMatches(tourney_id, [(i1, i2) for (i1, n1, i2, n2)
+                                           in pairings])
+    for (t1, t2) in zip(sequential, batched):
+        if ([row[1:] for row in playerStandings(t1)] !=
+                [row[1:] for row in playerStandings(t2)]):
+            raise ValueError(
+                "swissPairingsMany should record byes as swissPairings does.")
+    print "19. Many tournaments are paired at once as swissPairings would."
+
+
+def testTiebreaks():
+    deleteTournaments()
+    tourney_id = createTournament("Tiebreak Tourney")
+    registerPlayers(tourney_id, ["A", "B", "C", "D", "E"])
+    ids = dict((name, id) for (id, name, w, m, omw)
+               in playerStandings(tourney_id))
+    reportMatches(tourney_id, [(ids[w], ids[l]) for (w, l) in
+                               [("A", "B"), ("C", "D"), ("A", "C"),
+                                ("E", "B")]])
+    reportMatch(tourney_id, ids["E"], 0)
+    reportMatch(tourney_id, ids["D"], 0)
+    rows = tiebreakStandings(tourney_id)
+    if [row[:5] for row in rows] != playerStandings(tourney_id):
+        raise ValueError(
+            "tiebreakStandings should start with playerStandings' columns.")
+    expected = {"A": (1, 1), "B": (4, 0), "C": (3, 1), "D": (1, 0),
+                "E": (0, 0)}
+    for row in rows:
+        if (row[7], row[8]) != expected[row[1]]:
+            raise ValueError("%s should have a Buchholz of %d and a "
+                             "Sonneborn-Berger of %d." %
+                             ((row[1],) + expected[row[1]]))
+    omw_pct = dict((row[1], row[5]) for row in rows)
+    if abs(omw_pct["A"] - 5.0 / 12) > 1e-9 or abs(omw_pct["B"] - 1) > 1e-9:
+        raise ValueError(
+            "Opponents' match-win percentages should be at least a third.")
+    if ([row[1] for row in tiebreakStandings(tourney_id, ("buchholz",))] !=
+            ["B", "C", "A", "D", "E"]):
+        raise ValueError("tiebreakStandings should rank by the given order.")
+    if tiebreaks.numpy is not None:
+        player_ids = sorted(ids.values())
+        vectorized = tiebreaks.computeTiebreaks(
+            player_ids, getMatches(tourney_id), vectorized=True)
+        python = tiebreaks.computeTiebreaks(
+            player_ids, getMatches(tourney_id), vectorized=False)
+        for name in tiebreaks.COLUMNS:
+            if any(abs(x - y) > 1e-9 for (x, y)
+                   in zip(vectorized[name], python[name])):
+                raise ValueError("Tiebreaks should be the same with and "
+                                 "without NumPy.")
+        big = [10 ** 12 + player_id for player_id in player_ids]
+        shifted = dict(zip(player_ids, big))
+        shifted[0] = 0
+        large = tiebreaks.computeTiebreaks(
+            big, [(shifted[w], shifted[l]) for (w, l)
+                  in getMatches(tourney_id)], vectorized=True)
+        if large != vectorized:
+            raise ValueError("Tiebreaks should not depend on how large the "
+                             "player ids are.")
+    for vectorized in ((True, False) if tiebreaks.numpy is not None else
+                       (False,)):
+        empty = tiebreaks.computeTiebreaks([1, 2], [], vectorized)
+        if empty["wins"] != [0, 0] or empty["omw"] != [0, 0]:
+            raise ValueError("Players with no matches should have no wins "
+                             "and no OMW.")
+    try:
+        tiebreakStandings(tourney_id, ("rating",))
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown tiebreak should raise a ValueError.")
+    print "20. Tiebreakers are computed for the whole standings at once."
+
+
+def testStreaming():
+    deleteTournaments()
+    tourney_id = createTournament("Streamed Tourney")
+    ids = registerPlayers(tourney_id, ["Player %d" % i for i in range(7)])
+    for round_number in range(3):
+        reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                   in swissPairings(tourney_id)])
+    standings = playerStandings(tourney_id)
+    streamed = []
+    for row in iterStandings(tourney_id, fetch_size=2):
+        # Other calls on the same thread share the stream's connection.
+        if countPlayers(tourney_id) != 7:
+            raise ValueError("Calls made while streaming should still work.")
+        streamed.append(row)
+    if streamed != standings:
+        raise ValueError("iterStandings should stream playerStandings.")
+    if list(iterMatches(tourney_id, fetch_size=3)) != getMatches(tourney_id):
+        raise ValueError("iterMatches should stream getMatches.")
+    if (list(iterPlayers(tourney_id, fetch_size=2)) !=
+            sorted((row[0], row[1]) for row in standings)):
+        raise ValueError("iterPlayers should stream the players by id.")
+    # Two streams read in turn on one thread, the first finishing first
+    rows = iterStandings(tourney_id, fetch_size=1)
+    matches = iterMatches(tourney_id, fetch_size=1)
+    interleaved = [next(rows), next(matches)]
+    interleaved.extend(rows)
+    pool = getattr(getSession(), 'pool', None)
+    if pool is not None and pool.stats()['in_use'] != 1:
+        raise ValueError("A stream still being read should keep its "
+                         "connection.")
+    if ([next(matches)] + list(matches) != getMatches(tourney_id)[1:] or
+            interleaved[:1] + interleaved[2:] != standings):
+        raise ValueError("Interleaved streams should each read every row.")
+    if pool is not None and pool.stats()['in_use'] != 0:
+        raise ValueError("The last stream to finish should give its "
+                         "connection back.")
+    out = io.BytesIO()
+    if exportStandings(tourney_id, out, fetch_size=2) != 7:
+        raise ValueError("exportStandings should return the rows written.")
+    lines = list(csv.reader(io.BytesIO(out.getvalue())))
+    if (lines[0] != ["id", "name", "wins", "matches", "omw"] or
+            lines[1:] != [[str(value) for value in row] for row in standings]):
+        raise ValueError("exportStandings should write CSV with a header.")
+    out = io.BytesIO()
+    exportMatches(tourney_id, out, format='jsonl')
+    matches = [json.loads(line) for line in out.getvalue().splitlines()]
+    if ([(m["winner"], m["loser"]) for m in matches] !=
+            [tuple(match) for match in getMatches(tourney_id)]):
+        raise ValueError("exportMatches should write one match per line.")
+    try:
+        exportPlayers(tourney_id, io.BytesIO(), format='xml')
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown export format should raise a "
+                         "ValueError.")
+    print "21. Standings, matches and players can be streamed and exported."
+
+
+def testPairingState():
+    deleteTournaments()
+    tourney_id = createTournament("Stateful Tourney")
+    registerPlayers(tourney_id, ["Player %d" % i for i in range(9)])
+    before = pairingStateStats()
+    for round_number in range(3):
+        pairings = swissPairings(tourney_id)
+        reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                   in pairings])
+    after = pairingStateStats()
+    if after['rebuilds'] != before['rebuilds']:
+        raise ValueError("Pairing should not rebuild the state every round.")
+    # Each round applies the matches of the round before it and its bye.
+    if after['applied'] - before['applied'] != len(getMatches(tourney_id)) - 5:
+        raise ValueError("Pairing should only apply the matches since the "
+                         "last round.")
+    if checkPairingState(tourney_id) != []:
+        raise ValueError("The pairing state should agree with the matches.")
+    player1, player2 = [row[0] for row in playerStandings(tourney_id)[:2]]
+    session = getSession()
+    with session.pairingState(tourney_id) as state:
+        state.graph.addMatch(player1, player2)
+    if (checkPairingState(tourney_id) !=
+            sorted([('opponents', player1), ('opponents', player2)])):
+        raise ValueError("checkPairingState should report the players whose "
+                         "opponents differ.")
+    if checkPairingState(tourney_id) != []:
+        raise ValueError("checkPairingState should repair the state.")
+    with session.pairingState(tourney_id) as state:
+        state.matches += 1
+    rebuilds = pairingStateStats()['rebuilds']
+    swissPairings(tourney_id)
+    if pairingStateStats()['rebuilds'] != rebuilds + 1:
+        raise ValueError("A state whose match count is wrong should be "
+                         "rebuilt.")
+    deleteMatches(tourney_id)
+    if len(swissPairings(tourney_id)) != 4:
+        raise ValueError("Deleting matches should reset the pairing state.")
+    print "22. Pairing state is kept between rounds and can be checked."
+
+
+def testArchive():
+    deleteTournaments()
+    kept = createTournament("Kept Tourney")
+    finished = createTournament("Finished Tourney")
+    deleted = createTournament("Deleted Tourney")
+    for tourney_id in (kept, finished, deleted):
+        registerPlayers(tourney_id, ["Player %d" % i for i in range(5)])
+        for round_number in range(2):
+            reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                       in swissPairings(tourney_id)])
+    kept_standings = playerStandings(kept)
+    final_standings = playerStandings(finished)
+    if archiveTournament(finished) != len(getMatches(kept)):
+        raise ValueError("archiveTournament should return the number of "
+                         "matches archived.")
+    if archivedStandings(finished) != final_standings:
+        raise ValueError("archivedStandings should return the standings as "
+                         "they were when archived.")
+    deleteTournament(deleted)
+    for tourney_id in (finished, deleted):
+        if playerStandings(tourney_id) or getMatches(tourney_id):
+            raise ValueError("Archived and deleted tournaments should leave "
+                             "no standings or matches.")
+    if playerStandings(kept) != kept_standings:
+        raise ValueError("Archiving and deleting a tournament should not "
+                         "change the others.")
+    if archivedStandings(deleted) != []:
+        raise ValueError("A deleted tournament should not be archived.")
+    try:
+        archiveTournament(finished)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Archiving a tournament twice should raise a "
+                         "ValueError.")
+    deleteTournaments()
+    if archivedStandings(finished) != []:
+        raise ValueError("deleteTournaments should empty the archive.")
+    print "23. Tournaments can be deleted and archived one at a time."
+
+
+def testPreparedStatements():
+    deleteTournaments()
+    tourney_id = createTournament("Prepared Tourney")
+    registerPlayers(tourney_id, ["Player %d" % i for i in range(7)])
+    for round_number in range(3):
+        reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                   in swissPairings(tourney_id)])
+    session = getSession()
+    registry = getattr(session, 'statements', None)
+    player_ids = [row[0] for row in playerStandings(tourney_id)]
+
+    def answers():
+        return ([(hasBye(tourney_id, p), getOpponentMatchWins(tourney_id, p),
+                  numberOfMatchesPlayed(tourney_id, p, player_ids[0]))
+                 for p in player_ids], getMatches(tourney_id))
+    prepared = answers()
+    if registry is not None:
+        session.statements = None
+        try:
+            unprepared = answers()
+        finally:
+            session.statements = registry
+        if prepared != unprepared:
+            raise ValueError("Prepared statements should return the same "
+                             "results as the queries they stand in for.")
+        with session.cursor() as c:
+            # Like a new connection, with nothing prepared yet
+            c.execute("DEALLOCATE ALL")
+            registry.forget(c.connection)
+            hasBye(tourney_id, player_ids[0])
+            hasBye(tourney_id, player_ids[1])
+            if registry.prepared(c.connection) != set(['tournament_byes']):
+                raise ValueError("A connection should prepare a statement "
+                                 "once, when it first runs it.")
+        with session.cursor() as c:
+            # The statements are still on the server, and are read from it
+            registry.forget(c.connection)
+        if answers() != prepared:
+            raise ValueError("A connection should not prepare a statement "
+                             "it already has.")
+        with session.cursor() as c:
+            c.execute("DEALLOCATE ALL")
+        # The first statement of its transaction, on the same connection
+        if answers() != prepared:
+            raise ValueError("Statements should be prepared again after "
+                             "the server drops them.")
+        try:
+            with session.cursor() as c:
+                c.execute("DEALLOCATE ALL")
+                hasBye(tourney_id, player_ids[0])
+        except psycopg2.Error:
+            pass
+        else:
+            raise ValueError("A statement dropped part way through a "
+                             "transaction should fail.")
+        if answers() != prepared:
+            raise ValueError("The next transaction should prepare the "
+                             "statement again.")
+    print "24. The hot queries run as prepared statements."
+
+
+def testExternalIds():
+    deleteTournaments()
+    first = createTournament("First Open")
+    second = createTournament("Second Open")
+    ann, bob, cid = registerPlayers(first, ["Ann", "Bob", "Cid"],
+                                    ["A-1", "B-2", None])
+    if registerPlayer(second, "Ann Smith", "A-1") != ann:
+        raise ValueError("Registering an external id again should link to "
+                         "the same player.")
+    bob2, dee = registerPlayers(second, ["Bob", "Dee"], ["B-2", "D-4"])
+    if bob2 != bob or dee in (ann, bob, cid):
+        raise ValueError("registerPlayers should link known external ids "
+                         "and add the others.")
+    if countPlayers() != 4:
+        raise ValueError("Linked players should not be added again.")
+    if (findPlayers(["A-1", "D-4", "X-9"]) !=
+            {"A-1": (ann, "Ann Smith"), "D-4": (dee, "Dee")}):
+        raise ValueError("findPlayers should return the id and latest name "
+                         "of each known external id.")
+    try:
+        registerPlayer(second, "Ann", "A-1")
+    except (ValueError, psycopg2.Error, sqlite3.Error):
+        pass
+    else:
+        raise ValueError("A player should not be registered twice in one "
+                         "tournament.")
+    try:
+        registerPlayers(second, ["Eve", "Fay"], ["E-5"])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("registerPlayers should need an external id (or "
+                         "None) for every name.")
+    reportMatch(first, ann, bob)
+    reportMatch(second, ann, bob)
+    archiveTournament(first)
+    if playerHistory(bob) != [(first, 0, 1, 1), (second, 0, 1, 1)]:
+        raise ValueError("playerHistory should list a player's live and "
+                         "archived tournaments.")
+    print "25. Players registered under an external id are linked."
+
+
+class UnreachableReplica(object):
+    """A replica whose server cannot be reached."""
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            raise psycopg2.OperationalError("could not connect to server")
+        return call
+
+    def close(self):
+        pass
+
+
+def testReadReplicas():
+    deleteTournaments()
+    primary = getSession()
+    # The primary stands in for its own replica.
+    routed = RoutingSession(primary, [UnreachableReplica(), primary],
+                            read_your_writes=60)
+    setSession(routed)
+    try:
+        tourney_id = createTournament("Replicated Tourney")
+        player_ids = registerPlayers(tourney_id, ["Player %d" % i
+                                                  for i in range(4)])
+        standings = playerStandings(tourney_id)
+        if routingStats()['fresh_reads'] != 1:
+            raise ValueError("A tournament just changed should be read from "
+                             "the primary.")
+        routed.read_your_writes = 0
+        for player_id in player_ids:
+            hasBye(tourney_id, player_id)
+        for attempt in range(3):
+            if playerStandings(tourney_id) != standings:
+                raise ValueError("A replica should return the primary's "
+                                 "standings.")
+        if routingStats()['replica_reads'] != [0, 6]:
+            raise ValueError("Standings read from a replica should not be "
+                             "cached, so every read reaches a replica.")
+        if list(iterStandings(tourney_id)) != standings:
+            raise ValueError("Streams should be read from replicas too.")
+        counters = routingStats()
+        if counters['fallbacks'] != 1 or counters['replica_reads'] != [0, 7]:
+            raise ValueError("A failed replica should be skipped and the "
+                             "reads spread over the others.")
+        routed.replicas[1] = UnreachableReplica()
+        if countPlayers(tourney_id) != 4:
+            raise ValueError("Reads should fall back to the primary when "
+                             "no replica can be reached.")
+        pairings = swissPairings(tourney_id)
+        reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                   in pairings])
+        if routingStats()['fallbacks'] != 2:
+            raise ValueError("Pairing should read from the primary.")
+    finally:
+        setSession(primary)
+    if not isinstance(primary, RoutingSession) and routingStats() is not None:
+        raise ValueError("A session without replicas has no routing stats.")
+    print "26. Reads can be routed to replicas."
+
+
+def testStandingsFeed():
+    deleteTournaments()
+    watched = createTournament("Watched Tourney")
+    other = createTournament("Other Tourney")
+    ann, bob, cid = registerPlayers(watched, ["Ann", "Bob", "Cid"])
+    registerPlayers(other, ["Dee", "Eve"])
+    feed = watchStandings([watched])
+    try:
+        if feed.poll(0.01) != []:
+            raise ValueError("A new feed should have no changes.")
+        reportMatch(watched, cid, ann)
+        changes = feed.poll(5)
+        if changes != [(watched, [(cid, "Cid", 1, 1, 0, 1, 3),
+                                  (ann, "Ann", 0, 1, 1, 2, 1),
+                                  (bob, "Bob", 0, 0, 0, 3, 2)])]:
+            raise ValueError("The feed should send the changed players with "
+                             "their rank moves.")
+        reportMatch(other, *[row[0] for row in playerStandings(other)])
+        reportMatch(watched, bob, 0)
+        changes = feed.poll(5)
+        if changes != [(watched, [(bob, "Bob", 1, 1, 0, 1, 3),
+                                  (cid, "Cid", 1, 1, 0, 2, 1),
+                                  (ann, "Ann", 0, 1, 1, 3, 2)])]:
+            raise ValueError("The feed should only send the tournaments it "
+                             "follows.")
+        deleteTournament(watched)
+        changes = feed.poll(5)
+        if [delta.rank for delta in changes[0][1]] != [None] * 3:
+            raise ValueError("The feed should send the players removed.")
+    finally:
+        feed.close()
+    print "27. Standings changes are fed to subscribers."
+
+
+def testWhatIfPairings():
+    deleteTournaments()
+    tourney_id = createTournament("What If Tourney")
+    registerPlayers(tourney_id, ["Ann", "Bob", "Cid", "Dee", "Eve", "Fay",
+                                 "Gus"])
+    pairings = swissPairings(tourney_id)
+    reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2) in pairings])
+    this_round = startRound(tourney_id)
+    pairings = pairRound(this_round)
+    submitResults(this_round, [(pairings[0][2], pairings[0][0])])
+    planner = planPairings(tourney_id)
+    scenarios = [this_round.results() +
+                 [(p[i], p[2 - i]) for p in pairings[1:]] for i in (0, 2)]
+    plans = [planner.plan(results) for results in scenarios]
+    if previewPairings(tourney_id, scenarios[1]) != plans[1]:
+        raise ValueError("previewPairings should plan as the planner does.")
+    if len(getMatches(tourney_id)) != 4:
+        raise ValueError("Planning should not record results or a bye.")
+    try:
+        planner.plan([(pairings[0][0], -1)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A result for an unknown player should be refused.")
+    submitResults(this_round, scenarios[1][2:])
+    closeRound(this_round)
+    if planner.standings(scenarios[1]) != playerStandings(tourney_id):
+        raise ValueError("The planner should work out the standings.")
+    if planPairings(tourney_id).plan() != plans[1]:
+        raise ValueError("The planner should pair as if the results were "
+                         "reported.")
+    bye = plans[1][0]
+    if swissPairings(tourney_id) != plans[1][1] or not hasBye(tourney_id, bye):
+        raise ValueError("swissPairings should pair as the planner did.")
+    print "28. Pairings can be planned for hypothetical results."
+
+
+def testSnapshots():
+    deleteTournaments()
+    tourney_id = createTournament("Saved Tourney")
+    registerPlayers(tourney_id, ["Ann", "Bob", "Cid", "Dee", "Eve"],
+                    ["FED-1", None, "FED-3", None, None])
+    for round_number in range(2):
+        reportMatches(tourney_id, [(id1, id2) for (id1, n1, id2, n2)
+                                   in swissPairings(tourney_id)])
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "saved.snapshot")
+    try:
+        if saveSnapshot(tourney_id, path, "Saved Tourney") != (5, 6):
+            raise ValueError("Every player and match should be saved.")
+        with openSnapshot(path) as saved:
+            if (saved.tournament_id, saved.name) != (tourney_id,
+                                                     "Saved Tourney"):
+                raise ValueError("The snapshot should keep the tournament.")
+            if saved.matches() != getMatches(tourney_id):
+                raise ValueError("The snapshot should keep every match.")
+            if (dict(zip(saved.names(), saved.externalIds())) !=
+                    {"Ann": "FED-1", "Bob": None, "Cid": "FED-3",
+                     "Dee": None, "Eve": None}):
+                raise ValueError("The snapshot should keep external ids.")
+            if saved.standings() != playerStandings(tourney_id):
+                raise ValueError("Standings should be worked out from the "
+                                 "snapshot's arrays.")
+            planned = planPairings(tourney_id).plan()
+            if (saved.pairings() != planned or
+                    saved.planner().plan() != planned):
+                raise ValueError("A snapshot should be paired as the "
+                                 "tournament is.")
+        restored = restoreSnapshot(path, "Restored Tourney")
+        # Players linked by external id keep their ids, so ties may fall
+        # in another order
+        if (sorted(row[1:] for row in playerStandings(restored)) !=
+                sorted(row[1:] for row in playerStandings(tourney_id))):
+            raise ValueError("A restored tournament should have the same "
+                             "standings.")
+        linked = findPlayers(["FED-1", "FED-3"])
+        if (sorted(player_id for (player_id, name, external_id) in
+                   iterPlayers(restored, external_ids=True) if external_id) !=
+                sorted(player_id for (player_id, name) in linked.values())):
+            raise ValueError("Restored players should keep their external "
+                             "ids.")
+        blocked = os.path.join(directory, "blocked")
+        os.mkdir(blocked)
+        open(os.path.join(blocked, "in the way"), "w").close()
+        try:
+            saveSnapshot(tourney_id, blocked)
+        except (OSError, IOError):
+            pass
+        else:
+            raise ValueError("Saving over a directory should fail.")
+        if os.path.exists(blocked + ".tmp"):
+            raise ValueError("A failed save should remove its temporary "
+                             "file.")
+        with open(path, 'r+b') as f:
+            f.truncate(40)
+        try:
+            openSnapshot(path)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("A damaged snapshot should be refused.")
+    finally:
+        shutil.rmtree(directory)
+    print "29. Tournaments can be saved to and restored from snapshots."
+
+
+def testConcurrentReports():
+    deleteTournaments()
+    tourney_id = createTournament("Busy Tourney")
+    player_ids = registerPlayers(tourney_id, ["Player %d" % i
+                                              for i in range(8)])
+    errors = []
+
+    def report(offset):
+        try:
+            # Every thread's winners beat the same players at the same time
+            for i in range(40):
+                winner = player_ids[(offset + i) % len(player_ids)]
+                loser = player_ids[(offset + i + 1 + i % 3) % len(player_ids)]
+                reportMatch(tourney_id, winner, loser)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=report, args=(offset,))
+               for offset in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    if rebuildStandings(tourney_id):
+        raise ValueError("Matches reported at the same time should keep the "
+                         "standings correct.")
+    print "30. Matches can be reported concurrently."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -284,4 +1044,22 @@ if __name__ == '__main__':
     testBye()
     testOpponentMatchWins()
     testMultipleTournaments()
+    testStandingsOpponentMatchWins()
+    testMatchingPairings()
+    testBulkRegisterAndReport()
+    testStandingsCache()
+    testInstrumentation()
+    testRounds()
+    testSwissPairingsMany()
+    testTiebreaks()
+    testStreaming()
+    testPairingState()
+    testArchive()
+    testPreparedStatements()
+    testExternalIds()
+    testReadReplicas()
+    testStandingsFeed()
+    testWhatIfPairings()
+    testSnapshots()
+    testConcurrentReports()
     print "Success!  All tests pass!"
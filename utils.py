@@ -4,18 +4,113 @@
 #
 
 
-def tuple_without(original_tuple, element_to_remove):
-    """Removes an element from a tuple.
-
-    This function was found online:
-    http://www.markhneedham.com/blog/2013/01/27/python-conceptually-
-    removing-an-item-from-a-tuple/
+class PlayerRecord(object):
+    """One player's row of the standings, linked to its neighbours.
 
     Args:
-      original_tuple: the complete tuple
-      element_to_remove: the element of the tuple to remove
+      id:  the player's unique id
+      name:  the player's full name
+      wins:  the number of matches the player has won
+      matches:  the number of matches the player has played
+      omw:  the number of matches the player's opponents have won
+    """
+
+    __slots__ = ('id', 'name', 'wins', 'matches', 'omw', 'prev', 'next')
+
+    def __init__(self, id, name, wins, matches, omw):
+        self.id = id
+        self.name = name
+        self.wins = wins
+        self.matches = matches
+        self.omw = omw
+        self.prev = None
+        self.next = None
+
+    def row(self):
+        """Returns the record as a playerStandings() tuple."""
+        return (self.id, self.name, self.wins, self.matches, self.omw)
+
 
-    Returns:
-      The tuple minus the element to remove
+class StandingsPool(object):
+    """The players still waiting to be paired, in standings order.
+
+    A doubly linked list of PlayerRecords with an index by player id, so a
+    player can be removed from anywhere in the standings in constant time
+    without copying the rest of the list.
+
+    Args:
+      standings:  playerStandings() tuples, in standings order
     """
-    return filter(lambda el: el != element_to_remove, original_tuple)
+
+    def __init__(self, standings=()):
+        self._records = {}
+        self._head = None
+        self._tail = None
+        for row in standings:
+            self.append(PlayerRecord(*row))
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, player_id):
+        return player_id in self._records
+
+    def __iter__(self):
+        """Yields the PlayerRecords in standings order.
+
+        The record being visited may be removed during iteration.
+        """
+        record = self._head
+        while record is not None:
+            following = record.next
+            yield record
+            record = following
+
+    def append(self, record):
+        """Adds a PlayerRecord at the bottom of the standings."""
+        if record.id in self._records:
+            raise ValueError("Player %s is already in the pool." % record.id)
+        record.prev = self._tail
+        record.next = None
+        if self._tail is None:
+            self._head = record
+        else:
+            self._tail.next = record
+        self._tail = record
+        self._records[record.id] = record
+
+    def get(self, player_id):
+        """Returns the PlayerRecord for a player id, or None."""
+        return self._records.get(player_id)
+
+    def first(self):
+        """Returns the PlayerRecord at the top of the standings, or None."""
+        return self._head
+
+    def remove(self, player_id):
+        """Removes a player from the pool and returns their PlayerRecord.
+
+        Raises:
+          KeyError:  if the player is not in the pool
+        """
+        record = self._records.pop(player_id)
+        if record.prev is None:
+            self._head = record.next
+        else:
+            record.prev.next = record.next
+        if record.next is None:
+            self._tail = record.prev
+        else:
+            record.next.prev = record.prev
+        record.prev = record.next = None
+        return record
+
+    def popFirst(self):
+        """Removes and returns the PlayerRecord at the top of the standings.
+
+        Raises:
+          KeyError:  if the pool is empty
+        """
+        if self._head is None:
+            raise KeyError("The pool is empty.")
+        return self.remove(self._head.id)